@@ -1,6 +1,16 @@
 import os
+import json
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+import numpy as np
 import pandas as pd
+import matplotlib
+matplotlib.use('Agg')  # charts are only written to files, never shown
 import matplotlib.pyplot as plt
+from matplotlib.backends.backend_pdf import PdfPages
+
+import instrument
 
 race_years = {
     "Pres": [2008, 2012, 2016, 2020, 2024],
@@ -8,20 +18,49 @@ race_years = {
     "Sen":  [2008, 2010, 2014, 2016, 2020, 2022],
 }
 races = list(race_years.keys())
+districts = list(range(1, 15))
+PARTIES = ['Dem', 'Rep', 'Oth']
+CACHE_FILE = 'realignment_table.parquet'
+PDF_FILE = 'district_trends.pdf'
+SPRITE_FILE = 'district_trends_sprite.png'
+
+# The figure this process draws every chart on (see chart_figure)
+_chart = None
+
+def chart_figure():
+    """Create this process's chart figure on first use and return (figure, axes, dem line, rep line, title).
+
+    Every chart has the same size, styling and axes, so one figure is reused
+    and only the line data, x range and title change between charts.
+    """
+    global _chart
+    if _chart is None:
+        fig, ax = plt.subplots(figsize=(8, 5))
+        dem_line, = ax.plot([], [], marker='o', label="Democrat", color='blue', linewidth=2)
+        rep_line, = ax.plot([], [], marker='o', label="Republican", color='red', linewidth=2)
+        title = ax.set_title("", fontsize=14)
+        ax.set_xlabel("Year", fontsize=12)
+        ax.set_ylabel("Vote %", fontsize=12)
+        ax.set_ylim(0, 1)
+        ax.grid(True, linestyle='--', alpha=0.5)
+        ax.legend()
+        _chart = (fig, ax, dem_line, rep_line, title)
+    return _chart
+
+def draw_trends(years, dem_percents, rep_percents, title):
+    fig, ax, dem_line, rep_line, title_text = chart_figure()
+    # Missing results (None/NaN) leave gaps in the lines
+    dem_line.set_data(years, np.asarray(dem_percents, dtype=float))
+    rep_line.set_data(years, np.asarray(rep_percents, dtype=float))
+    margin = max((max(years) - min(years)) * 0.05, 0.5)
+    ax.set_xlim(min(years) - margin, max(years) + margin)
+    title_text.set_text(title)
+    fig.tight_layout()
+    return fig
 
 def plot_trends(years, dem_percents, rep_percents, title, filename):
-    plt.figure(figsize=(8, 5))
-    plt.plot(years, dem_percents, marker='o', label="Democrat", color='blue', linewidth=2)
-    plt.plot(years, rep_percents, marker='o', label="Republican", color='red', linewidth=2)
-    plt.title(title, fontsize=14)
-    plt.xlabel("Year", fontsize=12)
-    plt.ylabel("Vote %", fontsize=12)
-    plt.ylim(0, 1)
-    plt.grid(True, linestyle='--', alpha=0.5)
-    plt.legend()
-    plt.tight_layout()
-    plt.savefig(filename)
-    plt.close()
+    fig = draw_trends(years, dem_percents, rep_percents, title)
+    fig.savefig(filename)
     print(f"Saved {filename}")
 
 def find_election_file(year, race, missing_files_reported):
@@ -70,25 +109,170 @@ def standardize_columns(df):
             df[party] = pd.to_numeric(df[party], errors='coerce')
     return df
 
-missing_files_reported = set()
-for race in races:
-    years = race_years[race]
-    for district_num in range(1, 15):
-        dem_percents = []
-        rep_percents = []
-        for year in years:
+def load_race_file(filename, race, year):
+    """Read one race-year CSV and return its district rows as (race, district, year, Dem, Rep, Oth)"""
+    df = standardize_columns(pd.read_csv(filename))
+    df = df.assign(ID=df["ID"].astype(str).str.strip())
+    # Same matching as before: first row whose ID equals the district number
+    df = df[df["ID"].isin([str(district) for district in districts])].drop_duplicates("ID")
+    table = pd.DataFrame({
+        "race": race,
+        "district": df["ID"].astype(int),
+        "year": year,
+    })
+    for party in PARTIES:
+        table[party] = df[party] if party in df.columns else float('nan')
+    return table
+
+def find_race_files(missing_files_reported):
+    """{(race, year): filename} for every race-year file that exists"""
+    files = {}
+    for race in races:
+        for year in race_years[race]:
             filename = find_election_file(year, race, missing_files_reported)
-            if not filename:
-                dem_percents.append(None)
-                rep_percents.append(None)
-                continue
-            df = pd.read_csv(filename)
-            df = standardize_columns(df)
-            row = df[df["ID"].astype(str) == str(district_num)]
-            if not row.empty:
-                dem_percents.append(row["Dem"].values[0])
-                rep_percents.append(row["Rep"].values[0])
-            else:
-                dem_percents.append(None)
-                rep_percents.append(None)
-        plot_trends(years, dem_percents, rep_percents, f"NC-{district_num} {race} Results", f"NC-{district_num}_{race}_trend.png")
+            if filename:
+                files[(race, year)] = filename
+    return files
+
+def build_district_table(files):
+    """One race x district x year table of party shares, reading each CSV exactly once"""
+    frames = [load_race_file(filename, race, year) for (race, year), filename in files.items()]
+    print(f"Read {len(frames)} CSV files")
+    if not frames:
+        return pd.DataFrame(columns=PARTIES, index=pd.MultiIndex.from_tuples([], names=["race", "district", "year"]))
+    return pd.concat(frames, ignore_index=True).set_index(["race", "district", "year"]).sort_index()
+
+def cache_key(files):
+    """Identifies the inputs of a cached table: the source files and their modification times"""
+    return {
+        "race_years": race_years,
+        "sources": {f"{race}_{year}": [filename, os.stat(filename).st_mtime_ns]
+                    for (race, year), filename in sorted(files.items())},
+    }
+
+def write_table(table, path):
+    if path.endswith('.feather'):
+        table.reset_index().to_feather(path)
+    else:
+        table.to_parquet(path)
+
+def read_table(path):
+    if path.endswith('.feather'):
+        return pd.read_feather(path).set_index(["race", "district", "year"])
+    return pd.read_parquet(path)
+
+def load_district_table(cache_file=CACHE_FILE):
+    """Return the district table, reusing the Parquet/Feather cache (with its
+    ``.json`` key file) when no CSV has been added, removed or modified since it was written"""
+    missing_files_reported = set()
+    files = find_race_files(missing_files_reported)
+    key = cache_key(files)
+    key_file = cache_file + '.json' if cache_file else None
+
+    if cache_file and os.path.exists(cache_file) and os.path.exists(key_file):
+        with open(key_file, 'r', encoding='utf-8') as f:
+            cached_key = json.load(f)
+        if cached_key == json.loads(json.dumps(key)):
+            print(f"Using cached table {cache_file}")
+            return read_table(cache_file)
+
+    table = build_district_table(files)
+    if cache_file:
+        try:
+            write_table(table, cache_file)
+        except ImportError as e:
+            print(f"Not caching the table ({e})")
+        else:
+            with open(key_file, 'w', encoding='utf-8') as f:
+                json.dump(key, f, indent=2)
+            print(f"Saved {cache_file}")
+    return table
+
+def district_series(table, race, district):
+    """Dem and Rep shares for every year of the race, NaN where no result exists"""
+    years = race_years[race]
+    index = pd.MultiIndex.from_product([[race], [district], years])
+    rows = table.reindex(index)
+    return years, rows["Dem"].tolist(), rows["Rep"].tolist()
+
+def chart_specs(table):
+    """(years, dem %, rep %, title, filename) for every race and district"""
+    charts = []
+    for race in races:
+        for district_num in districts:
+            years, dem_percents, rep_percents = district_series(table, race, district_num)
+            charts.append((years, dem_percents, rep_percents, f"NC-{district_num} {race} Results", f"NC-{district_num}_{race}_trend.png"))
+    return charts
+
+def render_chart(chart, image=False):
+    """Draw one chart on this process's figure; save it as a PNG, or return its RGBA pixels if ``image``"""
+    years, dem_percents, rep_percents, title, filename = chart
+    if not image:
+        plot_trends(years, dem_percents, rep_percents, title, filename)
+        return None
+    fig = draw_trends(years, dem_percents, rep_percents, title)
+    fig.canvas.draw()
+    return np.asarray(fig.canvas.buffer_rgba()).copy()
+
+def map_charts(func, charts, workers=1):
+    """Apply ``func`` to every chart, in a process pool when ``workers`` > 1 (each worker keeps its own figure)"""
+    if workers <= 1:
+        return [func(chart) for chart in charts]
+    chunksize = max(1, len(charts) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(func, charts, chunksize=chunksize))
+
+def write_pdf(charts, pdf_file=PDF_FILE):
+    """All charts as pages of one PDF. PdfPages writes from a single process, so pages are drawn here in order."""
+    with PdfPages(pdf_file) as pdf:
+        for years, dem_percents, rep_percents, title, _ in charts:
+            pdf.savefig(draw_trends(years, dem_percents, rep_percents, title))
+    print(f"Saved {pdf_file} ({len(charts)} pages)")
+
+def write_sprite(charts, workers=1, sprite_file=SPRITE_FILE, columns=None):
+    """All charts tiled into one PNG (one row per race by default), plus a JSON index of each chart's position"""
+    images = map_charts(partial(render_chart, image=True), charts, workers)
+    columns = columns or len(districts)
+    rows = -(-len(images) // columns)
+    height, width = images[0].shape[:2]
+    sheet = np.full((rows * height, columns * width, 4), 255, dtype=np.uint8)
+    positions = {}
+    for i, (image, chart) in enumerate(zip(images, charts)):
+        y, x = (i // columns) * height, (i % columns) * width
+        sheet[y:y + height, x:x + width] = image
+        positions[os.path.splitext(chart[4])[0]] = {'x': x, 'y': y, 'width': width, 'height': height}
+    plt.imsave(sprite_file, sheet)
+    with open(os.path.splitext(sprite_file)[0] + '.json', 'w', encoding='utf-8') as f:
+        json.dump(positions, f, indent=2)
+    print(f"Saved {sprite_file} ({len(images)} charts)")
+
+def plot_all(table, workers=1, output='png'):
+    charts = chart_specs(table)
+    if output == 'pdf':
+        write_pdf(charts)
+    elif output == 'sprite':
+        write_sprite(charts, workers)
+    else:
+        map_charts(render_chart, charts, workers)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Plot district-level party trends for each race')
+    parser.add_argument('--cache', default=CACHE_FILE,
+                        help='Parquet (or .feather) file for the district table (default: %(default)s)')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='Always rebuild the table from the CSV files and do not save it')
+    parser.add_argument('--output', choices=['png', 'pdf', 'sprite'], default='png',
+                        help=f'One PNG per chart, a multi-page {PDF_FILE}, or a {SPRITE_FILE} sprite sheet (default: png)')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Number of processes rendering charts (default: 1, 0 = one per CPU core)')
+    instrument.add_arguments(parser)
+    args = parser.parse_args()
+    if args.workers == 0:
+        args.workers = os.cpu_count() or 1
+    
+    with instrument.run('NCRealignmentTracker', args):
+        with instrument.stage('load_table') as stage:
+            table = load_district_table(None if args.no_cache else args.cache)
+            stage.count('rows', len(table))
+        with instrument.stage('plot'):
+            plot_all(table, workers=args.workers, output=args.output)
@@ -0,0 +1,397 @@
+"""
+Benchmark harness for the data / geometry build pipeline.
+
+Generates synthetic precinct results (comprehensive JSON format) and
+synthetic precinct polygons at NC scale and multiples of it, then times the
+pipeline stages on them: parse, transform, simplify, split, compress and
+write, plus the end-to-end scripts (optimize_data, optimize_split_data,
+optimize_geojson, optimize_split_geojson, build_topojson).
+
+Every stage records wall time, CPU time and peak RSS. On Linux the peak is
+reset before each stage through /proc/self/clear_refs, so it is the stage's
+own high-water mark; elsewhere it falls back to the process-wide maximum.
+Results are written as JSON, and ``--compare`` flags stages that got slower
+than a previous run by more than ``--threshold``.
+
+Runs offline: everything is generated locally from a fixed seed.
+"""
+
+import os
+import sys
+import json
+import gzip
+import math
+import time
+import argparse
+import platform
+import tempfile
+import contextlib
+from datetime import datetime, timezone
+
+import numpy as np
+import shapely
+from shapely.geometry import mapping
+
+from competitiveness import build_scale, classify, competitiveness_objects
+import optimize_data
+import optimize_split_data
+import optimize_geojson
+import optimize_split_geojson
+import build_topojson
+import geometry_cache
+from instrument import reset_peak_rss, peak_rss_mb, path_size
+
+# Roughly the 2024 NC precinct count and state bounding box
+NC_PRECINCTS = 2660
+NC_COUNTIES = 100
+NC_BOUNDS = (-84.32, 33.84, -75.46, 36.59)
+
+YEARS = ['2008', '2010', '2012', '2014', '2016', '2018', '2020', '2022', '2024']
+CONTEST_TYPES = ['president', 'us_senate', 'governor', 'lieutenant_governor', 'attorney_general',
+                 'secretary_of_state', 'auditor', 'treasurer', 'commissioner_of_agriculture']
+
+
+# --- Measurement -----------------------------------------------------------
+
+def measure(stages, name, func, *args, output=None, quiet=True, **kwargs):
+    """Run one stage, append its timings to ``stages`` and return its result.
+
+    ``output`` is a path whose size is recorded as the stage's output bytes;
+    a bytes/str result is measured directly.
+    """
+    reset_peak_rss()
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull if quiet else sys.stdout):
+        result = func(*args, **kwargs)
+    seconds = time.perf_counter() - wall_start
+    cpu_seconds = time.process_time() - cpu_start
+
+    stage = {
+        'name': name,
+        'seconds': round(seconds, 4),
+        'cpu_seconds': round(cpu_seconds, 4),
+        'peak_rss_mb': round(peak_rss_mb(), 1)
+    }
+    if output is not None:
+        stage['bytes'] = path_size(output)
+    elif isinstance(result, (bytes, str)):
+        stage['bytes'] = len(result)
+    stages.append(stage)
+
+    size = f", {stage['bytes'] / 1024 / 1024:.2f}MB" if 'bytes' in stage else ''
+    print(f"  {name:<28} {seconds:8.3f}s  cpu {cpu_seconds:8.3f}s  peak {stage['peak_rss_mb']:8.1f}MB{size}")
+    return result
+
+
+# --- Synthetic data --------------------------------------------------------
+
+def grid_shape(n_precincts, bounds=NC_BOUNDS):
+    """Grid dimensions with about n_precincts cells and the bounds' aspect ratio"""
+    minx, miny, maxx, maxy = bounds
+    aspect = (maxx - minx) * math.cos(math.radians((miny + maxy) / 2)) / (maxy - miny)
+    nx = max(1, round(math.sqrt(n_precincts * aspect)))
+    ny = max(1, round(n_precincts / nx))
+    return nx, ny
+
+
+def county_of_cell(i, j, nx, ny, n_counties=NC_COUNTIES):
+    """County number for a grid cell: counties are rectangular blocks of cells"""
+    cx, cy = grid_shape(n_counties, (0, 0, nx, ny))
+    return min(i * cx // nx, cx - 1) * cy + min(j * cy // ny, cy - 1)
+
+
+def precinct_key(i, j, nx, ny):
+    return f"COUNTY{county_of_cell(i, j, nx, ny):03d}_{i:04d}_{j:04d}"
+
+
+def synthetic_precincts(n_precincts, edge_vertices=24, seed=0, bounds=NC_BOUNDS):
+    """GeoJSON FeatureCollection of valid, edge-sharing polygons tiling the bounds.
+
+    Cells of a jittered grid; every cell side is a wiggly line shared
+    exactly by the two cells it separates, like real precinct borders.
+    """
+    rng = np.random.default_rng(seed)
+    nx, ny = grid_shape(n_precincts, bounds)
+    minx, miny, maxx, maxy = bounds
+    dx, dy = (maxx - minx) / nx, (maxy - miny) / ny
+
+    gx, gy = np.meshgrid(np.arange(nx + 1, dtype=np.float64), np.arange(ny + 1, dtype=np.float64), indexing='ij')
+    gx[1:-1, :] += rng.uniform(-0.2, 0.2, (nx - 1, ny + 1))
+    gy[:, 1:-1] += rng.uniform(-0.2, 0.2, (nx + 1, ny - 1))
+    corners = np.stack([minx + gx * dx, miny + gy * dy], axis=-1)
+
+    t = np.arange(1, edge_vertices) / edge_vertices
+    envelope = np.sin(np.pi * t)
+
+    def edges(start, end):
+        """Interior points of edges start -> end, wiggled perpendicular to the edge"""
+        direction = end - start
+        normal = np.stack([-direction[..., 1], direction[..., 0]], axis=-1)
+        wiggle = rng.uniform(-0.03, 0.03, start.shape[:-1] + (len(t),)) * envelope
+        return (start[..., None, :] + direction[..., None, :] * t[:, None]
+                + normal[..., None, :] * wiggle[..., None])
+
+    horizontal = edges(corners[:-1, :], corners[1:, :])    # (i, j) -> (i + 1, j)
+    vertical = edges(corners[:, :-1], corners[:, 1:])      # (i, j) -> (i, j + 1)
+
+    features = []
+    for i in range(nx):
+        for j in range(ny):
+            ring = np.concatenate([
+                corners[i, j][None], horizontal[i, j],
+                corners[i + 1, j][None], vertical[i + 1, j],
+                corners[i + 1, j + 1][None], horizontal[i, j + 1][::-1],
+                corners[i, j + 1][None], vertical[i, j][::-1],
+                corners[i, j][None]
+            ])
+            county = county_of_cell(i, j, nx, ny)
+            features.append({
+                'type': 'Feature',
+                'properties': {
+                    'GEOID': f'37{county:03d}{i:04d}{j:04d}',
+                    'PRECINCT': f'{i:04d}_{j:04d}',
+                    'County': f'COUNTY{county:03d}',
+                    'COUNTYFP': f'{county:03d}'
+                },
+                'geometry': {'type': 'Polygon', 'coordinates': [ring.tolist()]}
+            })
+    return {'type': 'FeatureCollection', 'features': features}
+
+
+def synthetic_results(n_precincts, years=3, contests=6, seed=0):
+    """Comprehensive-format results for every grid precinct, with derived fields filled in"""
+    rng = np.random.default_rng(seed)
+    scale = build_scale()
+    nx, ny = grid_shape(n_precincts)
+    keys = [precinct_key(i, j, nx, ny) for i in range(nx) for j in range(ny)]
+    counties = [key.split('_', 1)[0] for key in keys]
+    precincts = [key.split('_', 1)[1] for key in keys]
+    lean = rng.normal(0, 0.25, len(keys))
+
+    results_by_year = {}
+    for year in YEARS[-years:]:
+        year_contests = {}
+        for contest_type in CONTEST_TYPES[:contests]:
+            turnout = rng.integers(200, 4000, len(keys))
+            rep_share = np.clip(0.5 + lean + rng.normal(0, 0.05, len(keys)), 0.02, 0.98)
+            other = (turnout * rng.uniform(0, 0.04, len(keys))).astype(np.int64)
+            rep = ((turnout - other) * rep_share).astype(np.int64)
+            dem = turnout - other - rep
+            derived = classify(dem, rep, scale)
+            objects = competitiveness_objects(derived['category'], scale)
+            contest_name = contest_type.replace('_', ' ').upper()
+
+            columns = [
+                dem.tolist(), rep.tolist(), other.tolist(), turnout.tolist(),
+                derived['two_party_total'].tolist(), derived['margin'].tolist(),
+                derived['margin_pct'].tolist(), derived['winner'].tolist()
+            ]
+            results = {}
+            for row, key in enumerate(keys):
+                d, r, o, total, two_party, margin, margin_pct, winner = (c[row] for c in columns)
+                results[key] = {
+                    'county': counties[row],
+                    'precinct': precincts[row],
+                    'contest': contest_name,
+                    'year': year,
+                    'dem_candidate': f'Democrat {contest_type}',
+                    'rep_candidate': f'Republican {contest_type}',
+                    'dem_votes': d,
+                    'rep_votes': r,
+                    'other_votes': o,
+                    'total_votes': total,
+                    'two_party_total': two_party,
+                    'margin': margin,
+                    'margin_pct': margin_pct,
+                    'winner': winner,
+                    'competitiveness': objects[row],
+                    'all_parties': {'DEM': d, 'REP': r, 'LIB': o}
+                }
+            year_contests[contest_type] = {
+                f'{contest_type}_{year}_1': {
+                    'contest_name': contest_name,
+                    'results': results
+                }
+            }
+        results_by_year[year] = year_contests
+
+    return {
+        'metadata': {
+            'title': 'Synthetic benchmark results',
+            'years_covered': list(results_by_year)
+        },
+        'results_by_year': results_by_year
+    }
+
+
+def write_json(data, path):
+    with open(path, 'w') as f:
+        json.dump(data, f)
+
+
+# --- Stages ----------------------------------------------------------------
+
+def benchmark_results(stages, work_dir, n_precincts, years, contests, seed):
+    input_file = os.path.join(work_dir, 'results.json')
+    data = measure(stages, 'results.generate', synthetic_results, n_precincts, years, contests, seed)
+    measure(stages, 'results.generate_write', write_json, data, input_file, output=input_file)
+    del data
+
+    data = measure(stages, 'results.parse', lambda: json.load(open(input_file)))
+    split = measure(stages, 'results.transform', lambda: {
+        year: optimize_split_data.optimize_year(contests)
+        for year, contests in data['results_by_year'].items()
+    })
+    measure(stages, 'results.compress', lambda: b''.join(
+        gzip.compress(json.dumps(year_data).encode('utf-8'), mtime=0) for year_data in split.values()
+    ))
+    del data, split
+
+    # Build manifests go to the work directory so the repo's .build/ state is never touched
+    split_dir = os.path.join(work_dir, 'split')
+    measure(stages, 'results.split_write', optimize_split_data.optimize_election_data,
+            input_file, split_dir, manifest_dir=os.path.join(work_dir, 'manifest_split'), output=split_dir)
+    stream_dir = os.path.join(work_dir, 'split_stream')
+    measure(stages, 'results.split_stream', optimize_split_data.optimize_election_data,
+            input_file, stream_dir, stream=True, manifest_dir=os.path.join(work_dir, 'manifest_stream'),
+            output=stream_dir)
+    single_file = os.path.join(work_dir, 'election_data.json.gz')
+    measure(stages, 'results.single_file', optimize_data.optimize_election_data,
+            input_file, single_file, output=single_file)
+    return os.path.getsize(input_file)
+
+
+def benchmark_geometry(stages, work_dir, n_precincts, edge_vertices, seed):
+    input_file = os.path.join(work_dir, 'precincts.geojson')
+    collection = measure(stages, 'geometry.generate', synthetic_precincts, n_precincts, edge_vertices, seed)
+    measure(stages, 'geometry.generate_write', write_json, collection, input_file, output=input_file)
+    feature_count = len(collection['features'])
+    del collection
+
+    collection = measure(stages, 'geometry.parse', optimize_split_geojson.read_geojson, input_file)
+    geometries = measure(stages, 'geometry.to_shapely', lambda: shapely.from_geojson(
+        [json.dumps(feature['geometry']) for feature in collection['features']]
+    ))
+    simplified = measure(stages, 'geometry.simplify', shapely.simplify, geometries, 0.0001, preserve_topology=True)
+    measure(stages, 'geometry.compress', lambda: gzip.compress(json.dumps({
+        'type': 'FeatureCollection',
+        'features': [
+            {'type': 'Feature', 'properties': feature['properties'], 'geometry': mapping(geometry)}
+            for feature, geometry in zip(collection['features'], simplified)
+        ]
+    }).encode('utf-8'), mtime=0))
+    del geometries, simplified
+
+    split_dir = os.path.join(work_dir, 'regions')
+    os.makedirs(split_dir, exist_ok=True)
+    measure(stages, 'geometry.split', optimize_split_geojson.split_and_optimize_geojson,
+            collection, split_dir, 'precincts', divisions=3, tolerance=0.0005, output=split_dir)
+    del collection
+
+    cache_file = os.path.join(work_dir, 'precincts.geobin')
+    measure(stages, 'geometry.cache_build', geometry_cache.build_cache, input_file, cache_file, output=cache_file)
+    measure(stages, 'geometry.cache_load', lambda: geometry_cache.geometries(geometry_cache.read_cache(cache_file)))
+
+    topojson_file = os.path.join(work_dir, 'precincts.topojson')
+    measure(stages, 'geometry.topojson', build_topojson.build_topojson,
+            input_file, topojson_file, 'precincts', 0.0005, output=topojson_file)
+    simplified_file = os.path.join(work_dir, 'precincts.json.gz')
+    measure(stages, 'geometry.simplify_write', optimize_geojson.process_file,
+            input_file, simplified_file, 'precincts', cache_file=cache_file, output=simplified_file)
+    return feature_count, os.path.getsize(input_file)
+
+
+def run(scales, years=3, contests=6, edge_vertices=24, seed=0, parts=('results', 'geometry')):
+    report = {
+        'version': '1.0',
+        'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'machine': {
+            'platform': platform.platform(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'shapely': shapely.__version__,
+            'cpu_count': os.cpu_count()
+        },
+        'config': {
+            'years': years,
+            'contests_per_year': contests,
+            'edge_vertices': edge_vertices,
+            'seed': seed
+        },
+        'runs': []
+    }
+
+    for scale in scales:
+        n_precincts = int(NC_PRECINCTS * scale)
+        print(f"\nScale {scale}x ({n_precincts} precincts)")
+        stages = []
+        entry = {'scale': scale, 'precincts': n_precincts, 'stages': stages}
+        with tempfile.TemporaryDirectory(prefix='nc_benchmark_') as work_dir:
+            if 'results' in parts:
+                entry['results_input_bytes'] = benchmark_results(stages, work_dir, n_precincts, years, contests, seed)
+            if 'geometry' in parts:
+                features, size = benchmark_geometry(stages, work_dir, n_precincts, edge_vertices, seed)
+                entry['geometry_features'] = features
+                entry['geometry_input_bytes'] = size
+        report['runs'].append(entry)
+
+    return report
+
+
+def compare(report, baseline, threshold=0.25, min_seconds=0.05):
+    """Print per-stage changes against a previous report; returns the regressions"""
+    previous = {
+        (run['scale'], stage['name']): stage
+        for run in baseline.get('runs', [])
+        for stage in run['stages']
+    }
+    regressions = []
+    print(f"\nCompared with baseline from {baseline.get('created', 'unknown')}:")
+    for run in report['runs']:
+        for stage in run['stages']:
+            old = previous.get((run['scale'], stage['name']))
+            if not old:
+                continue
+            ratio = stage['seconds'] / old['seconds'] if old['seconds'] else float('inf')
+            flag = ''
+            if ratio > 1 + threshold and stage['seconds'] - old['seconds'] > min_seconds:
+                flag = '  REGRESSION'
+                regressions.append({'scale': run['scale'], 'stage': stage['name'],
+                                    'seconds': stage['seconds'], 'baseline_seconds': old['seconds']})
+            print(f"  {run['scale']:>4}x {stage['name']:<28} {old['seconds']:8.3f}s -> {stage['seconds']:8.3f}s "
+                  f"({ratio:5.2f}x){flag}")
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the data and geometry build pipeline on synthetic NC-scale inputs')
+    parser.add_argument('--scales', type=float, nargs='+', default=[1, 10],
+                        help='Multiples of NC precinct count to run (default: 1 10)')
+    parser.add_argument('--years', type=int, default=3, help='Election years per results file (default: 3)')
+    parser.add_argument('--contests', type=int, default=6, help='Contests per year (default: 6)')
+    parser.add_argument('--edge-vertices', type=int, default=24,
+                        help='Vertices per polygon side; polygons have four sides (default: 24)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--only', choices=['results', 'geometry'], help='Run only one half of the pipeline')
+    parser.add_argument('--output', default='benchmarks/pipeline_benchmark.json')
+    parser.add_argument('--compare', metavar='BASELINE', help='Previous report to compare stage times against')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='Slowdown ratio over the baseline that counts as a regression (default: 0.25)')
+    args = parser.parse_args()
+
+    parts = (args.only,) if args.only else ('results', 'geometry')
+    report = run(args.scales, args.years, args.contests, args.edge_vertices, args.seed, parts)
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            report['regressions'] = compare(report, json.load(f), args.threshold)
+
+    output_dir = os.path.dirname(args.output)
+    if output_dir and not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nWrote {args.output}")
+
+    if report.get('regressions'):
+        raise SystemExit(1)
@@ -0,0 +1,259 @@
+"""
+Area-weighted precinct crosswalk between two precinct vintages.
+
+Every source precinct (e.g. the 2010 VTDs) is intersected with the target
+precincts it overlaps (the 2024 shapes the map ships), found through an
+STRtree. The share of the source's area that falls in each target becomes a
+weight, and the weights of each source are scaled to sum to 1 so no votes are
+lost to slivers or water. A key drawn as several features is one source: its
+area and coverage are summed over all of them, and its votes go to each in
+proportion to its overlaps. Weights are stored as a sparse target x source
+matrix in CSR form (``indptr``/``indices``/``weights``) in an ``.npz`` file
+alongside both key lists.
+
+Reallocating a contest onto the target shapes is then one sparse
+matrix-vector product per vote column:
+
+    target_votes[t] = sum over sources s of weights[t, s] * source_votes[s]
+
+Results keys are lined up with source precincts by exact key, or by county and
+precinct code when the results carry the precinct name (ALAMANCE_01_PATTERSON
+matches the ALAMANCE_01 shape). Keys with no shape are reported and their
+votes are left out of the projection.
+"""
+
+import os
+import json
+import math
+import argparse
+
+import numpy as np
+import shapely
+from shapely.geometry import shape
+from shapely.strtree import STRtree
+
+from build_swing import precinct_code
+from competitiveness import classify, competitiveness_objects
+import instrument
+
+VOTE_FIELDS = ['dem_votes', 'rep_votes', 'other_votes', 'total_votes']
+# Overlaps smaller than this share of a source precinct are edge noise from
+# boundaries that were digitized slightly differently
+MIN_WEIGHT = 1e-4
+DEFAULT_KEY = '{County}_{PRECINCT}'
+
+
+def normalize_key(key):
+    return key.upper().replace(' ', '_')
+
+
+def load_precincts(path, key_template=DEFAULT_KEY):
+    """Keys, counties and shapely geometries of a precinct GeoJSON"""
+    with open(path, 'r', encoding='utf-8') as f:
+        geojson = json.load(f)
+    keys, counties, geometries = [], [], []
+    for feature in geojson['features']:
+        if not feature.get('geometry'):
+            continue
+        properties = feature.get('properties') or {}
+        keys.append(normalize_key(key_template.format(**properties)))
+        counties.append(normalize_key(str(properties.get('County', ''))))
+        geometries.append(shape(feature['geometry']))
+    return keys, counties, shapely.make_valid(np.asarray(geometries, dtype=object))
+
+
+def equal_area(geometries):
+    """Scale longitudes by cos(latitude) so planar areas are proportional to ground area across the state"""
+    min_x, min_y, max_x, max_y = shapely.total_bounds(geometries)
+    factor = math.cos(math.radians((min_y + max_y) / 2))
+    return shapely.transform(geometries, lambda coords: coords * [factor, 1.0])
+
+
+def build_crosswalk(source, target):
+    """Sparse target x source weight matrix from two (keys, counties, geometries) layers"""
+    source_keys, source_counties, source_geometries = source
+    target_keys, target_counties, target_geometries = target
+    source_geometries = equal_area(source_geometries)
+    target_geometries = equal_area(target_geometries)
+
+    tree = STRtree(target_geometries)
+    source_idx, target_idx = tree.query(source_geometries, predicate='intersects')
+    overlap = shapely.area(shapely.intersection(source_geometries[source_idx], target_geometries[target_idx]))
+    # Weights are shares of the area of the whole key, over all of its features
+    _, key_of = np.unique(np.asarray(source_keys), return_inverse=True)
+    key_area = np.bincount(key_of, weights=shapely.area(source_geometries))
+    weights = overlap / np.maximum(key_area[key_of[source_idx]], 1e-18)
+
+    keep = weights >= MIN_WEIGHT
+    source_idx, target_idx, weights = source_idx[keep], target_idx[keep], weights[keep]
+    # Share of each source key covered by the target layer, before rescaling (per feature)
+    coverage = np.bincount(key_of[source_idx], weights=weights, minlength=len(key_area))[key_of]
+    weights = weights / np.maximum(coverage[source_idx], 1e-18)
+
+    order = np.lexsort((source_idx, target_idx))
+    indptr = np.zeros(len(target_keys) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(target_idx, minlength=len(target_keys)), out=indptr[1:])
+    return {
+        'source_keys': np.asarray(source_keys),
+        'source_counties': np.asarray(source_counties),
+        'target_keys': np.asarray(target_keys),
+        'target_counties': np.asarray(target_counties),
+        'indptr': indptr,
+        'indices': source_idx[order].astype(np.int32),
+        'weights': weights[order],
+        'coverage': coverage,
+    }
+
+
+def save_crosswalk(crosswalk, path):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    np.savez_compressed(path, **crosswalk)
+
+
+def load_crosswalk(path):
+    with np.load(path, allow_pickle=False) as data:
+        return {name: data[name] for name in data.files}
+
+
+def reallocate(crosswalk, votes):
+    """Project source-aligned vote columns (n_source or n_source x k) onto the target precincts"""
+    votes = np.asarray(votes, dtype=np.float64)
+    rows = np.repeat(np.arange(len(crosswalk['indptr']) - 1), np.diff(crosswalk['indptr']))
+    contributions = crosswalk['weights'][:, None] * votes.reshape(len(votes), -1)[crosswalk['indices']]
+    projected = np.stack([np.bincount(rows, weights=column, minlength=len(crosswalk['indptr']) - 1)
+                          for column in contributions.T], axis=1)
+    return projected if votes.ndim > 1 else projected[:, 0]
+
+
+class SourceIndex:
+    """Looks up the source precinct rows for results keys (cached per key)"""
+
+    def __init__(self, crosswalk):
+        keys = crosswalk['source_keys'].tolist()
+        counties = crosswalk['source_counties'].tolist()
+        self.by_key = {}
+        self.by_code = {}
+        for i, (key, county) in enumerate(zip(keys, counties)):
+            self.by_key.setdefault(key, []).append(i)
+            self.by_code.setdefault((county, precinct_code(key, county)), set()).add(key)
+        self.cache = {}
+
+    def rows(self, key, county):
+        """Rows of every feature of the source key a results key matches, [] if none"""
+        if key not in self.cache:
+            rows = self.by_key.get(normalize_key(key))
+            if rows is None:
+                county = normalize_key(county or key.split('_', 1)[0])
+                candidates = self.by_code.get((county, precinct_code(normalize_key(key), county)), set())
+                rows = self.by_key[next(iter(candidates))] if len(candidates) == 1 else None
+            self.cache[key] = rows or []
+        return self.cache[key]
+
+
+def project_contest(crosswalk, source_index, results):
+    """Reallocate one contest's precinct results; returns (rows keyed by target key, unmatched keys)"""
+    votes = np.zeros((len(crosswalk['source_keys']), len(VOTE_FIELDS)))
+    unmatched = []
+    for key, row in results.items():
+        rows = source_index.rows(key, row.get('county'))
+        if not rows:
+            unmatched.append(key)
+            continue
+        # Each feature's weights are shares of the whole key, so every one of them gets the key's votes
+        votes[rows] += [row.get(field) or 0 for field in VOTE_FIELDS]
+
+    # A target key drawn as several features is one row of the output
+    keys, first, key_of = np.unique(crosswalk['target_keys'], return_index=True, return_inverse=True)
+    order = np.argsort(first)
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    first, key_of = first[order], rank[key_of.ravel()]
+    projected = reallocate(crosswalk, votes)
+    projected = np.stack([np.bincount(key_of, weights=column, minlength=len(first)) for column in projected.T], axis=1)
+    has_votes = projected[:, VOTE_FIELDS.index('total_votes')] > 0
+    target_rows = np.flatnonzero(has_votes)
+    columns = {field: np.round(projected[target_rows, j], 2) for j, field in enumerate(VOTE_FIELDS)}
+    # classify works on integer counts; votes in hundredths keep the fractional shares exact
+    derived = classify(np.rint(columns['dem_votes'] * 100), np.rint(columns['rep_votes'] * 100))
+    competitiveness = competitiveness_objects(derived['category'])
+
+    rows = {}
+    for n, t in enumerate(target_rows.tolist()):
+        key = str(crosswalk['target_keys'][first[t]])
+        county = str(crosswalk['target_counties'][first[t]])
+        row = {'county': county, 'precinct': key[len(county) + 1:] if key.startswith(county + '_') else key}
+        for field in VOTE_FIELDS:
+            row[field] = float(columns[field][n])
+        row['margin_pct'] = float(derived['margin_pct'][n])
+        row['winner'] = str(derived['winner'][n])
+        row['competitiveness'] = competitiveness[n]
+        rows[key] = row
+    return rows, unmatched
+
+
+def project_results(crosswalk, results_by_year):
+    """Every contest of ``results_by_year`` reallocated onto the target precincts, plus an unmatched report"""
+    source_index = SourceIndex(crosswalk)
+    projected = {}
+    report = {}
+    for year, contest_types in results_by_year.items():
+        for contest_type, contests in contest_types.items():
+            for contest_id, details in contests.items():
+                rows, unmatched = project_contest(crosswalk, source_index, details.get('results', {}))
+                contest = {field: value for field, value in details.items() if field != 'results'}
+                contest['results'] = rows
+                projected.setdefault(year, {}).setdefault(contest_type, {})[contest_id] = contest
+                if unmatched:
+                    report[contest_id] = sorted(unmatched)
+    return projected, report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build an area-weighted precinct crosswalk and project results onto it')
+    parser.add_argument('--crosswalk', default='data/crosswalk/crosswalk.npz',
+                        help='Crosswalk file to write (with --source) or read (default: %(default)s)')
+    parser.add_argument('--source', help='GeoJSON of the older precinct vintage; builds the crosswalk')
+    parser.add_argument('--target', default='data/nc_precincts_enhanced_2024.geojson',
+                        help='GeoJSON of the precincts to project onto (default: %(default)s)')
+    parser.add_argument('--source-key', default=DEFAULT_KEY,
+                        help='Key template over the source properties (default: %(default)s)')
+    parser.add_argument('--target-key', default=DEFAULT_KEY,
+                        help='Key template over the target properties (default: %(default)s)')
+    parser.add_argument('--results', nargs='*', default=[],
+                        help='Results files (results_by_year schema) to reallocate onto the target precincts')
+    parser.add_argument('--output-dir', default='data/crosswalk')
+    instrument.add_arguments(parser)
+    args = parser.parse_args()
+
+    with instrument.run('build_crosswalk', args):
+        if args.source:
+            print(f"Building crosswalk {args.source} -> {args.target}...")
+            with instrument.stage('load_precincts', inputs=[args.source, args.target]):
+                source = load_precincts(args.source, args.source_key)
+                target = load_precincts(args.target, args.target_key)
+            with instrument.stage('crosswalk', outputs=[args.crosswalk]) as stage:
+                crosswalk = build_crosswalk(source, target)
+                save_crosswalk(crosswalk, args.crosswalk)
+                stage.count('overlaps', len(crosswalk['weights']))
+            partial = int((crosswalk['coverage'] < 0.99).sum())
+            print(f"- {os.path.basename(args.crosswalk)}: {len(source[0])} source x {len(target[0])} target precincts, "
+                  f"{len(crosswalk['weights'])} overlaps, {partial} source precincts less than 99% covered")
+        else:
+            crosswalk = load_crosswalk(args.crosswalk)
+
+        for results_file in args.results:
+            name = os.path.splitext(os.path.basename(results_file))[0]
+            with instrument.stage(f'project_{name}', inputs=[results_file]):
+                with open(results_file, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                projected, report = project_results(crosswalk, data.get('results_by_year', data))
+            os.makedirs(args.output_dir, exist_ok=True)
+            output_file = os.path.join(args.output_dir, f'{name}_projected.json')
+            with open(output_file, 'w', encoding='utf-8') as f:
+                json.dump({'results_by_year': projected}, f, separators=(',', ':'))
+            with open(os.path.join(args.output_dir, f'{name}_unmatched.json'), 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=2)
+            unmatched = sum(len(keys) for keys in report.values())
+            print(f"- {os.path.basename(output_file)}: {unmatched} result keys without a source precinct")
@@ -0,0 +1,206 @@
+"""
+Integer feature ids for the map layers, and the join of every year's results keys to them.
+
+The map used to join results to shapes in the browser on every contest load:
+county names went through countyNameMap and precinct names were normalized
+and compared with each feature's properties. This script resolves the join
+once per build, so the page can color shapes with setFeatureState by id.
+
+A feature's id is its position in the source GeoJSON. That is the ``id``
+build_topojson.py gives every TopoJSON object and build_vector_tiles.py every
+tile feature, and the page adds the plain GeoJSON with ``generateId`` so it
+is numbered the same way. Ids stay fixed for as long as the geometry file
+does, so the index records each layer's feature count, the sha256 of its
+GeoJSON and a fingerprint of its key sequence: FNV-1a (32 bit) over the UTF-8
+of the features' normalized keys, one per line. The page computes the same
+fingerprint from whatever form of the layer it loaded (GeoJSON, TopoJSON or a
+geometry level, which all keep the features' order and properties) and only
+colors by id when it matches.
+
+Counties are matched on the County property, ignoring case and spaces vs
+underscores. Precinct keys (ALAMANCE_01_PATTERSON) are matched against
+'{County}_{PRECINCT}' of the shapes, exactly or, as in build_crosswalk.py, by
+county and precinct code when the shapes sharing them have a single key. A
+key drawn as several shapes maps to the list of their ids.
+
+Output (``data/feature_ids`` by default):
+
+    feature_ids_index.json              layers (source, key, features, sha256, fingerprint) and years -> file, match counts
+    feature_ids_{year}.json             {'counties': {county: id}, 'precincts': {key: id}}
+    feature_ids_{year}_unmatched.json   results counties and keys without a shape, by county
+"""
+
+import os
+import json
+import glob
+import argparse
+
+import numpy as np
+
+from precinct_store import iter_year_stores, read_store
+from build_crosswalk import DEFAULT_KEY, normalize_key
+from build_swing import precinct_code
+from build_manifest import hash_file
+import geometry_cache
+import instrument
+
+COUNTY_KEY = '{County}'
+
+
+def feature_keys(properties_list, key_template):
+    """Normalized key and county of every feature's properties, in order ('' if missing)"""
+    keys, counties = [], []
+    for properties in properties_list:
+        properties = properties or {}
+        try:
+            keys.append(normalize_key(key_template.format(**properties)))
+        except KeyError:
+            keys.append('')
+        counties.append(normalize_key(str(properties.get('County', ''))))
+    return keys, counties
+
+
+def layer_keys(path, key_template):
+    """Normalized key and county of every feature of a GeoJSON layer, in file order ('' if missing)"""
+    return feature_keys(geometry_cache.properties(geometry_cache.open_layer(path)), key_template)
+
+
+def key_fingerprint(keys):
+    """FNV-1a (32 bit) of the keys' UTF-8, one per line, as 8 hex digits (fingerprintKeys in the page)"""
+    value = 0x811c9dc5
+    for byte in '\n'.join(keys).encode('utf-8'):
+        value = ((value ^ byte) * 0x01000193) & 0xffffffff
+    return f'{value:08x}'
+
+
+class FeatureIndex:
+    """Looks up the feature ids of results keys (cached per key)"""
+
+    def __init__(self, keys, counties):
+        self.features = len(keys)
+        self.fingerprint = key_fingerprint(keys)
+        self.by_key = {}
+        self.by_code = {}
+        for i, (key, county) in enumerate(zip(keys, counties)):
+            if not key:
+                continue
+            self.by_key.setdefault(key, []).append(i)
+            self.by_code.setdefault((county, precinct_code(key, county)), set()).add(key)
+        self.cache = {}
+
+    def ids(self, key, county=None):
+        """Ids of the shapes of a results key, [] if there are none.
+
+        Without ``county`` only exact keys match.
+        """
+        if (key, county) not in self.cache:
+            ids = self.by_key.get(normalize_key(key))
+            if ids is None and county:
+                code_county = normalize_key(county)
+                candidates = self.by_code.get((code_county, precinct_code(normalize_key(key), code_county)), set())
+                ids = self.by_key[next(iter(candidates))] if len(candidates) == 1 else None
+            self.cache[key, county] = ids or []
+        return self.cache[key, county]
+
+
+def _id_value(ids):
+    return ids[0] if len(ids) == 1 else ids
+
+
+def join_year(store, county_index, precinct_index=None):
+    """Feature id table and unmatched report for the keys of one year store"""
+    counties = store['counties']
+    table = {'year': store['year'], 'counties': {}, 'precincts': {}}
+    unmatched = {'year': store['year'], 'counties': [], 'precincts': {}}
+    for county in counties:
+        ids = county_index.ids(county)
+        if ids:
+            table['counties'][county] = _id_value(ids)
+        else:
+            unmatched['counties'].append(county)
+
+    if precinct_index is not None:
+        for key, county in zip(store['keys'], np.asarray(store['key_county']).tolist()):
+            county = counties[county]
+            ids = precinct_index.ids(key, county)
+            if ids:
+                table['precincts'][key] = _id_value(ids)
+            else:
+                unmatched['precincts'].setdefault(county, []).append(key)
+    return table, unmatched
+
+
+def build_feature_ids(stores, layers, output_dir):
+    """Write one feature id table and one unmatched report per year, plus an index.
+
+    ``layers`` maps 'counties' (and optionally 'precincts') to (GeoJSON path, key template).
+    """
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    indexes = {}
+    index = {'version': '1.0', 'layers': {}, 'years': {}}
+    for name, (path, key_template) in layers.items():
+        indexes[name] = FeatureIndex(*layer_keys(path, key_template))
+        index['layers'][name] = {'source': os.path.basename(path), 'key': key_template,
+                                 'features': indexes[name].features, 'sha256': hash_file(path),
+                                 'fingerprint': indexes[name].fingerprint}
+
+    for store in stores:
+        year = store['year']
+        table, unmatched = join_year(store, indexes['counties'], indexes.get('precincts'))
+        name = f'feature_ids_{year}'
+        with open(os.path.join(output_dir, name + '.json'), 'w', encoding='utf-8') as f:
+            json.dump(table, f, separators=(',', ':'))
+        with open(os.path.join(output_dir, name + '_unmatched.json'), 'w', encoding='utf-8') as f:
+            json.dump(unmatched, f, indent=2)
+        unmatched_precincts = sum(len(keys) for keys in unmatched['precincts'].values())
+        index['years'][year] = {
+            'file': name + '.json',
+            'unmatched_file': name + '_unmatched.json',
+            'counties': len(table['counties']),
+            'precincts': len(table['precincts']),
+            'unmatched_counties': len(unmatched['counties']),
+            'unmatched_precincts': unmatched_precincts,
+        }
+        print(f"- {name}.json: {len(table['counties'])} counties and {len(table['precincts'])} precincts matched, "
+              f"{len(unmatched['counties'])} counties and {unmatched_precincts} precinct keys without a shape")
+
+    with open(os.path.join(output_dir, 'feature_ids_index.json'), 'w', encoding='utf-8') as f:
+        json.dump(index, f, indent=2)
+    return index
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Join every year\'s results keys to integer feature ids of the map layers')
+    parser.add_argument('--input', default='data/nc_statewide_precinct_comprehensive_2008_2024_UPDATED_MERGED.json')
+    parser.add_argument('--from-stores', metavar='DIR',
+                        help='Read the columnar precinct stores in DIR instead of the JSON')
+    parser.add_argument('--counties', default='data/nc_counties.geojson')
+    parser.add_argument('--precincts', default='data/nc_precincts_enhanced_2024.geojson',
+                        help='Precinct GeoJSON (precinct keys are not joined if missing)')
+    parser.add_argument('--precinct-key', default=DEFAULT_KEY,
+                        help='Key template over the precinct properties (default: %(default)s)')
+    parser.add_argument('--output-dir', default='data/feature_ids')
+    instrument.add_arguments(parser)
+    args = parser.parse_args()
+
+    with instrument.run('build_feature_ids', args):
+        layers = {'counties': (args.counties, COUNTY_KEY)}
+        if os.path.exists(args.precincts):
+            layers['precincts'] = (args.precincts, args.precinct_key)
+        else:
+            print(f"Skipping precincts: {args.precincts} not found")
+
+        with instrument.stage('read', inputs=[args.from_stores or args.input]):
+            if args.from_stores:
+                store_files = sorted(glob.glob(os.path.join(args.from_stores, 'precinct_store_*.bin')))
+                stores = [read_store(path) for path in store_files]
+            else:
+                print(f"Streaming data from {args.input}...")
+                stores = list(iter_year_stores(args.input))
+
+        with instrument.stage('join', inputs=[path for path, _ in layers.values()],
+                              outputs=[args.output_dir]) as stage:
+            index = build_feature_ids(stores, layers, args.output_dir)
+            stage.count('years', len(index['years']))
+            stage.count('unmatched_precincts', sum(year['unmatched_precincts'] for year in index['years'].values()))
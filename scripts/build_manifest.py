@@ -0,0 +1,152 @@
+"""
+Content-hash manifests for incremental rebuilds.
+
+Each build script keeps its own manifest under ``.build/`` (one file per
+script, so scripts running side by side never write the same file). An
+entry records the hash of everything that went into one unit of output (a
+year, a region, a copied file) and the hash of every file it produced:
+
+    {"version": 1, "entries": {"2024": {"input": "<sha256>",
+                                        "outputs": {"docs/data/...": "<sha256>"},
+                                        ...extra fields...}}}
+
+A unit is up to date when its input hash is unchanged and every recorded
+output still exists with the recorded content, so a rerun only rebuilds
+what actually changed and files edited or deleted by hand are noticed.
+"""
+
+import os
+import json
+import shutil
+import hashlib
+
+MANIFEST_DIR = '.build'
+MANIFEST_VERSION = 1
+
+
+def hash_bytes(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def hash_file(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def hash_json(value):
+    """Hash of a JSON-serializable value, independent of dict key order"""
+    return hash_bytes(json.dumps(value, sort_keys=True, separators=(',', ':')).encode('utf-8'))
+
+
+def manifest_path(name, manifest_dir=MANIFEST_DIR):
+    return os.path.join(manifest_dir, f'{name}.json')
+
+
+def load_manifest(name, manifest_dir=MANIFEST_DIR):
+    """Load a script's manifest; a missing or outdated one starts empty"""
+    path = manifest_path(name, manifest_dir)
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest.get('version') == MANIFEST_VERSION:
+            return manifest
+    return {'version': MANIFEST_VERSION, 'entries': {}}
+
+
+def save_manifest(manifest, name, manifest_dir=MANIFEST_DIR):
+    """Write the manifest atomically, so an interrupted build never leaves it half-written"""
+    os.makedirs(manifest_dir, exist_ok=True)
+    path = manifest_path(name, manifest_dir)
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+
+def is_fresh(manifest, key, input_hash, outputs=None):
+    """True when ``key`` was built from ``input_hash`` and its outputs are untouched.
+
+    ``outputs`` (optional) is the list of paths the unit should produce now;
+    if it differs from the recorded one, the unit is stale.
+    """
+    entry = manifest['entries'].get(key)
+    if not entry or entry.get('input') != input_hash:
+        return False
+    recorded = entry.get('outputs', {})
+    if outputs is not None and set(outputs) != set(recorded):
+        return False
+    return all(os.path.exists(path) and hash_file(path) == digest for path, digest in recorded.items())
+
+
+def record(manifest, key, input_hash, outputs, **extra):
+    """Store the input hash and the current hash of each output for ``key``"""
+    entry = {
+        'input': input_hash,
+        'outputs': {path: hash_file(path) for path in outputs}
+    }
+    entry.update(extra)
+    manifest['entries'][key] = entry
+    return entry
+
+
+def write_if_changed(path, data):
+    """Write bytes to ``path`` unless it already holds exactly them; returns True if written"""
+    if os.path.exists(path) and os.path.getsize(path) == len(data):
+        with open(path, 'rb') as f:
+            if f.read() == data:
+                return False
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+    return True
+
+
+def copy_if_changed(src, dst):
+    """Copy ``src`` to ``dst`` unless the contents already match; returns True if copied"""
+    if os.path.isdir(dst):
+        dst = os.path.join(dst, os.path.basename(src))
+    if (os.path.exists(dst) and os.path.getsize(dst) == os.path.getsize(src)
+            and hash_file(dst) == hash_file(src)):
+        return False
+    directory = os.path.dirname(dst)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    shutil.copy2(src, dst)
+    return True
+
+
+def sync_tree(src_dir, dst_dir, manifest, key=None):
+    """Mirror ``src_dir`` into ``dst_dir`` touching only files that changed.
+
+    Files whose content already matches are left alone. Files this sync put
+    in ``dst_dir`` before that no longer exist in ``src_dir`` are removed;
+    anything else in ``dst_dir`` (written by other scripts) is kept.
+    Returns (copied, removed, unchanged) path lists.
+    """
+    key = key or f'sync:{dst_dir}'
+    previous = manifest['entries'].get(key, {}).get('files', [])
+
+    copied, unchanged, files = [], [], []
+    for root, _, names in os.walk(src_dir):
+        for name in sorted(names):
+            src = os.path.join(root, name)
+            relative = os.path.relpath(src, src_dir)
+            files.append(relative)
+            if copy_if_changed(src, os.path.join(dst_dir, relative)):
+                copied.append(relative)
+            else:
+                unchanged.append(relative)
+
+    removed = []
+    for relative in sorted(set(previous) - set(files)):
+        path = os.path.join(dst_dir, relative)
+        if os.path.exists(path):
+            os.remove(path)
+            removed.append(relative)
+
+    manifest['entries'][key] = {'files': sorted(files)}
+    return copied, removed, unchanged
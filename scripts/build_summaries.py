@@ -0,0 +1,166 @@
+import json
+import os
+import glob
+import argparse
+from collections import Counter
+
+import numpy as np
+
+from precinct_store import iter_year_stores, read_store
+from competitiveness import build_scale, classify, NO_DATA_COLOR
+import instrument
+
+SCALE = build_scale()
+CATEGORY_COLORS = dict(zip(SCALE['codes'].tolist(), SCALE['colors'].tolist()))
+CATEGORY_COLORS['NO_DATA'] = NO_DATA_COLOR
+
+# Thresholds used by the map for county-level ratings (getCountyCompetitiveness)
+COUNTY_THRESHOLDS = [
+    (40, 'ANNIHILATION'), (30, 'DOMINANT'), (20, 'STRONGHOLD'), (10, 'SAFE'),
+    (5.5, 'LIKELY'), (1, 'LEAN'), (0.5, 'TILT')
+]
+
+# Signed margin histogram: 10-point bins from D+100 to R+100
+HISTOGRAM_EDGES = list(range(-100, 101, 10))
+
+
+def county_code(dem_votes, rep_votes):
+    """County rating, matching the map's getCountyCompetitiveness"""
+    two_party = dem_votes + rep_votes
+    if two_party == 0:
+        return 'NO_DATA'
+    margin = abs(rep_votes - dem_votes) / two_party * 100
+    prefix = 'R_' if rep_votes > dem_votes else 'D_'
+    for threshold, name in COUNTY_THRESHOLDS:
+        if margin >= threshold:
+            return prefix + name
+    return 'TOSSUP'
+
+
+def dominant_color(codes):
+    """Most common precinct color; ties go to the color seen first, as on the map"""
+    colors = Counter(CATEGORY_COLORS[code] for code in codes)
+    return max(colors, key=colors.get) if colors else CATEGORY_COLORS['NO_DATA']
+
+
+def summarize_contest(store, contest_id):
+    """County, statewide, category and histogram summary for one contest"""
+    contest = store['contests'][contest_id]
+    columns = contest['columns']
+    county_idx = store['key_county'][columns['index']].astype(np.int64)
+    n_counties = len(store['counties'])
+
+    totals = {}
+    for name in ('dem_votes', 'rep_votes', 'other_votes', 'total_votes'):
+        totals[name] = np.bincount(county_idx, weights=columns[name], minlength=n_counties).astype(np.int64)
+    precinct_counts = np.bincount(county_idx, minlength=n_counties)
+
+    derived = classify(columns['dem_votes'], columns['rep_votes'], SCALE)
+    margins = derived['margin_pct']
+    codes = SCALE['codes'][derived['category']].tolist()
+
+    codes_by_county = {}
+    for county, code in zip(county_idx.tolist(), codes):
+        codes_by_county.setdefault(county, []).append(code)
+
+    counties = {}
+    for i, county in enumerate(store['counties']):
+        if precinct_counts[i] == 0:
+            continue
+        dem, rep = int(totals['dem_votes'][i]), int(totals['rep_votes'][i])
+        code = county_code(dem, rep)
+        counties[county] = {
+            'dem_votes': dem,
+            'rep_votes': rep,
+            'other_votes': int(totals['other_votes'][i]),
+            'total_votes': int(totals['total_votes'][i]),
+            'precincts': int(precinct_counts[i]),
+            'code': code,
+            'color': CATEGORY_COLORS[code],
+            'dominant_color': dominant_color(codes_by_county[i]),
+            'categories': dict(Counter(codes_by_county[i]))
+        }
+
+    dem = int(columns['dem_votes'].sum(dtype=np.int64))
+    rep = int(columns['rep_votes'].sum(dtype=np.int64))
+    statewide_code = county_code(dem, rep)
+    histogram, _ = np.histogram(np.clip(margins, -100, 100), bins=HISTOGRAM_EDGES)
+
+    return {
+        'type': contest['type'],
+        'name': contest['meta'].get('contest_name', ''),
+        'statewide': {
+            'dem_votes': dem,
+            'rep_votes': rep,
+            'other_votes': int(columns['other_votes'].sum(dtype=np.int64)),
+            'total_votes': int(columns['total_votes'].sum(dtype=np.int64)),
+            'precincts': int(len(margins)),
+            'margin_pct': round((rep - dem) / (dem + rep) * 100, 2) if dem + rep else 0,
+            'code': statewide_code,
+            'color': CATEGORY_COLORS[statewide_code]
+        },
+        'counties': counties,
+        'categories': dict(Counter(codes)),
+        'margin_histogram': {
+            'edges': HISTOGRAM_EDGES,
+            'counts': histogram.tolist()
+        }
+    }
+
+
+def summarize_year(store):
+    return {
+        'version': '1.0',
+        'year': store['year'],
+        'contests': {
+            contest_id: summarize_contest(store, contest_id)
+            for contest_id in store['contests']
+        }
+    }
+
+
+def build_summaries(stores, output_dir):
+    """Write election_summary_{year}.json for every store plus an index"""
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    index = {'version': '1.0', 'years': {}}
+    for store in stores:
+        year = store['year']
+        summary = summarize_year(store)
+        filename = f'election_summary_{year}.json'
+        with open(os.path.join(output_dir, filename), 'w', encoding='utf-8') as f:
+            json.dump(summary, f, separators=(',', ':'))
+        index['years'][year] = {
+            'file': filename,
+            'contests': list(summary['contests'].keys())
+        }
+        size = os.path.getsize(os.path.join(output_dir, filename))
+        print(f"- {filename}: {len(summary['contests'])} contests, {size / 1024:.1f} KB")
+
+    with open(os.path.join(output_dir, 'election_summary_index.json'), 'w', encoding='utf-8') as f:
+        json.dump(index, f, indent=2)
+    return index
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Precompute county/statewide rollups for every contest')
+    parser.add_argument('--input', default='data/nc_statewide_precinct_comprehensive_2008_2024_UPDATED_MERGED.json')
+    parser.add_argument('--from-stores', metavar='DIR',
+                        help='Read the columnar precinct stores in DIR instead of the JSON')
+    parser.add_argument('--output-dir', default='data/summaries')
+    instrument.add_arguments(parser)
+    args = parser.parse_args()
+
+    with instrument.run('build_summaries', args):
+        if args.from_stores:
+            store_files = sorted(glob.glob(os.path.join(args.from_stores, 'precinct_store_*.bin')))
+            stores = (read_store(path) for path in store_files)
+        else:
+            print(f"Streaming data from {args.input}...")
+            stores = iter_year_stores(args.input)
+
+        # Stores are read lazily, so reading and summarizing share one stage
+        with instrument.stage('summarize', inputs=[args.from_stores or args.input], outputs=[args.output_dir]) as stage:
+            index = build_summaries(stores, args.output_dir)
+            stage.count('years', len(index['years']))
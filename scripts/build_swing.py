@@ -0,0 +1,375 @@
+"""
+Precinct-level swing between two contests (usually the same office in two cycles).
+
+Precinct keys (``ALAMANCE_01_PATTERSON``) are joined across the two contests
+with one vectorized intersection, and the shift is computed for every matched
+precinct at once:
+
+    margin_shift     change in (R - D) / total votes, in points (+ = toward R)
+    two_party_swing  change in R / (R + D), in points
+    turnout_change   change in total votes (also as a percentage)
+
+County and statewide arrows use each contest's full totals (a renamed
+precinct still counts toward its county), so the browser only has to draw
+them. Keys present in one contest but not the other are written to a
+separate report, classified as a likely rename, split or merge when another
+unmatched key in the same county shares the precinct code, instead of being
+dropped silently.
+
+Output (``data/swing`` by default):
+
+    swing_index.json                     pairs -> file, years, match counts
+    swing_{from}__{to}.json              precinct columns + county/statewide arrows
+    swing_{from}__{to}_unmatched.json    unmatched keys by county
+"""
+
+import re
+import os
+import json
+import glob
+import argparse
+
+import numpy as np
+
+from precinct_store import iter_year_stores, read_store
+import instrument
+
+YEAR_IN_CONTEST = re.compile(r'_(\d{4})_')
+
+# Arrow styling used by the map's swing arrows (showSwingArrows)
+R_COLOR = '#e74c3c'
+D_COLOR = '#3498db'
+MIN_ARROW_SHIFT = 0.5
+
+
+def contest_year(contest_id):
+    match = YEAR_IN_CONTEST.search(contest_id)
+    return match.group(1) if match else None
+
+
+def contest_slot(contest_id):
+    """A contest id without its year (us_senate_2014_1 -> us_senate_1), used to line up cycles"""
+    return YEAR_IN_CONTEST.sub('_', contest_id, count=1)
+
+
+def find_pairs(stores, all_pairs=False):
+    """(from contest, to contest) pairs of the same office in different years.
+
+    By default each contest is paired with the latest earlier year that has
+    the same office; ``all_pairs`` pairs it with every earlier year.
+    """
+    slots = {}
+    for year in sorted(stores):
+        for contest_id in sorted(stores[year]['contests']):
+            slots.setdefault(contest_slot(contest_id), []).append(contest_id)
+    pairs = []
+    for contest_ids in slots.values():
+        for i in range(1, len(contest_ids)):
+            earlier = contest_ids[:i] if all_pairs else contest_ids[i - 1:i]
+            pairs.extend((from_id, contest_ids[i]) for from_id in earlier)
+    return pairs
+
+
+def contest_columns(store, contest_id):
+    """Keys, counties and vote columns of one contest as arrays"""
+    if '_key_array' not in store:
+        store['_key_array'] = np.asarray(store['keys'])
+        store['_county_array'] = np.asarray(store['counties'])
+    columns = store['contests'][contest_id]['columns']
+    index = np.asarray(columns['index'])
+    return {
+        'keys': store['_key_array'][index],
+        'counties': store['_county_array'][np.asarray(store['key_county'])[index]],
+        'dem': np.asarray(columns['dem_votes'], dtype=np.int64),
+        'rep': np.asarray(columns['rep_votes'], dtype=np.int64),
+        'total': np.asarray(columns['total_votes'], dtype=np.int64),
+    }
+
+
+def shares(dem, rep, total):
+    """(R - D) / total and R / (R + D) in percent, 0 where there are no votes"""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        margin = np.where(total > 0, (rep - dem) / np.maximum(total, 1) * 100, 0.0)
+        rep_share = np.where(dem + rep > 0, rep / np.maximum(dem + rep, 1) * 100, 0.0)
+    return margin, rep_share
+
+
+def swing_vectors(before, after):
+    """Shift arrays for rows that line up between ``before`` and ``after`` (dicts of vote arrays)"""
+    margin_before, share_before = shares(before['dem'], before['rep'], before['total'])
+    margin_after, share_after = shares(after['dem'], after['rep'], after['total'])
+    turnout_change = after['total'] - before['total']
+    with np.errstate(divide='ignore', invalid='ignore'):
+        turnout_pct = np.where(before['total'] > 0,
+                               turnout_change / np.maximum(before['total'], 1) * 100, 0.0)
+    return {
+        'margin_shift': margin_after - margin_before,
+        'two_party_swing': share_after - share_before,
+        'turnout_change': turnout_change,
+        'turnout_change_pct': turnout_pct,
+    }
+
+
+def arrow(shift, swing, turnout_change, turnout_pct):
+    """Arrow for one area; the angle/scale formula is the one the map used to compute at render time"""
+    shift = float(shift)
+    return {
+        'margin_shift': round(shift, 2),
+        'two_party_swing': round(float(swing), 2),
+        'turnout_change': int(turnout_change),
+        'turnout_change_pct': round(float(turnout_pct), 2),
+        'direction': 'R' if shift > 0 else 'D',
+        'angle': 0 if shift > 0 else 180,
+        'scale': round(min(2, 0.5 + abs(shift) / 10), 3),
+        'color': R_COLOR if shift > 0 else D_COLOR,
+        'visible': abs(shift) >= MIN_ARROW_SHIFT,
+    }
+
+
+def county_totals(columns, counties):
+    """dem / rep / total votes summed per county (in ``counties`` order)"""
+    county_index = {county: i for i, county in enumerate(counties)}
+    rows = np.asarray([county_index[county] for county in columns['counties'].tolist()], dtype=np.int64)
+    return {
+        name: np.bincount(rows, weights=columns[name], minlength=len(counties)).astype(np.int64)
+        for name in ('dem', 'rep', 'total')
+    }
+
+
+def precinct_code(key, county):
+    """The precinct code of a key: ALAMANCE_01_PATTERSON -> 01"""
+    prefix = county.replace(' ', '_') + '_'
+    rest = key[len(prefix):] if key.startswith(prefix) else key.split('_', 1)[-1]
+    return rest.split('_', 1)[0]
+
+
+def classify_unmatched(only_before, only_after):
+    """Group unmatched keys by county and guess why each one did not line up.
+
+    Both arguments map key -> county. A key only in the earlier contest and a
+    key only in the later one are candidates for the same area when they are
+    in the same county and their precinct codes are equal or one extends the
+    other with a non-digit suffix (01 / 01, 05 / 05A). One candidate each way
+    is a likely rename, one earlier key with several later ones a split, and
+    the reverse a merge.
+    """
+    def compatible(code, other):
+        shorter, longer = sorted((code, other), key=len)
+        # 05 matches 05A or 05-1, but 1 does not match 10
+        return longer.startswith(shorter) and (len(longer) == len(shorter) or not longer[len(shorter)].isdigit())
+
+    by_county = {}
+    for key, county in only_after.items():
+        by_county.setdefault(county, []).append((precinct_code(key, county), key))
+    forward = {}
+    backward = {}
+    for key, county in only_before.items():
+        code = precinct_code(key, county)
+        forward[key] = sorted(other for other_code, other in by_county.get(county, []) if compatible(code, other_code))
+        for other in forward[key]:
+            backward.setdefault(other, []).append(key)
+
+    report = {}
+    def county_entry(county):
+        return report.setdefault(county, {'renamed': [], 'split': [], 'merged': [], 'ambiguous': [],
+                                         'only_before': [], 'only_after': []})
+
+    for key, county in sorted(only_before.items()):
+        targets = forward[key]
+        if not targets:
+            county_entry(county)['only_before'].append(key)
+        elif len(targets) > 1:
+            county_entry(county)['split'].append({'from': key, 'to': targets})
+        elif len(backward[targets[0]]) == 1:
+            county_entry(county)['renamed'].append({'from': key, 'to': targets[0]})
+        elif any(len(forward[source]) > 1 for source in backward[targets[0]]):
+            # Overlapping splits and merges; listed so nothing disappears from the report
+            county_entry(county)['ambiguous'].append({'from': key, 'to': targets})
+    for key, county in sorted(only_after.items()):
+        sources = backward.get(key, [])
+        if not sources:
+            county_entry(county)['only_after'].append(key)
+        elif len(sources) > 1 and all(len(forward[source]) == 1 for source in sources):
+            county_entry(county)['merged'].append({'from': sorted(sources), 'to': key})
+
+    return {county: {kind: keys for kind, keys in entry.items() if keys}
+            for county, entry in sorted(report.items())}
+
+
+def compute_swing(store_before, from_id, store_after, to_id, centroids=None, join_renamed=False):
+    """Swing file contents and unmatched report for one pair of contests.
+
+    With ``join_renamed`` the likely renames from the unmatched report are
+    joined as well (listed under ``precincts.renamed``); they stay in the report.
+    """
+    before = contest_columns(store_before, from_id)
+    after = contest_columns(store_after, to_id)
+
+    keys, i_before, i_after = np.intersect1d(before['keys'], after['keys'], return_indices=True)
+
+    only_before = np.ones(len(before['keys']), dtype=bool)
+    only_before[i_before] = False
+    only_after = np.ones(len(after['keys']), dtype=bool)
+    only_after[i_after] = False
+    unmatched_before = dict(zip(before['keys'][only_before].tolist(), before['counties'][only_before].tolist()))
+    unmatched_after = dict(zip(after['keys'][only_after].tolist(), after['counties'][only_after].tolist()))
+    report = classify_unmatched(unmatched_before, unmatched_after)
+
+    renamed = {}
+    if join_renamed:
+        renamed = {entry['to']: entry['from'] for county in report.values() for entry in county.get('renamed', [])}
+        row_before = {key: i for i, key in enumerate(before['keys'].tolist()) if key in unmatched_before}
+        row_after = {key: i for i, key in enumerate(after['keys'].tolist()) if key in unmatched_after}
+        keys = np.concatenate([keys, np.asarray(list(renamed), dtype=keys.dtype if len(keys) else str)])
+        i_before = np.concatenate([i_before, np.asarray([row_before[key] for key in renamed.values()], dtype=np.int64)])
+        i_after = np.concatenate([i_after, np.asarray([row_after[key] for key in renamed], dtype=np.int64)])
+        for new_key, old_key in renamed.items():
+            del unmatched_before[old_key], unmatched_after[new_key]
+
+    matched = swing_vectors({name: before[name][i_before] for name in ('dem', 'rep', 'total')},
+                            {name: after[name][i_after] for name in ('dem', 'rep', 'total')})
+
+    counties = sorted(set(before['counties'].tolist()) | set(after['counties'].tolist()))
+    totals_before = county_totals(before, counties)
+    totals_after = county_totals(after, counties)
+    county_swing = swing_vectors(totals_before, totals_after)
+
+    unmatched_counts = {}
+    for county in list(unmatched_before.values()) + list(unmatched_after.values()):
+        unmatched_counts[county] = unmatched_counts.get(county, 0) + 1
+    matched_counts = dict(zip(*np.unique(before['counties'][i_before], return_counts=True)))
+
+    county_arrows = {}
+    for i, county in enumerate(counties):
+        if totals_before['total'][i] == 0 or totals_after['total'][i] == 0:
+            continue
+        entry = arrow(county_swing['margin_shift'][i], county_swing['two_party_swing'][i],
+                      county_swing['turnout_change'][i], county_swing['turnout_change_pct'][i])
+        entry['precincts_matched'] = int(matched_counts.get(county, 0))
+        entry['precincts_unmatched'] = unmatched_counts.get(county, 0)
+        if centroids and county.upper() in centroids:
+            entry['centroid'] = centroids[county.upper()]
+        county_arrows[county] = entry
+
+    state_before = {name: np.asarray([values.sum()]) for name, values in totals_before.items()}
+    state_after = {name: np.asarray([values.sum()]) for name, values in totals_after.items()}
+    state = swing_vectors(state_before, state_after)
+    statewide = arrow(state['margin_shift'][0], state['two_party_swing'][0],
+                      state['turnout_change'][0], state['turnout_change_pct'][0])
+    statewide['precincts_matched'] = int(len(keys))
+    statewide['precincts_unmatched'] = len(unmatched_before) + len(unmatched_after)
+
+    # Columnar so the file stays small; row i of every array is keys[i] (the later contest's key)
+    precincts = {
+        'keys': keys.tolist(),
+        'margin_shift': np.round(matched['margin_shift'], 2).tolist(),
+        'two_party_swing': np.round(matched['two_party_swing'], 2).tolist(),
+        'turnout_change': matched['turnout_change'].tolist(),
+    }
+    if renamed:
+        precincts['renamed'] = renamed
+    swing = {
+        'version': '1.0',
+        'from': {'year': contest_year(from_id) or store_before['year'], 'contest': from_id},
+        'to': {'year': contest_year(to_id) or store_after['year'], 'contest': to_id},
+        'statewide': statewide,
+        'counties': county_arrows,
+        'precincts': precincts,
+    }
+    unmatched = {
+        'from': from_id,
+        'to': to_id,
+        'only_before': int(only_before.sum()),
+        'only_after': int(only_after.sum()),
+        'joined_as_renamed': len(renamed),
+        'counties': report,
+    }
+    return swing, unmatched
+
+
+def load_centroids(counties_file):
+    """County name (upper case) -> [lon, lat] of the polygon centroid"""
+    from shapely.geometry import shape
+
+    with open(counties_file, 'r', encoding='utf-8') as f:
+        geojson = json.load(f)
+    centroids = {}
+    for feature in geojson['features']:
+        name = (feature.get('properties') or {}).get('County')
+        if name and feature.get('geometry'):
+            point = shape(feature['geometry']).centroid
+            centroids[name.upper()] = [round(point.x, 5), round(point.y, 5)]
+    return centroids
+
+
+def build_swing(stores, output_dir, pairs=None, all_pairs=False, centroids=None, join_renamed=False):
+    """Write one swing file and one unmatched report per contest pair, plus an index"""
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    stores = {store['year']: store for store in stores}
+    contest_store = {contest_id: store for store in stores.values() for contest_id in store['contests']}
+
+    index = {'version': '1.0', 'pairs': {}}
+    for from_id, to_id in pairs or find_pairs(stores, all_pairs):
+        if from_id not in contest_store or to_id not in contest_store:
+            print(f"Skipping {from_id} -> {to_id}: contest not found")
+            continue
+        swing, unmatched = compute_swing(contest_store[from_id], from_id, contest_store[to_id], to_id,
+                                         centroids, join_renamed)
+        name = f'swing_{from_id}__{to_id}'
+        with open(os.path.join(output_dir, name + '.json'), 'w', encoding='utf-8') as f:
+            json.dump(swing, f, separators=(',', ':'))
+        with open(os.path.join(output_dir, name + '_unmatched.json'), 'w', encoding='utf-8') as f:
+            json.dump(unmatched, f, indent=2)
+        index['pairs'][f'{from_id}__{to_id}'] = {
+            'file': name + '.json',
+            'unmatched_file': name + '_unmatched.json',
+            'from_year': swing['from']['year'],
+            'to_year': swing['to']['year'],
+            'matched': swing['statewide']['precincts_matched'],
+            'unmatched': swing['statewide']['precincts_unmatched'],
+        }
+        print(f"- {name}.json: {swing['statewide']['precincts_matched']} precincts matched "
+              f"({unmatched['joined_as_renamed']} by likely rename), "
+              f"{unmatched['only_before']} keys only in {from_id}, {unmatched['only_after']} only in {to_id}, "
+              f"statewide {swing['statewide']['direction']}+{abs(swing['statewide']['margin_shift']):.2f}")
+
+    with open(os.path.join(output_dir, 'swing_index.json'), 'w', encoding='utf-8') as f:
+        json.dump(index, f, indent=2)
+    return index
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Precompute precinct, county and statewide swing between contests')
+    parser.add_argument('--input', default='data/nc_statewide_precinct_comprehensive_2008_2024_UPDATED_MERGED.json')
+    parser.add_argument('--from-stores', metavar='DIR',
+                        help='Read the columnar precinct stores in DIR instead of the JSON')
+    parser.add_argument('--output-dir', default='data/swing')
+    parser.add_argument('--pair', nargs=2, action='append', metavar=('FROM', 'TO'),
+                        help='Contest ids to compare, e.g. president_2020_1 president_2024_1 (repeatable); '
+                             'default: each office against its previous cycle')
+    parser.add_argument('--all-pairs', action='store_true',
+                        help='Pair each office with every earlier cycle, not just the previous one')
+    parser.add_argument('--join-renamed', action='store_true',
+                        help='Also join precincts the unmatched report lists as likely renames '
+                             '(same county and precinct code, e.g. ALAMANCE_01_PATTERSON -> ALAMANCE_01)')
+    parser.add_argument('--counties', default='data/nc_counties.geojson',
+                        help='County GeoJSON used to add arrow anchor points (skipped if missing)')
+    instrument.add_arguments(parser)
+    args = parser.parse_args()
+
+    with instrument.run('build_swing', args):
+        with instrument.stage('read', inputs=[args.from_stores or args.input]):
+            if args.from_stores:
+                store_files = sorted(glob.glob(os.path.join(args.from_stores, 'precinct_store_*.bin')))
+                stores = [read_store(path) for path in store_files]
+            else:
+                print(f"Streaming data from {args.input}...")
+                stores = list(iter_year_stores(args.input))
+
+        with instrument.stage('centroids'):
+            centroids = load_centroids(args.counties) if os.path.exists(args.counties) else None
+        with instrument.stage('swing', outputs=[args.output_dir]) as stage:
+            index = build_swing(stores, args.output_dir, pairs=args.pair, all_pairs=args.all_pairs,
+                                centroids=centroids, join_renamed=args.join_renamed)
+            stage.count('pairs', len(index['pairs']))
@@ -0,0 +1,391 @@
+"""
+Shared-arc (TopoJSON) encoder for the county and precinct layers.
+
+``simplify_geojson`` simplifies every polygon on its own, so a border shared
+by two precincts is stored twice and the two copies can be simplified
+differently, leaving slivers and gaps. Here the rings are cut into arcs at
+junctions (points where the set of neighbouring rings changes), each shared
+arc is stored once and referenced by both polygons, and simplification runs
+once per arc with the junctions pinned, so neighbours always agree.
+
+Coordinates are quantized to an integer grid and arcs are delta-encoded, as
+in the TopoJSON spec; the output decodes with topojson-client's
+``topojson.feature``. Each geometry keeps its position in the source GeoJSON
+as ``id``.
+"""
+
+import os
+import json
+import gzip
+import argparse
+
+import numpy as np
+import shapely
+
+import instrument
+
+DEFAULT_QUANTIZATION = 100000
+
+DEFAULT_LAYERS = {
+    'counties': ('data/nc_counties.geojson', 0.001),
+    'precincts': ('data/nc_precincts_enhanced_2024.geojson', 0.0005),
+}
+
+# Simplification levels per layer, coarsest first. Each tolerance is about
+# one screen pixel (in degrees) at the level's minimum zoom, so the map can
+# start with the coarse file and swap in finer ones as it zooms in.
+LEVELS = {
+    'counties': [
+        {'name': 'low', 'tolerance': 0.005, 'minzoom': 0},
+        {'name': 'medium', 'tolerance': 0.0015, 'minzoom': 8},
+        {'name': 'high', 'tolerance': 0.0003, 'minzoom': 10}
+    ],
+    'precincts': [
+        {'name': 'low', 'tolerance': 0.0015, 'minzoom': 0},
+        {'name': 'medium', 'tolerance': 0.0004, 'minzoom': 10},
+        {'name': 'high', 'tolerance': 0.0001, 'minzoom': 12}
+    ]
+}
+
+LEVELS_MANIFEST = 'geometry_levels.json'
+
+
+def _polygons(geometry):
+    """Polygon coordinate lists of a GeoJSON Polygon / MultiPolygon"""
+    if not geometry:
+        return []
+    if geometry['type'] == 'Polygon':
+        return [geometry['coordinates']]
+    if geometry['type'] == 'MultiPolygon':
+        return geometry['coordinates']
+    return []
+
+
+def quantize_transform(features, quantization=DEFAULT_QUANTIZATION):
+    """TopoJSON transform covering every coordinate of the features"""
+    coords = np.concatenate([
+        np.asarray(ring, dtype=np.float64)[:, :2]
+        for feature in features
+        for polygon in _polygons(feature.get('geometry'))
+        for ring in polygon
+    ])
+    x0, y0 = coords.min(axis=0)
+    x1, y1 = coords.max(axis=0)
+    return {
+        'scale': [float(x1 - x0) / (quantization - 1) or 1.0, float(y1 - y0) / (quantization - 1) or 1.0],
+        'translate': [float(x0), float(y0)]
+    }
+
+
+def _quantize_ring(ring, transform):
+    points = np.asarray(ring, dtype=np.float64)[:, :2]
+    q = np.rint((points - transform['translate']) / transform['scale']).astype(np.int64)
+    # Drop the closing point and any vertices that collapsed onto their predecessor
+    q = q[:-1] if len(q) > 1 and (q[0] == q[-1]).all() else q
+    keep = np.ones(len(q), dtype=bool)
+    keep[1:] = (q[1:] != q[:-1]).any(axis=1)
+    q = q[keep]
+    if len(q) > 1 and (q[0] == q[-1]).all():
+        q = q[:-1]
+    return q
+
+
+def build_topology(features, transform):
+    """Cut the quantized rings of all features into shared arcs.
+
+    Returns ``{'arcs': [int array (n, 2)], 'geometries': [...]}`` where each
+    geometry holds, per polygon, per ring, the list of arc references
+    (``~i`` for arc ``i`` traversed backwards).
+    """
+    rings = []
+    geometries = []
+    for feature in features:
+        polygons = []
+        for polygon in _polygons(feature.get('geometry')):
+            ring_ids = []
+            for i, ring in enumerate(polygon):
+                q = _quantize_ring(ring, transform)
+                if len(q) < 3:
+                    if i == 0:
+                        break
+                    continue
+                ring_ids.append(len(rings))
+                rings.append(q)
+            if ring_ids:
+                polygons.append(ring_ids)
+        geometries.append(polygons)
+
+    if not rings:
+        return {'arcs': [], 'ring_arcs': [], 'ring_vertices': 0, 'geometries': [[] for _ in features]}
+
+    # A vertex is a junction when it is not always visited between the same
+    # two neighbours, i.e. where one ring's neighbourhood diverges from another's
+    lengths = np.array([len(r) for r in rings])
+    starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+    points = np.concatenate(rings)
+    span = int(points.max()) + 1
+    keys = points[:, 0] * span + points[:, 1]
+    position = np.arange(len(points)) - np.repeat(starts, lengths)
+    ring_length = np.repeat(lengths, lengths)
+    prev_keys = keys[np.repeat(starts, lengths) + (position - 1) % ring_length]
+    next_keys = keys[np.repeat(starts, lengths) + (position + 1) % ring_length]
+    low = np.minimum(prev_keys, next_keys)
+    high = np.maximum(prev_keys, next_keys)
+
+    order = np.lexsort((high, low, keys))
+    sorted_keys, sorted_low, sorted_high = keys[order], low[order], high[order]
+    new_key = np.ones(len(order), dtype=bool)
+    new_key[1:] = sorted_keys[1:] != sorted_keys[:-1]
+    new_pair = new_key.copy()
+    new_pair[1:] |= (sorted_low[1:] != sorted_low[:-1]) | (sorted_high[1:] != sorted_high[:-1])
+    pair_counts = np.add.reduceat(new_pair.astype(np.int64), np.flatnonzero(new_key))
+    junction_keys = sorted_keys[new_key][pair_counts > 1]
+    is_junction = np.isin(keys, junction_keys)
+
+    arcs = []
+    arc_index = {}
+
+    def add_arc(arc_keys, coords):
+        arc_keys = tuple(arc_keys)
+        if arc_keys in arc_index:
+            return arc_index[arc_keys]
+        reverse_keys = arc_keys[::-1]
+        if reverse_keys in arc_index:
+            return ~arc_index[reverse_keys]
+        arc_index[arc_keys] = len(arcs)
+        arcs.append(coords)
+        return arc_index[arc_keys]
+
+    ring_arcs = []
+    for ring_id, ring in enumerate(rings):
+        start = starts[ring_id]
+        ring_keys = keys[start:start + len(ring)].tolist()
+        junctions = np.flatnonzero(is_junction[start:start + len(ring)])
+        if not len(junctions):
+            # Closed ring with no junctions: rotate to a canonical start so a
+            # ring shared with another polygon (an enclave) is found in either direction
+            first = int(np.argmin(keys[start:start + len(ring)]))
+            rotated = np.roll(ring, -first, axis=0)
+            rotated_keys = ring_keys[first:] + ring_keys[:first]
+            ring_arcs.append([add_arc(rotated_keys + rotated_keys[:1], np.vstack([rotated, rotated[:1]]))])
+            continue
+
+        first = int(junctions[0])
+        rotated = np.vstack([np.roll(ring, -first, axis=0), ring[first:first + 1]])
+        rotated_keys = ring_keys[first:] + ring_keys[:first] + ring_keys[first:first + 1]
+        cuts = (junctions - first).tolist() + [len(ring)]
+        refs = []
+        for a, b in zip(cuts[:-1], cuts[1:]):
+            refs.append(add_arc(rotated_keys[a:b + 1], rotated[a:b + 1]))
+        ring_arcs.append(refs)
+
+    return {
+        'arcs': arcs,
+        'ring_arcs': ring_arcs,
+        'ring_vertices': int(len(points)),
+        'geometries': [
+            [[ring_arcs[ring_id] for ring_id in polygon] for polygon in polygons]
+            for polygons in geometries
+        ]
+    }
+
+
+def _arc_id(ref):
+    return ref if ref >= 0 else ~ref
+
+
+def simplify_arcs(topology, transform, tolerance):
+    """Douglas-Peucker each arc once (tolerance in source units, endpoints kept).
+
+    Any ring that would collapse below three distinct points keeps its
+    original arcs, which stays consistent for the neighbours sharing them.
+    """
+    arcs = topology['arcs']
+    if not arcs or not tolerance:
+        return list(arcs)
+
+    scale = np.asarray(transform['scale'])
+    lengths = np.array([len(arc) for arc in arcs])
+    coords = np.concatenate(arcs) * scale
+    lines = shapely.linestrings(coords, indices=np.repeat(np.arange(len(arcs)), lengths))
+    simplified = shapely.simplify(lines, tolerance, preserve_topology=False)
+    counts = shapely.get_num_coordinates(simplified)
+    flat = np.rint(shapely.get_coordinates(simplified) / scale).astype(np.int64)
+    result = np.split(flat, np.cumsum(counts)[:-1])
+
+    for refs in topology['ring_arcs']:
+        distinct = sum(len(result[_arc_id(ref)]) - 1 for ref in refs)
+        if distinct < 3:
+            for ref in refs:
+                result[_arc_id(ref)] = arcs[_arc_id(ref)]
+    return result
+
+
+def encode_topology(layers, transform):
+    """TopoJSON dict from {object name: (features, topology, arcs)}.
+
+    Each layer's arcs are appended to the shared arc list and delta encoded.
+    """
+    all_arcs = []
+    objects = {}
+    for name, (features, topology, arcs) in layers.items():
+        offset = len(all_arcs)
+        for arc in arcs:
+            deltas = np.diff(arc, axis=0, prepend=np.zeros((1, 2), dtype=np.int64))
+            all_arcs.append(deltas.tolist())
+
+        shift = lambda ref: ref + offset if ref >= 0 else ~(~ref + offset)
+        geometries = []
+        for i, (feature, polygons) in enumerate(zip(features, topology['geometries'])):
+            geometry = {'type': None, 'id': i, 'properties': feature.get('properties') or {}}
+            shifted = [[[shift(ref) for ref in ring] for ring in polygon] for polygon in polygons]
+            if len(shifted) == 1:
+                geometry['type'] = 'Polygon'
+                geometry['arcs'] = shifted[0]
+            elif shifted:
+                geometry['type'] = 'MultiPolygon'
+                geometry['arcs'] = shifted
+            geometries.append(geometry)
+        objects[name] = {'type': 'GeometryCollection', 'geometries': geometries}
+
+    return {
+        'type': 'Topology',
+        'transform': transform,
+        'objects': objects,
+        'arcs': all_arcs
+    }
+
+
+def decode_arc(arc, transform):
+    """Absolute coordinates of a delta-encoded arc"""
+    points = np.cumsum(np.asarray(arc, dtype=np.float64), axis=0)
+    return points * transform['scale'] + transform['translate']
+
+
+def count_vertices(arcs):
+    return int(sum(len(arc) for arc in arcs))
+
+
+def load_topology(input_path, quantization=DEFAULT_QUANTIZATION):
+    """Read a GeoJSON layer and cut it into shared arcs"""
+    print(f"Processing {input_path}...")
+    with instrument.stage('read', inputs=[input_path]), open(input_path, 'r') as f:
+        features = json.load(f)['features']
+
+    transform = quantize_transform(features, quantization)
+    print("Building shared arcs...")
+    with instrument.stage('arcs'):
+        topology = build_topology(features, transform)
+    print(f"  {len(topology['ring_arcs'])} rings, {topology['ring_vertices']} ring vertices -> "
+          f"{len(topology['arcs'])} unique arcs, {count_vertices(topology['arcs'])} arc vertices")
+    return features, transform, topology
+
+
+def write_topojson(encoded, output_path):
+    """Write compact TopoJSON; returns (bytes, gzipped bytes)"""
+    output_dir = os.path.dirname(output_path)
+    if output_dir and not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    data = json.dumps(encoded, separators=(',', ':')).encode('utf-8')
+    with open(output_path, 'wb') as f:
+        f.write(data)
+    return len(data), len(gzip.compress(data, mtime=0))
+
+
+def build_topojson(input_path, output_path, name, tolerance=0.0001, quantization=DEFAULT_QUANTIZATION):
+    """Encode one GeoJSON layer as a TopoJSON file with shared, once-simplified arcs"""
+    features, transform, topology = load_topology(input_path, quantization)
+
+    print(f"Simplifying arcs (tolerance {tolerance})...")
+    with instrument.stage('simplify'):
+        arcs = simplify_arcs(topology, transform, tolerance)
+    print(f"  {count_vertices(arcs)} vertices after simplification")
+
+    with instrument.stage('write', outputs=[output_path]):
+        encoded = encode_topology({name: (features, topology, arcs)}, transform)
+        write_topojson(encoded, output_path)
+
+    original_size = os.path.getsize(input_path) / (1024 * 1024)
+    final_size = os.path.getsize(output_path) / (1024 * 1024)
+    print(f"Size reduced from {original_size:.2f}MB to {final_size:.2f}MB")
+    return encoded
+
+
+def build_levels(input_path, output_dir, name, levels, quantization=DEFAULT_QUANTIZATION):
+    """Write one TopoJSON file per simplification level from a single topology.
+
+    Returns the layer's manifest entry: per level the file, tolerance,
+    minimum zoom, vertex count and raw / gzipped size.
+    """
+    features, transform, topology = load_topology(input_path, quantization)
+    base = os.path.splitext(os.path.basename(input_path))[0]
+
+    entries = []
+    for level in levels:
+        arcs = simplify_arcs(topology, transform, level['tolerance'])
+        filename = f"{base}.{level['name']}.topojson"
+        size, gzip_size = write_topojson(
+            encode_topology({name: (features, topology, arcs)}, transform),
+            os.path.join(output_dir, filename)
+        )
+        entries.append({
+            'name': level['name'],
+            'file': filename,
+            'tolerance': level['tolerance'],
+            'minzoom': level['minzoom'],
+            'vertices': count_vertices(arcs),
+            'bytes': size,
+            'gzip_bytes': gzip_size
+        })
+        print(f"  {level['name']:>6} (z{level['minzoom']}+, tolerance {level['tolerance']}): "
+              f"{entries[-1]['vertices']} vertices, {size / 1024:.1f} KB ({gzip_size / 1024:.1f} KB gzipped)")
+
+    return {
+        'source': os.path.basename(input_path),
+        'object': name,
+        'features': len(features),
+        'levels': entries
+    }
+
+
+def write_levels_manifest(layers, output_dir):
+    manifest = {'version': '1.0', 'layers': layers}
+    with open(os.path.join(output_dir, LEVELS_MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Encode the county and precinct layers as TopoJSON with shared arcs')
+    parser.add_argument('--counties', default=DEFAULT_LAYERS['counties'][0])
+    parser.add_argument('--precincts', default=DEFAULT_LAYERS['precincts'][0])
+    parser.add_argument('--output-dir', default='data')
+    parser.add_argument('--quantization', type=int, default=DEFAULT_QUANTIZATION,
+                        help='Grid size per axis for quantized coordinates (default: 100000)')
+    parser.add_argument('--tolerance', type=float,
+                        help='Simplification tolerance in degrees for both layers '
+                             '(default: 0.001 for counties, 0.0005 for precincts)')
+    parser.add_argument('--levels', action='store_true',
+                        help=f'Write every level in LEVELS plus {LEVELS_MANIFEST} instead of a single file')
+    instrument.add_arguments(parser)
+    args = parser.parse_args()
+
+    with instrument.run('build_topojson', args):
+        inputs = {'counties': args.counties, 'precincts': args.precincts}
+        manifest_layers = {}
+        for name, input_path in inputs.items():
+            if not os.path.exists(input_path):
+                print(f"Skipping {name}: {input_path} not found")
+                continue
+            with instrument.stage(name):
+                if args.levels:
+                    manifest_layers[name] = build_levels(input_path, args.output_dir, name, LEVELS[name],
+                                                         args.quantization)
+                    continue
+                tolerance = args.tolerance if args.tolerance is not None else DEFAULT_LAYERS[name][1]
+                output_name = os.path.splitext(os.path.basename(input_path))[0] + '.topojson'
+                build_topojson(input_path, os.path.join(args.output_dir, output_name), name, tolerance, args.quantization)
+
+        if args.levels and manifest_layers:
+            write_levels_manifest(manifest_layers, args.output_dir)
+            print(f"\nWrote {os.path.join(args.output_dir, LEVELS_MANIFEST)}")
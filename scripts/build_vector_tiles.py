@@ -0,0 +1,739 @@
+"""
+Vector-tile build stage for the precinct and county layers.
+
+Cuts the GeoJSON layers into a zoom pyramid of Mapbox Vector Tiles (MVT) and
+packs them into a single PMTiles (v3) archive. Mapbox GL JS cannot read
+PMTiles without a plugin, so ``--tile-dir`` also writes the tiles as
+{z}/{x}/{y}.pbf files plus a TileJSON; the map draws its precinct layer from
+that directory, fetching just the tiles covering the viewport instead of
+parsing the full GeoJSON. Everything runs offline in Python; no tile server
+or external tiling tool is needed.
+
+Geometries are projected to Web Mercator once, simplified once per zoom level
+(tolerance scaled to a fraction of a screen pixel at that zoom), and assigned
+to tiles through an STRtree. Each feature keeps a stable integer id (its
+position in the source GeoJSON) as its MVT feature id, the id
+build_feature_ids.py joins results to. Each layer's feature count and key
+fingerprint go into the metadata, so the page can check that the tiles and
+the feature id tables were built from the same shapes.
+
+``--verify`` decodes every tile in an archive and checks the feature ids and
+their identifying property against the source GeoJSON.
+"""
+
+import os
+import json
+import gzip
+import math
+import shutil
+import struct
+import hashlib
+import argparse
+
+import numpy as np
+import shapely
+from shapely.geometry import shape
+from shapely.geometry.polygon import orient
+from shapely.strtree import STRtree
+
+from build_crosswalk import DEFAULT_KEY
+from build_feature_ids import COUNTY_KEY, feature_keys, key_fingerprint
+import instrument
+
+EXTENT = 4096
+BUFFER = 64
+
+# MVT geometry types / commands
+POLYGON = 3
+MOVE_TO, LINE_TO, CLOSE_PATH = 1, 2, 7
+
+# PMTiles v3 constants
+HEADER_SIZE = 127
+MAX_ROOT_SIZE = 16384 - HEADER_SIZE
+COMPRESSION_NONE, COMPRESSION_GZIP = 1, 2
+TILE_TYPE_MVT = 1
+
+# Layer name -> source file, identifying property, key template (as in
+# build_feature_ids.py) and zoom range. Precincts start at the zoom of the
+# statewide view, since the map draws them from these tiles
+DEFAULT_LAYERS = {
+    'counties': {
+        'path': 'data/nc_counties.geojson',
+        'id_property': 'County',
+        'key': COUNTY_KEY,
+        'minzoom': 4,
+        'maxzoom': 10
+    },
+    'precincts': {
+        'path': 'data/nc_precincts_enhanced_2024.geojson',
+        'id_property': 'PRECINCT',
+        'key': DEFAULT_KEY,
+        'minzoom': 5,
+        'maxzoom': 12
+    }
+}
+
+
+# --- Protobuf helpers ------------------------------------------------------
+
+def _varint(value):
+    out = bytearray()
+    while True:
+        byte = value & 0x7f
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def _zigzag(value):
+    return (value << 1) ^ (value >> 63)
+
+
+def _field(number, wire_type):
+    return _varint((number << 3) | wire_type)
+
+
+def _bytes_field(number, payload):
+    return _field(number, 2) + _varint(len(payload)) + payload
+
+
+def _varint_field(number, value):
+    return _field(number, 0) + _varint(value)
+
+
+def _packed_field(number, values):
+    return _bytes_field(number, b''.join(_varint(v) for v in values))
+
+
+def _read_varint(buf, pos):
+    result = shift = 0
+    while True:
+        byte = buf[pos]
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
+
+
+def _iter_fields(buf):
+    """Yield (field number, wire type, value) for a protobuf message"""
+    pos = 0
+    while pos < len(buf):
+        key, pos = _read_varint(buf, pos)
+        number, wire_type = key >> 3, key & 7
+        if wire_type == 0:
+            value, pos = _read_varint(buf, pos)
+        elif wire_type == 1:
+            value = buf[pos:pos + 8]
+            pos += 8
+        elif wire_type == 2:
+            length, pos = _read_varint(buf, pos)
+            value = buf[pos:pos + length]
+            pos += length
+        elif wire_type == 5:
+            value = buf[pos:pos + 4]
+            pos += 4
+        else:
+            raise ValueError(f"Unsupported protobuf wire type {wire_type}")
+        yield number, wire_type, value
+
+
+def _unpack_varints(buf):
+    values = []
+    pos = 0
+    while pos < len(buf):
+        value, pos = _read_varint(buf, pos)
+        values.append(value)
+    return values
+
+
+# --- MVT encoding ----------------------------------------------------------
+
+def _encode_value(value):
+    if isinstance(value, bool):
+        return _varint_field(7, int(value))
+    if isinstance(value, int):
+        if value >= 0:
+            return _varint_field(5, value)
+        return _varint_field(6, _zigzag(value))
+    if isinstance(value, float):
+        return _field(3, 1) + struct.pack('<d', value)
+    return _bytes_field(1, str(value).encode('utf-8'))
+
+
+def _decode_value(buf):
+    for number, _, value in _iter_fields(buf):
+        if number == 1:
+            return value.decode('utf-8')
+        if number == 2:
+            return struct.unpack('<f', value)[0]
+        if number == 3:
+            return struct.unpack('<d', value)[0]
+        if number in (4, 5):
+            return value
+        if number == 6:
+            return (value >> 1) ^ -(value & 1)
+        if number == 7:
+            return bool(value)
+    return None
+
+
+def _ring_commands(coords, cursor):
+    """Command integers for one ring; returns (commands, new cursor)"""
+    points = [tuple(p) for p in coords[:-1]]
+    deduped = [p for i, p in enumerate(points) if i == 0 or p != points[i - 1]]
+    if len(deduped) > 1 and deduped[-1] == deduped[0]:
+        deduped.pop()
+    if len(deduped) < 3:
+        return [], cursor
+
+    commands = [(MOVE_TO & 7) | (1 << 3)]
+    x, y = deduped[0]
+    commands += [_zigzag(x - cursor[0]), _zigzag(y - cursor[1])]
+    commands.append((LINE_TO & 7) | ((len(deduped) - 1) << 3))
+    for px, py in deduped[1:]:
+        commands += [_zigzag(px - x), _zigzag(py - y)]
+        x, y = px, py
+    commands.append((CLOSE_PATH & 7) | (1 << 3))
+    return commands, (x, y)
+
+
+def _polygon_commands(geometry):
+    """MVT command stream for a (multi)polygon already in integer tile coordinates"""
+    commands = []
+    cursor = (0, 0)
+    for polygon in shapely.get_parts(geometry):
+        if not isinstance(polygon, shapely.Polygon) or polygon.is_empty:
+            continue
+        # MVT wants exterior rings with positive area in tile space (y down)
+        polygon = orient(polygon, sign=1.0)
+        ring_commands, cursor_after = _ring_commands(
+            np.asarray(polygon.exterior.coords, dtype=np.int64).tolist(), cursor)
+        if not ring_commands:
+            continue
+        commands += ring_commands
+        cursor = cursor_after
+        for interior in polygon.interiors:
+            ring_commands, cursor = _ring_commands(
+                np.asarray(interior.coords, dtype=np.int64).tolist(), cursor)
+            commands += ring_commands
+    return commands
+
+
+def encode_layer(name, features):
+    """Encode one MVT layer from (feature_id, properties, tile geometry) tuples"""
+    keys, values = [], []
+    key_index, value_index = {}, {}
+    encoded_features = []
+
+    for feature_id, properties, geometry in features:
+        commands = _polygon_commands(geometry)
+        if not commands:
+            continue
+        tags = []
+        for key, value in properties.items():
+            if value is None or isinstance(value, (dict, list)):
+                continue
+            if key not in key_index:
+                key_index[key] = len(keys)
+                keys.append(key)
+            value_key = (type(value).__name__, value)
+            if value_key not in value_index:
+                value_index[value_key] = len(values)
+                values.append(value)
+            tags += [key_index[key], value_index[value_key]]
+        encoded_features.append(
+            _varint_field(1, feature_id)
+            + _packed_field(2, tags)
+            + _varint_field(3, POLYGON)
+            + _packed_field(4, commands)
+        )
+
+    if not encoded_features:
+        return b''
+
+    layer = _varint_field(15, 2) + _bytes_field(1, name.encode('utf-8'))
+    layer += b''.join(_bytes_field(2, f) for f in encoded_features)
+    layer += b''.join(_bytes_field(3, k.encode('utf-8')) for k in keys)
+    layer += b''.join(_bytes_field(4, _encode_value(v)) for v in values)
+    layer += _varint_field(5, EXTENT)
+    return _bytes_field(3, layer)
+
+
+def decode_tile(data):
+    """Decode an MVT tile into {layer: [{'id', 'properties', 'geometry'}]}"""
+    layers = {}
+    for number, _, layer_buf in _iter_fields(data):
+        if number != 3:
+            continue
+        name, keys, values, raw_features = None, [], [], []
+        for field, _, value in _iter_fields(layer_buf):
+            if field == 1:
+                name = value.decode('utf-8')
+            elif field == 2:
+                raw_features.append(value)
+            elif field == 3:
+                keys.append(value.decode('utf-8'))
+            elif field == 4:
+                values.append(_decode_value(value))
+        features = []
+        for raw in raw_features:
+            feature = {'id': None, 'properties': {}, 'geometry': []}
+            for field, _, value in _iter_fields(raw):
+                if field == 1:
+                    feature['id'] = value
+                elif field == 2:
+                    tags = _unpack_varints(value)
+                    for k, v in zip(tags[::2], tags[1::2]):
+                        feature['properties'][keys[k]] = values[v]
+                elif field == 4:
+                    feature['geometry'] = _unpack_varints(value)
+            features.append(feature)
+        layers[name] = features
+    return layers
+
+
+# --- Tiling ----------------------------------------------------------------
+
+def lonlat_to_world(coords):
+    """Project lon/lat coordinates to Web Mercator world units in [0, 1)"""
+    lon = coords[:, 0]
+    lat = np.clip(coords[:, 1], -85.0511287798, 85.0511287798)
+    x = (lon + 180.0) / 360.0
+    siny = np.sin(np.radians(lat))
+    y = 0.5 - np.log((1 + siny) / (1 - siny)) / (4 * math.pi)
+    return np.column_stack([x, y])
+
+
+def _has_geometry(feature):
+    geometry = feature.get('geometry')
+    return bool(geometry and geometry.get('coordinates'))
+
+
+def load_layer(name, config):
+    """Read a GeoJSON layer and project it; returns features and world geometries.
+
+    Features with a null or empty geometry keep their position (and so the ids
+    of the others) but get no geometry, so they are never cut into a tile.
+    """
+    print(f"Reading {config['path']}...")
+    with instrument.stage(f'read_{name}', inputs=[config['path']]), open(config['path'], 'r') as f:
+        features = json.load(f)['features']
+    geometries = np.array([shape(feature['geometry']) if _has_geometry(feature) else None
+                           for feature in features], dtype=object)
+    geometries[shapely.is_empty(geometries)] = None
+    skipped = int(shapely.is_missing(geometries).sum())
+    if skipped:
+        print(f"  Skipping {skipped} features without geometry")
+    world = shapely.transform(geometries, lonlat_to_world)
+    return {
+        'name': name,
+        'features': features,
+        'world': world,
+        'bounds': shapely.total_bounds(geometries),
+        'minzoom': config['minzoom'],
+        'maxzoom': config['maxzoom'],
+        'id_property': config.get('id_property'),
+        # The page colors tiles by feature id only when this matches the feature id index
+        'fingerprint': key_fingerprint(feature_keys([feature.get('properties') for feature in features],
+                                                    config.get('key', COUNTY_KEY))[0])
+    }
+
+
+def tile_range(bounds, z):
+    """Tile x/y ranges covering world-space bounds at zoom z"""
+    n = 1 << z
+    minx, miny, maxx, maxy = bounds
+    return (
+        range(max(0, int(minx * n)), min(n - 1, int(maxx * n)) + 1),
+        range(max(0, int(miny * n)), min(n - 1, int(maxy * n)) + 1)
+    )
+
+
+def build_tiles(layers, tolerance_px=0.5):
+    """Yield (z, x, y, tile bytes) for every non-empty tile of every layer.
+
+    Geometries are simplified once per zoom; tolerance_px is measured in
+    screen pixels of a 512px tile.
+    """
+    minzoom = min(layer['minzoom'] for layer in layers)
+    maxzoom = max(layer['maxzoom'] for layer in layers)
+    bounds = shapely.total_bounds(np.concatenate([layer['world'] for layer in layers]))
+
+    for z in range(minzoom, maxzoom + 1):
+        n = 1 << z
+        tile_size = 1.0 / n
+        tolerance = tile_size * tolerance_px / 512.0
+        margin = tile_size * BUFFER / EXTENT
+
+        zoom_layers = []
+        for layer in layers:
+            if not layer['minzoom'] <= z <= layer['maxzoom']:
+                continue
+            simplified = shapely.simplify(layer['world'], tolerance, preserve_topology=True)
+            zoom_layers.append((layer, simplified, STRtree(simplified)))
+        print(f"  zoom {z}: {', '.join(layer['name'] for layer, _, _ in zoom_layers)}")
+
+        xs, ys = tile_range(bounds, z)
+        for x in xs:
+            for y in ys:
+                x0, y0 = x * tile_size, y * tile_size
+                clip_box = (x0 - margin, y0 - margin, x0 + tile_size + margin, y0 + tile_size + margin)
+                tile = b''
+                for layer, simplified, tree in zoom_layers:
+                    candidates = np.sort(tree.query(shapely.box(*clip_box)))
+                    if not len(candidates):
+                        continue
+                    clipped = shapely.clip_by_rect(simplified[candidates], *clip_box)
+                    scale = EXTENT / tile_size
+                    to_tile = lambda c: np.round((c - (x0, y0)) * scale)
+                    tiled = shapely.transform(clipped, to_tile)
+                    tile += encode_layer(layer['name'], (
+                        (int(i), layer['features'][i]['properties'] or {}, geom)
+                        for i, geom in zip(candidates.tolist(), tiled)
+                        if not geom.is_empty
+                    ))
+                if tile:
+                    yield z, x, y, tile
+
+
+# --- PMTiles ---------------------------------------------------------------
+
+def zxy_to_tile_id(z, x, y):
+    """PMTiles tile id: tiles of lower zooms first, then Hilbert order"""
+    acc = ((1 << (2 * z)) - 1) // 3
+    n = 1 << z
+    d = 0
+    s = n >> 1
+    while s > 0:
+        rx = 1 if x & s else 0
+        ry = 1 if y & s else 0
+        d += s * s * ((3 * rx) ^ ry)
+        if ry == 0:
+            if rx == 1:
+                x = s - 1 - x
+                y = s - 1 - y
+            x, y = y, x
+        s >>= 1
+    return acc + d
+
+
+def tile_id_to_zxy(tile_id):
+    z = 0
+    acc = 0
+    while True:
+        count = 1 << (2 * z)
+        if tile_id < acc + count:
+            break
+        acc += count
+        z += 1
+    d = tile_id - acc
+    x = y = 0
+    s = 1
+    n = 1 << z
+    while s < n:
+        rx = 1 & (d // 2)
+        ry = 1 & (d ^ rx)
+        if ry == 0:
+            if rx == 1:
+                x = s - 1 - x
+                y = s - 1 - y
+            x, y = y, x
+        x += s * rx
+        y += s * ry
+        d //= 4
+        s <<= 1
+    return z, x, y
+
+
+def _serialize_directory(entries):
+    """entries: list of (tile_id, offset, length, run_length), sorted by tile_id"""
+    out = bytearray(_varint(len(entries)))
+    last_id = 0
+    for tile_id, _, _, _ in entries:
+        out += _varint(tile_id - last_id)
+        last_id = tile_id
+    for _, _, _, run_length in entries:
+        out += _varint(run_length)
+    for _, _, length, _ in entries:
+        out += _varint(length)
+    for i, (_, offset, _, _) in enumerate(entries):
+        previous = entries[i - 1] if i else None
+        if previous and offset == previous[1] + previous[2]:
+            out += _varint(0)
+        else:
+            out += _varint(offset + 1)
+    return gzip.compress(bytes(out), mtime=0)
+
+
+def _deserialize_directory(data):
+    buf = gzip.decompress(data)
+    count, pos = _read_varint(buf, 0)
+    columns = []
+    for _ in range(4):
+        column = []
+        for _ in range(count):
+            value, pos = _read_varint(buf, pos)
+            column.append(value)
+        columns.append(column)
+    entries = []
+    last_id = 0
+    for i in range(count):
+        last_id += columns[0][i]
+        raw_offset = columns[3][i]
+        if raw_offset == 0 and i:
+            offset = entries[i - 1][1] + entries[i - 1][2]
+        else:
+            offset = raw_offset - 1
+        entries.append((last_id, offset, columns[2][i], columns[1][i]))
+    return entries
+
+
+def _build_directories(entries):
+    """Root directory bytes and leaf directory bytes, splitting into leaves if needed"""
+    root = _serialize_directory(entries)
+    if len(root) <= MAX_ROOT_SIZE:
+        return root, b''
+
+    leaf_size = 4096
+    while True:
+        leaves = bytearray()
+        root_entries = []
+        for start in range(0, len(entries), leaf_size):
+            chunk = entries[start:start + leaf_size]
+            leaf = _serialize_directory(chunk)
+            root_entries.append((chunk[0][0], len(leaves), len(leaf), 0))
+            leaves += leaf
+        root = _serialize_directory(root_entries)
+        if len(root) <= MAX_ROOT_SIZE:
+            return root, bytes(leaves)
+        leaf_size *= 2
+
+
+def write_pmtiles(tiles, output_file, metadata, bounds_lonlat, minzoom, maxzoom):
+    """Write (z, x, y, data) tiles to a clustered PMTiles v3 archive"""
+    tile_data = bytearray()
+    contents = {}
+    entries = []
+    for tile_id, data in sorted((zxy_to_tile_id(z, x, y), data) for z, x, y, data in tiles):
+        compressed = gzip.compress(data, mtime=0)
+        digest = hashlib.sha256(compressed).digest()
+        if digest not in contents:
+            contents[digest] = (len(tile_data), len(compressed))
+            tile_data += compressed
+        offset, length = contents[digest]
+        last = entries[-1] if entries else None
+        if last and last[0] + last[3] == tile_id and last[1] == offset:
+            entries[-1] = (last[0], last[1], last[2], last[3] + 1)
+        else:
+            entries.append((tile_id, offset, length, 1))
+
+    root, leaves = _build_directories(entries)
+    metadata_bytes = gzip.compress(json.dumps(metadata).encode('utf-8'), mtime=0)
+
+    root_offset = HEADER_SIZE
+    metadata_offset = root_offset + len(root)
+    leaves_offset = metadata_offset + len(metadata_bytes)
+    data_offset = leaves_offset + len(leaves)
+
+    min_lon, min_lat, max_lon, max_lat = bounds_lonlat
+    e7 = lambda v: int(round(v * 10_000_000))
+    header = b'PMTiles' + bytes([3])
+    header += struct.pack(
+        '<11Q',
+        root_offset, len(root), metadata_offset, len(metadata_bytes),
+        leaves_offset, len(leaves), data_offset, len(tile_data),
+        sum(e[3] for e in entries), len(entries), len(contents)
+    )
+    header += struct.pack('<6B', 1, COMPRESSION_GZIP, COMPRESSION_GZIP, TILE_TYPE_MVT, minzoom, maxzoom)
+    header += struct.pack('<4i', e7(min_lon), e7(min_lat), e7(max_lon), e7(max_lat))
+    header += struct.pack('<B2i', minzoom, e7((min_lon + max_lon) / 2), e7((min_lat + max_lat) / 2))
+    assert len(header) == HEADER_SIZE
+
+    output_dir = os.path.dirname(output_file)
+    if output_dir and not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    with open(output_file, 'wb') as f:
+        f.write(header)
+        f.write(root)
+        f.write(metadata_bytes)
+        f.write(leaves)
+        f.write(tile_data)
+
+    return {'tiles': sum(e[3] for e in entries), 'unique_tiles': len(contents), 'entries': len(entries)}
+
+
+def read_pmtiles(input_file):
+    """Read a PMTiles archive; returns (header dict, metadata, {(z, x, y): tile bytes})"""
+    with open(input_file, 'rb') as f:
+        data = f.read()
+    if data[:7] != b'PMTiles' or data[7] != 3:
+        raise ValueError(f"Not a PMTiles v3 archive: {input_file}")
+    (root_offset, root_length, metadata_offset, metadata_length,
+     leaves_offset, leaves_length, data_offset, data_length,
+     addressed, entry_count, content_count) = struct.unpack_from('<11Q', data, 8)
+    header = {
+        'addressed_tiles': addressed,
+        'tile_entries': entry_count,
+        'tile_contents': content_count,
+        'minzoom': data[100],
+        'maxzoom': data[101]
+    }
+    metadata = json.loads(gzip.decompress(data[metadata_offset:metadata_offset + metadata_length]))
+
+    tiles = {}
+
+    def walk(entries):
+        for tile_id, offset, length, run_length in entries:
+            if run_length == 0:
+                start = leaves_offset + offset
+                walk(_deserialize_directory(data[start:start + length]))
+                continue
+            start = data_offset + offset
+            tile = gzip.decompress(data[start:start + length])
+            for i in range(run_length):
+                tiles[tile_id_to_zxy(tile_id + i)] = tile
+
+    walk(_deserialize_directory(data[root_offset:root_offset + root_length]))
+    return header, metadata, tiles
+
+
+def write_tile_directory(tiles, output_dir, metadata, minzoom, maxzoom):
+    """Also write tiles as {z}/{x}/{y}.pbf plus a TileJSON, which Mapbox GL can
+    load as a plain ``vector`` source on hosts without PMTiles support.
+    Zoom directories from an earlier build are cleared first, so tiles that no
+    longer exist are not left behind for the page to fetch."""
+    if os.path.isdir(output_dir):
+        for name in os.listdir(output_dir):
+            if name.isdigit():
+                shutil.rmtree(os.path.join(output_dir, name))
+    for z, x, y, data in tiles:
+        tile_dir = os.path.join(output_dir, str(z), str(x))
+        os.makedirs(tile_dir, exist_ok=True)
+        with open(os.path.join(tile_dir, f'{y}.pbf'), 'wb') as f:
+            f.write(data)
+    tilejson = dict(metadata, tilejson='3.0.0', tiles=['{z}/{x}/{y}.pbf'], minzoom=minzoom, maxzoom=maxzoom)
+    with open(os.path.join(output_dir, 'tiles.json'), 'w') as f:
+        json.dump(tilejson, f, indent=2)
+
+
+# --- Build / verify --------------------------------------------------------
+
+def build_archive(layer_configs, output_file, tolerance_px=0.5, tile_dir=None):
+    layers = [load_layer(name, config) for name, config in layer_configs.items()]
+
+    print("Cutting tiles...")
+    with instrument.stage('cut_tiles') as stage:
+        tiles = list(build_tiles(layers, tolerance_px))
+        stage.count('tiles', len(tiles))
+
+    all_bounds = np.array([layer['bounds'] for layer in layers])
+    lonlat_bounds = (*all_bounds[:, :2].min(axis=0), *all_bounds[:, 2:].max(axis=0))
+    metadata = {
+        'name': os.path.splitext(os.path.basename(output_file))[0],
+        'format': 'pbf',
+        'vector_layers': [
+            {
+                'id': layer['name'],
+                'fields': {
+                    key: 'String' if isinstance(value, str) else 'Number'
+                    for key, value in (layer['features'][0]['properties'] or {}).items()
+                    if not isinstance(value, (dict, list))
+                } if layer['features'] else {},
+                'minzoom': layer['minzoom'],
+                'maxzoom': layer['maxzoom'],
+                'features': len(layer['features']),
+                'fingerprint': layer['fingerprint']
+            }
+            for layer in layers
+        ]
+    }
+    minzoom = min(layer['minzoom'] for layer in layers)
+    maxzoom = max(layer['maxzoom'] for layer in layers)
+    with instrument.stage('write', outputs=[output_file] + ([tile_dir] if tile_dir else [])):
+        stats = write_pmtiles(tiles, output_file, metadata, tuple(float(v) for v in lonlat_bounds), minzoom, maxzoom)
+        if tile_dir:
+            write_tile_directory(tiles, tile_dir, metadata, minzoom, maxzoom)
+
+    size = os.path.getsize(output_file) / (1024 * 1024)
+    print(f"\nWrote {output_file}: {stats['tiles']} tiles "
+          f"({stats['unique_tiles']} unique), {size:.2f}MB")
+    return stats
+
+
+def verify_archive(archive_file, layer_configs):
+    """Decode every tile and check feature ids against the source GeoJSON"""
+    header, metadata, tiles = read_pmtiles(archive_file)
+    print(f"Decoded {len(tiles)} tiles from {archive_file}")
+
+    seen = {}
+    seen_at_maxzoom = {}
+    problems = 0
+    sources = {}
+    for name, config in layer_configs.items():
+        with open(config['path'], 'r') as f:
+            sources[name] = json.load(f)['features']
+
+    for (z, x, y), data in tiles.items():
+        for name, features in decode_tile(data).items():
+            source = sources.get(name)
+            if source is None:
+                print(f"  unexpected layer '{name}' in tile {z}/{x}/{y}")
+                problems += 1
+                continue
+            id_property = layer_configs[name].get('id_property')
+            for feature in features:
+                feature_id = feature['id']
+                if feature_id is None or feature_id >= len(source):
+                    print(f"  {name} {z}/{x}/{y}: feature id {feature_id} not in source")
+                    problems += 1
+                    continue
+                expected = (source[feature_id]['properties'] or {}).get(id_property)
+                if id_property and feature['properties'].get(id_property) != expected:
+                    print(f"  {name} {z}/{x}/{y}: feature {feature_id} has "
+                          f"{id_property}={feature['properties'].get(id_property)!r}, source has {expected!r}")
+                    problems += 1
+                seen.setdefault(name, set()).add(feature_id)
+                if z == layer_configs[name]['maxzoom']:
+                    seen_at_maxzoom.setdefault(name, set()).add(feature_id)
+
+    for name, source in sources.items():
+        expected_ids = {i for i, f in enumerate(source) if _has_geometry(f)}
+        missing = expected_ids - seen_at_maxzoom.get(name, set())
+        print(f"  {name}: {len(seen.get(name, ()))} of {len(expected_ids)} features present, "
+              f"{len(missing)} missing at zoom {layer_configs[name]['maxzoom']}")
+        if missing:
+            problems += len(missing)
+            print(f"    missing ids: {sorted(missing)[:20]}")
+
+    print("Verification passed" if not problems else f"Verification found {problems} problems")
+    return problems
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build a PMTiles vector-tile archive for the county and precinct layers')
+    parser.add_argument('--counties', default=DEFAULT_LAYERS['counties']['path'])
+    parser.add_argument('--precincts', default=DEFAULT_LAYERS['precincts']['path'])
+    parser.add_argument('--output', default='data/tiles/nc_map.pmtiles')
+    parser.add_argument('--tile-dir', help='Also write the tiles as a {z}/{x}/{y}.pbf directory')
+    parser.add_argument('--tolerance-px', type=float, default=0.5,
+                        help='Simplification tolerance in screen pixels at each zoom (default: 0.5)')
+    parser.add_argument('--verify', action='store_true',
+                        help='Decode an existing archive and check feature ids against the sources')
+    instrument.add_arguments(parser)
+    args = parser.parse_args()
+
+    layer_configs = {name: dict(config) for name, config in DEFAULT_LAYERS.items()}
+    layer_configs['counties']['path'] = args.counties
+    layer_configs['precincts']['path'] = args.precincts
+
+    with instrument.run('build_vector_tiles', args):
+        if args.verify:
+            with instrument.stage('verify', inputs=[args.output]):
+                problems = verify_archive(args.output, layer_configs)
+            raise SystemExit(1 if problems else 0)
+        build_archive(layer_configs, args.output, args.tolerance_px, args.tile_dir)
@@ -1,25 +1,50 @@
 import os
+import argparse
 import pandas as pd
 
-folder = '.'
+import instrument
+import csv_stats
 
-for filename in os.listdir(folder):
-    if filename.endswith('_election_only.csv'):
-        path = os.path.join(folder, filename)
-        try:
-            df = pd.read_csv(path)
-            # Use the correct column for district
-            district_col = None
-            for col in df.columns:
-                if col.strip().lower() in ['id', 'district']:
-                    district_col = col
-                    break
-            if not district_col:
-                print(f"Error: No district column in {filename}")
-                continue
-            valid_rows = df[district_col].astype(str).str.strip().str.lower().isin([str(i) for i in range(1, 15)])
-            if valid_rows.sum() == 0:
-                os.remove(path)
-                print(f"Deleted empty or duplicate file: {filename}")
-        except Exception as e:
-            print(f"Error processing {filename}: {e}")
+SUFFIXES = ('_election_only.csv', '_election_results_only.csv')
+
+def cleanup_empty_election_only(folder='.'):
+    """Delete *_election_only.csv and *_election_results_only.csv files without a single row for districts 1-14.
+
+    Files whose stats in csv_stats.json are still current are decided from
+    the stats; the others are read once and recorded there.
+    """
+    stats = csv_stats.load_stats(folder)
+    with instrument.stage('cleanup') as stage:
+        for filename in os.listdir(folder):
+            if filename.endswith(SUFFIXES):
+                path = os.path.join(folder, filename)
+                try:
+                    entry = csv_stats.lookup(stats, path)
+                    if entry is None:
+                        df = pd.read_csv(path)
+                        stage.add_input(path)
+                        # Use the correct column for district
+                        district_col = csv_stats.district_column(df.columns)
+                        district_rows = csv_stats.count_district_rows(df[district_col]) if district_col else 0
+                        csv_stats.record(stats, path, len(df), district_rows, district_col)
+                        entry = stats[filename]
+                    else:
+                        stage.count('from_stats')
+                    if not entry['district_column']:
+                        print(f"Error: No district column in {filename}")
+                        continue
+                    if entry['district_rows'] == 0:
+                        os.remove(path)
+                        csv_stats.forget(stats, path)
+                        print(f"Deleted empty or duplicate file: {filename}")
+                        stage.count('deleted')
+                except Exception as e:
+                    print(f"Error processing {filename}: {e}")
+    csv_stats.save_stats(folder, stats)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Delete election-only CSVs with no district rows')
+    parser.add_argument('folder', nargs='?', default='.', help='Directory with the CSV files (default: current directory)')
+    args = parser.parse_args()
+    with instrument.run('cleanup_empty_election_only'):
+        cleanup_empty_election_only(args.folder)
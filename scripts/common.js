@@ -178,8 +178,122 @@ class MobileWarning {
     }
 }
 
+// Per-contest access to the split election files (optimize_split_data.py).
+// Each year's .blocks file holds every contest as its own gzip member, and the
+// index lists the byte range of each one, so loading a contest costs one Range
+// request and decompresses only that contest. Dictionary-encoded (version 2.0)
+// files also fetch the year's county/precinct dictionary block, once per year.
+class SplitElectionData {
+    constructor(baseUrl = 'data/elections/', resolveUrl = path => path) {
+        this.baseUrl = baseUrl;
+        this.resolveUrl = resolveUrl;
+        this.indexPromise = null;
+        this.contests = new Map();
+        this.dictionaries = new Map();
+    }
+
+    index() {
+        if (!this.indexPromise) {
+            this.indexPromise = fetch(this.resolveUrl(`${this.baseUrl}election_data_index.json`))
+                .then(response => {
+                    if (!response.ok) throw new Error(`Split index: HTTP ${response.status}`);
+                    return response.json();
+                });
+        }
+        return this.indexPromise;
+    }
+
+    static async gunzip(buffer) {
+        const stream = new Blob([buffer]).stream().pipeThrough(new DecompressionStream('gzip'));
+        return new Response(stream).text();
+    }
+
+    // Resolves to {type, results, meta}, or null if the year or contest is unknown
+    contest(year, contestId) {
+        const key = `${year}/${contestId}`;
+        if (!this.contests.has(key)) {
+            const loading = this.loadContest(String(year), contestId);
+            loading.catch(() => this.contests.delete(key));
+            this.contests.set(key, loading);
+        }
+        return this.contests.get(key);
+    }
+
+    async loadContest(year, contestId) {
+        const index = await this.index();
+        const entry = index.years[year];
+        if (!entry || !entry.contests.includes(contestId)) return null;
+        const encoded = parseInt(index.version, 10) >= 2;
+
+        if (!entry.blocks) {
+            // Split output without .blocks files: fetch and decompress the whole year
+            const response = await fetch(this.resolveUrl(`${this.baseUrl}${entry.file}`));
+            if (!response.ok) throw new Error(`${entry.file}: HTTP ${response.status}`);
+            const yearData = JSON.parse(await SplitElectionData.gunzip(await response.arrayBuffer()));
+            const contest = yearData.contests[contestId];
+            if (!encoded) return contest;
+            const keys = SplitElectionData.precinctKeys(yearData.dictionary);
+            return SplitElectionData.decodeContest(contest, yearData.dictionary, keys);
+        }
+
+        const [offset, size] = entry.blocks.offsets[contestId];
+        const contest = await this.loadBlock(entry.blocks.file, offset, size);
+        if (!encoded) return contest;
+        const { dictionary, keys } = await this.dictionary(year, entry.blocks);
+        return SplitElectionData.decodeContest(contest, dictionary, keys);
+    }
+
+    async loadBlock(file, offset, size) {
+        const response = await fetch(this.resolveUrl(`${this.baseUrl}${file}`), {
+            headers: { Range: `bytes=${offset}-${offset + size - 1}` }
+        });
+        if (!response.ok) throw new Error(`${file}: HTTP ${response.status}`);
+        let buffer = await response.arrayBuffer();
+        // A server that ignores Range answers 200 with the whole file
+        if (response.status !== 206) buffer = buffer.slice(offset, offset + size);
+        return JSON.parse(await SplitElectionData.gunzip(buffer));
+    }
+
+    // Resolves to {dictionary, keys} for a 2.0 year
+    dictionary(year, blocks) {
+        if (!this.dictionaries.has(year)) {
+            const [offset, size] = blocks.dictionary;
+            const loading = this.loadBlock(blocks.file, offset, size)
+                .then(dictionary => ({ dictionary, keys: SplitElectionData.precinctKeys(dictionary) }));
+            loading.catch(() => this.dictionaries.delete(year));
+            this.dictionaries.set(year, loading);
+        }
+        return this.dictionaries.get(year);
+    }
+
+    // Precinct keys of a 2.0 dictionary: the county with spaces replaced by
+    // '_', then '_' and the precinct name, unless the name is the whole key
+    static precinctKeys(dictionary) {
+        const prefixes = dictionary.counties.map(county => county.replace(/ /g, '_') + '_');
+        const keys = dictionary.precinct_names.map((name, i) => prefixes[dictionary.precinct_county[i]] + name);
+        for (const i of dictionary.unprefixed || []) keys[i] = dictionary.precinct_names[i];
+        return keys;
+    }
+
+    // A 2.0 contest ({type, p, d, r, meta}; p holds index deltas) as {type, results, meta}
+    static decodeContest(contest, dictionary, keys) {
+        const results = {};
+        let precinct = 0;
+        for (let i = 0; i < contest.p.length; i++) {
+            precinct += contest.p[i];
+            results[keys[precinct]] = {
+                d: contest.d[i],
+                r: contest.r[i],
+                c: dictionary.counties[dictionary.precinct_county[precinct]]
+            };
+        }
+        return { type: contest.type, results, meta: contest.meta };
+    }
+}
+
 // Export managers for use in other files
 window.LoadingManager = LoadingManager;
 window.AnalyticsManager = AnalyticsManager;
 window.SocialShare = SocialShare;
 window.MobileWarning = MobileWarning;
+window.SplitElectionData = SplitElectionData;
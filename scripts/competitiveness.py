@@ -0,0 +1,200 @@
+"""
+Vectorized margin / competitiveness classification.
+
+Turns whole arrays of dem/rep votes into the derived fields every precinct row
+of the comprehensive JSON carries (margin, margin_pct, winner and the nested
+competitiveness object) in a single batched pass, using the scale stored in
+``metadata.categorization_system.competitiveness_scale``.
+
+Categories are found with one ``searchsorted`` over the scale's signed bin
+edges (R minus D, in percent of the two-party vote). A margin sitting exactly
+on an edge falls in the bin on the Democratic side, which is what the stored
+data does (e.g. R+20.00 is Safe, D+20.00 is Stronghold).
+"""
+
+import re
+import json
+import argparse
+
+import numpy as np
+
+import instrument
+
+DEFAULT_SCALE = {
+    'Republican': [
+        {'category': 'Annihilation', 'range': 'R+40%+', 'color': '#67000d'},
+        {'category': 'Dominant', 'range': 'R+30-40%', 'color': '#a50f15'},
+        {'category': 'Stronghold', 'range': 'R+20-30%', 'color': '#cb181d'},
+        {'category': 'Safe', 'range': 'R+10-20%', 'color': '#ef3b2c'},
+        {'category': 'Likely', 'range': 'R+5.5-10%', 'color': '#fb6a4a'},
+        {'category': 'Lean', 'range': 'R+1-5.5%', 'color': '#fcae91'},
+        {'category': 'Tilt', 'range': 'R+0.5-1%', 'color': '#fee8c8'}
+    ],
+    'Tossup': [
+        {'category': 'Tossup', 'range': '±0.5%', 'color': '#f7f7f7'}
+    ],
+    'Democratic': [
+        {'category': 'Tilt', 'range': 'D+0.5-1%', 'color': '#e1f5fe'},
+        {'category': 'Lean', 'range': 'D+1-5.5%', 'color': '#c6dbef'},
+        {'category': 'Likely', 'range': 'D+5.5-10%', 'color': '#9ecae1'},
+        {'category': 'Safe', 'range': 'D+10-20%', 'color': '#6baed6'},
+        {'category': 'Stronghold', 'range': 'D+20-30%', 'color': '#3182bd'},
+        {'category': 'Dominant', 'range': 'D+30-40%', 'color': '#08519c'},
+        {'category': 'Annihilation', 'range': 'D+40%+', 'color': '#08306b'}
+    ]
+}
+
+NO_DATA_COLOR = '#e0e0e0'
+
+WINNERS = np.array(['DEM', 'TIE', 'REP'])
+
+_RANGE_LOWER = re.compile(r'^[RD]\+([0-9.]+)')
+
+
+def _lower_bound(entry):
+    match = _RANGE_LOWER.match(entry['range'])
+    if not match:
+        raise ValueError(f"Cannot parse competitiveness range '{entry['range']}'")
+    return float(match.group(1))
+
+
+def build_scale(competitiveness_scale=None):
+    """Bin edges and per-bin labels for a competitiveness scale.
+
+    Bins run from the strongest Democratic category to the strongest
+    Republican one; ``edges`` holds the signed lower bounds between them.
+    """
+    scale = competitiveness_scale or DEFAULT_SCALE
+    democratic = sorted(scale['Democratic'], key=_lower_bound, reverse=True)
+    republican = sorted(scale['Republican'], key=_lower_bound)
+    tossup = scale['Tossup'][0]
+
+    bins = [('Democratic', 'D_', entry) for entry in democratic]
+    bins.append(('Tossup', '', tossup))
+    bins.extend(('Republican', 'R_', entry) for entry in republican)
+
+    edges = [-_lower_bound(entry) for entry in democratic]
+    edges += [_lower_bound(entry) for entry in republican]
+
+    return {
+        'edges': np.array(edges, dtype=np.float64),
+        'categories': np.array([entry['category'] for _, _, entry in bins]),
+        'parties': np.array([party for party, _, _ in bins]),
+        'codes': np.array([prefix + entry['category'].upper() for _, prefix, entry in bins]),
+        'colors': np.array([entry['color'] for _, _, entry in bins])
+    }
+
+
+def scale_from_metadata(metadata):
+    """Scale from the comprehensive JSON's metadata block, or the default one"""
+    system = (metadata or {}).get('categorization_system', {})
+    return build_scale(system.get('competitiveness_scale'))
+
+
+def round_pct(values):
+    """Round to two decimals exactly as Python's round(x, 2) does.
+
+    ``np.round`` scales by 100 first, which can land on the other side of a
+    half for a handful of values; those few are re-rounded in Python.
+    """
+    scaled = values * 100
+    rounded = np.rint(scaled) / 100
+    fraction = np.abs(scaled - np.trunc(scaled))
+    ambiguous = np.flatnonzero(np.abs(fraction - 0.5) < 1e-6)
+    for i in ambiguous.tolist():
+        rounded[i] = round(float(values[i]), 2)
+    return rounded
+
+
+def classify(dem_votes, rep_votes, scale=None):
+    """Derive margin, margin_pct, winner and category for whole vote arrays.
+
+    Returns a dict of arrays; ``category`` indexes into the scale's
+    ``codes`` / ``categories`` / ``parties`` / ``colors``.
+    """
+    if scale is None:
+        scale = build_scale()
+    dem = np.asarray(dem_votes, dtype=np.int64)
+    rep = np.asarray(rep_votes, dtype=np.int64)
+
+    margin = rep - dem
+    two_party = dem + rep
+    with np.errstate(divide='ignore', invalid='ignore'):
+        raw_pct = np.where(two_party > 0, margin / np.maximum(two_party, 1) * 100, 0.0)
+    margin_pct = round_pct(raw_pct)
+
+    return {
+        'margin': margin,
+        'two_party_total': two_party,
+        'margin_pct': margin_pct,
+        'winner': WINNERS[np.sign(margin) + 1],
+        'category': np.searchsorted(scale['edges'], margin_pct, side='left')
+    }
+
+
+def competitiveness_objects(categories, scale=None):
+    """Nested competitiveness dicts (as stored per precinct) for category indexes"""
+    if scale is None:
+        scale = build_scale()
+    lookup = [
+        {
+            'category': str(scale['categories'][i]),
+            'party': str(scale['parties'][i]),
+            'code': str(scale['codes'][i]),
+            'color': str(scale['colors'][i])
+        }
+        for i in range(len(scale['codes']))
+    ]
+    return [lookup[i] for i in np.asarray(categories).tolist()]
+
+
+def verify_file(input_file):
+    """Recompute every derived precinct field and compare with the stored values"""
+    with open(input_file, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    scale = scale_from_metadata(data.get('metadata'))
+
+    mismatches = 0
+    checked = 0
+    for year, contests in data.get('results_by_year', {}).items():
+        for contest_type, contest_data in contests.items():
+            for contest_id, details in contest_data.items():
+                rows = list(details.get('results', {}).items())
+                if not rows:
+                    continue
+                derived = classify(
+                    [row.get('dem_votes', 0) for _, row in rows],
+                    [row.get('rep_votes', 0) for _, row in rows],
+                    scale
+                )
+                objects = competitiveness_objects(derived['category'], scale)
+                for i, (precinct_id, row) in enumerate(rows):
+                    expected = {
+                        'margin': int(derived['margin'][i]),
+                        'two_party_total': int(derived['two_party_total'][i]),
+                        'margin_pct': float(derived['margin_pct'][i]),
+                        'winner': str(derived['winner'][i]),
+                        'competitiveness': objects[i]
+                    }
+                    for field, value in expected.items():
+                        if field in row and row[field] != value:
+                            mismatches += 1
+                            if mismatches <= 20:
+                                print(f"  {year} {contest_id} {precinct_id}: {field} stored {row[field]!r}, computed {value!r}")
+                checked += len(rows)
+                print(f"Checked {contest_id}: {len(rows)} precincts")
+
+    print(f"\n{checked} precincts checked, {mismatches} mismatched fields")
+    return mismatches
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check stored margin/competitiveness fields against the vectorized classifier')
+    parser.add_argument('files', nargs='+', help='Comprehensive-format result files (e.g. data/results_2010.json)')
+    instrument.add_arguments(parser)
+    args = parser.parse_args()
+
+    with instrument.run('competitiveness', args), instrument.stage('verify', inputs=args.files) as stage:
+        total = sum(verify_file(path) for path in args.files)
+        stage.count('mismatches', total)
+    raise SystemExit(1 if total else 0)
@@ -0,0 +1,67 @@
+"""
+Row-validity stats for the election CSVs, kept next to them in csv_stats.json.
+
+extract_election_results.py records every CSV it writes (its row count and
+how many rows belong to districts 1-14), and cleanup_empty_election_only.py
+records each CSV it has had to open. An entry is only trusted while the
+file's size and modification time still match, so a CSV is read again only
+after it changes.
+"""
+
+import os
+import json
+
+STATS_FILE = 'csv_stats.json'
+DISTRICTS = [str(i) for i in range(1, 15)]
+
+
+def load_stats(folder):
+    path = os.path.join(folder, STATS_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_stats(folder, stats):
+    with open(os.path.join(folder, STATS_FILE), 'w', encoding='utf-8') as f:
+        json.dump(stats, f, indent=2, sort_keys=True)
+
+
+def district_column(columns):
+    """The column holding the district number ('ID' or 'District'), or None"""
+    for col in columns:
+        if col.strip().lower() in ['id', 'district']:
+            return col
+    return None
+
+
+def count_district_rows(values):
+    """Number of values that name a district 1-14 (a pandas Series)"""
+    return int(values.astype(str).str.strip().str.lower().isin(DISTRICTS).sum())
+
+
+def lookup(stats, path):
+    """The recorded stats of a CSV, or None if it is unknown or changed since"""
+    entry = stats.get(os.path.basename(path))
+    if entry is None:
+        return None
+    stat = os.stat(path)
+    if entry['size'] != stat.st_size or entry['mtime_ns'] != stat.st_mtime_ns:
+        return None
+    return entry
+
+
+def record(stats, path, rows, district_rows, column):
+    stat = os.stat(path)
+    stats[os.path.basename(path)] = {
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'rows': rows,
+        'district_rows': district_rows,
+        'district_column': column
+    }
+
+
+def forget(stats, path):
+    stats.pop(os.path.basename(path), None)
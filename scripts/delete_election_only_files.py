@@ -1,5 +1,7 @@
 import os
 
+import instrument
+
 def delete_election_only_files(directory):
     count = 0
     for filename in os.listdir(directory):
@@ -16,4 +18,5 @@ def delete_election_only_files(directory):
 if __name__ == "__main__":
     # Change this to the directory where your data files are stored
     data_dir = os.path.dirname(os.path.abspath(__file__))
-    delete_election_only_files(data_dir)
+    with instrument.run('delete_election_only_files'), instrument.stage('delete'):
+        delete_election_only_files(data_dir)
@@ -1,10 +1,22 @@
 import os
+import argparse
 
-folder = '.'
+import instrument
 
-for filename in os.listdir(folder):
-    if filename.endswith('.csv'):
-        path = os.path.join(folder, filename)
-        if os.path.getsize(path) == 0:
-            os.remove(path)
-            print(f"Deleted empty file: {filename}")
+def delete_empty_files(folder='.'):
+    """Remove zero-byte CSV files"""
+    with instrument.stage('delete') as stage:
+        for filename in os.listdir(folder):
+            if filename.endswith('.csv'):
+                path = os.path.join(folder, filename)
+                if os.path.getsize(path) == 0:
+                    os.remove(path)
+                    print(f"Deleted empty file: {filename}")
+                    stage.count('deleted')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Delete empty CSV files')
+    parser.add_argument('folder', nargs='?', default='.', help='Directory with the CSV files (default: current directory)')
+    args = parser.parse_args()
+    with instrument.run('delete_empty_files'):
+        delete_empty_files(args.folder)
@@ -1,42 +1,191 @@
 import os
-import shutil
+import re
+import glob
+import gzip
+import json
 import subprocess
+from build_manifest import (load_manifest, save_manifest, is_fresh, record, hash_bytes,
+                            write_if_changed, sync_tree)
+import instrument
+
+try:
+    import brotli
+except ImportError:  # .br siblings are skipped without the package
+    brotli = None
+
+MANIFEST_NAME = 'deploy'
+DEPLOY_DIR = 'deploy'
+ASSET_MANIFEST = 'asset-manifest.json'
+HASH_LENGTH = 10
+# Formats that are already compressed gain nothing from a .gz/.br sibling
+# (.blocks files are runs of gzip members read with Range requests, so they
+# must never be served with a Content-Encoding either)
+COMPRESSED_EXTENSIONS = ('.gz', '.br', '.pbf', '.pmtiles', '.png', '.jpg', '.blocks')
+# Source layers that also keep an unhashed copy next to the hashed one, since
+# optimize_split_geojson.py and external links use them under these names
+SOURCE_GEOJSON = ['data/nc_counties.geojson', 'data/nc_precincts_enhanced_2024.geojson']
+# Vector tiles are requested through the {z}/{x}/{y}.pbf template in tiles.json,
+# so they keep fixed names and stay out of the inlined asset manifest
+VECTOR_TILE_DIR = 'data/tiles'
+SPLIT_DATA_FILE = re.compile(r'^election_data_(index\.json|\d{4}\.json\.gz|\d{4}\.blocks)$')
 
 def create_deploy_structure():
     """Create deployment directory structure"""
-    deploy_dir = 'deploy'
+    deploy_dir = DEPLOY_DIR
     os.makedirs(deploy_dir, exist_ok=True)
     os.makedirs(os.path.join(deploy_dir, 'styles'), exist_ok=True)
     os.makedirs(os.path.join(deploy_dir, 'scripts'), exist_ok=True)
     os.makedirs(os.path.join(deploy_dir, 'data'), exist_ok=True)
 
-def optimize_and_copy_files():
-    """Optimize and copy all necessary files to deploy directory"""
-    # Copy and minify CSS
-    with open('styles/main.css', 'r', encoding='utf-8') as f:
-        css = f.read()
+def minify_css(css):
     # Basic CSS minification
-    css = '\n'.join(line.strip() for line in css.split('\n') if line.strip())
-    with open('deploy/styles/main.css', 'w', encoding='utf-8') as f:
-        f.write(css)
+    return '\n'.join(line.strip() for line in css.split('\n') if line.strip())
+
+def minify_js(js):
+    # Basic JS minification
+    return '\n'.join(line.strip() for line in js.split('\n') if line.strip() and not line.strip().startswith('//'))
+
+def split_extension(filename):
+    """Split off the extension, keeping compound ones like .json.gz together"""
+    if filename.endswith('.json.gz'):
+        return filename[:-len('.json.gz')], '.json.gz'
+    return os.path.splitext(filename)
+
+def hashed_path(path, data):
+    """data/nc_counties.geojson -> data/nc_counties.<hash>.geojson"""
+    directory, filename = os.path.split(path)
+    stem, extension = split_extension(filename)
+    return '/'.join(filter(None, [directory, f"{stem}.{hash_bytes(data)[:HASH_LENGTH]}{extension}"]))
+
+def compressed_siblings(path, data):
+    """Precompressed copies for servers that serve .gz/.br files directly (gzip_static style)"""
+    if path.endswith(COMPRESSED_EXTENSIONS):
+        return {}
+    siblings = {path + '.gz': lambda: gzip.compress(data, 9, mtime=0)}
+    if brotli is not None:
+        siblings[path + '.br'] = lambda: brotli.compress(data, quality=11)
+    return siblings
+
+def emit_asset(path, data, manifest, written, hashed=True):
+    """Write one asset, under its hashed name unless ``hashed`` is False, plus its
+    compressed siblings. Returns the path the asset is served from.
+    
+    Compression is skipped when the manifest shows the same content was already
+    emitted and the files on disk are untouched.
+    """
+    served_path = hashed_path(path, data) if hashed else path
+    siblings = compressed_siblings(served_path, data)
+    outputs = [os.path.join(DEPLOY_DIR, p) for p in [served_path] + list(siblings)]
+    
+    key = f'asset:{served_path}'
+    digest = hash_bytes(data)
+    if not is_fresh(manifest, key, digest, outputs):
+        write_if_changed(outputs[0], data)
+        for sibling, compress in siblings.items():
+            write_if_changed(os.path.join(DEPLOY_DIR, sibling), compress())
+        record(manifest, key, digest, outputs)
+    written[key] = [served_path] + list(siblings)
+    return served_path
+
+def collect_assets():
+    """(path under the site root, content) for every static asset, in a stable order"""
+    assets = []
     
-    # Copy and minify JavaScript
+    # Minified stylesheet and map script
+    with open('styles/main.css', 'r', encoding='utf-8') as f:
+        assets.append(('styles/main.css', minify_css(f.read()).encode('utf-8')))
     with open('scripts/map.js', 'r', encoding='utf-8') as f:
-        js = f.read()
-    # Basic JS minification
-    js = '\n'.join(line.strip() for line in js.split('\n') if line.strip() and not line.strip().startswith('//'))
-    with open('deploy/scripts/map.js', 'w', encoding='utf-8') as f:
-        f.write(js)
+        assets.append(('scripts/map.js', minify_js(f.read()).encode('utf-8')))
+    
+    # Shared helpers referenced from index.html, GeoJSON, TopoJSON builds (including
+    # any simplification levels and their manifest), per-year summaries,
+    # precomputed swing and feature id tables (the unmatched-key reports are
+    # not used by the page) and the vector tile TileJSON
+    files = ['styles/common.css', 'scripts/common.js'] + SOURCE_GEOJSON
+    files += sorted(glob.glob('data/*.topojson')) + ['data/geometry_levels.json']
+    files += [f'{VECTOR_TILE_DIR}/tiles.json']
+    files += sorted(glob.glob('data/summaries/*.json'))
+    files += sorted(path for path in glob.glob('data/swing/*.json') if not path.endswith('_unmatched.json'))
+    files += sorted(path for path in glob.glob('data/feature_ids/*.json') if not path.endswith('_unmatched.json'))
+    for path in files:
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                assets.append((path.replace(os.sep, '/'), f.read()))
+    
+    # Per-year split files, written straight into docs by optimize_split_data.py
+    # (the hashed copies a previous deploy synced next to them are skipped)
+    for path in sorted(glob.glob('docs/data/elections/election_data_*')):
+        if not SPLIT_DATA_FILE.match(os.path.basename(path)):
+            continue
+        with open(path, 'rb') as f:
+            assets.append((os.path.relpath(path, 'docs').replace(os.sep, '/'), f.read()))
+    return assets
+
+def collect_vector_tiles():
+    """(path under the site root, content) for every {z}/{x}/{y}.pbf tile"""
+    tiles = []
+    for path in sorted(glob.glob(os.path.join(VECTOR_TILE_DIR, '*', '*', '*.pbf'))):
+        with open(path, 'rb') as f:
+            tiles.append((path.replace(os.sep, '/'), f.read()))
+    return tiles
+
+def build_index_html(asset_paths):
+    """index.html with hashed script/stylesheet references and the asset manifest
+    inlined, so the page resolves data files without an extra request"""
+    with open('index.html', 'r', encoding='utf-8', newline='') as f:
+        html = f.read()
+    
+    def replace_reference(match):
+        attribute, quote, path = match.groups()
+        return f"{attribute}={quote}{asset_paths.get(path, path)}{quote}"
+    html = re.sub(r"""\b(src|href)=(['"])([^'"]+)\2""", replace_reference, html)
+    
+    manifest_script = f"<script>window.ASSET_MANIFEST = {json.dumps(asset_paths, sort_keys=True)};</script>"
+    return html.replace('<head>', '<head>\n    ' + manifest_script, 1).encode('utf-8')
+
+def optimize_and_copy_files(manifest):
+    """Write content-hashed, precompressed assets to the deploy directory.
+    
+    A hashed file never changes once written, so it can be cached forever;
+    only index.html, asset-manifest.json, the SOURCE_GEOJSON copies and the
+    vector tiles keep fixed names.
+    """
+    written = {}
+    asset_paths = {}
+    with instrument.stage('collect') as stage:
+        assets = collect_assets()
+        tiles = collect_vector_tiles()
+        stage.add_input(sum(len(data) for _, data in assets + tiles))
+    with instrument.stage('emit', outputs=[DEPLOY_DIR]) as stage:
+        for path, data in assets:
+            asset_paths[path] = emit_asset(path, data, manifest, written)
+            if path in SOURCE_GEOJSON:
+                emit_asset(path, data, manifest, written, hashed=False)
+        for path, data in tiles:
+            emit_asset(path, data, manifest, written, hashed=False)
+        stage.count('assets', len(assets))
+        stage.count('tiles', len(tiles))
+    
+    asset_manifest = json.dumps(asset_paths, indent=2, sort_keys=True).encode('utf-8')
+    emit_asset(ASSET_MANIFEST, asset_manifest, manifest, written, hashed=False)
+    emit_asset('index.html', build_index_html(asset_paths), manifest, written, hashed=False)
+    
+    # Drop files from earlier deploys whose content no longer matches any source
+    for key in [key for key in manifest['entries'] if key.startswith('asset:') and key not in written]:
+        for output in manifest['entries'].pop(key)['outputs']:
+            if os.path.exists(output):
+                os.remove(output)
     
-    # Copy GeoJSON files
-    if os.path.exists('data/nc_counties.geojson'):
-        shutil.copy2('data/nc_counties.geojson', 'deploy/data/')
-    if os.path.exists('data/nc_precincts_enhanced_2024.geojson'):
-        shutil.copy2('data/nc_precincts_enhanced_2024.geojson', 'deploy/data/')
+    file_count = sum(len(files) for files in written.values())
+    print(f"Wrote {len(asset_paths)} hashed assets ({file_count} files including compressed copies)")
+    if brotli is None:
+        print("brotli is not installed, skipping .br copies")
+    return asset_paths
 
 def main():
     """Main deployment function"""
     print("Starting deployment process...")
+    manifest = load_manifest(MANIFEST_NAME)
     
     # Create directory structure
     print("Creating directory structure...")
@@ -44,14 +193,19 @@ def main():
     
     # Optimize and copy files
     print("Optimizing and copying files...")
-    optimize_and_copy_files()
+    with instrument.stage('assets'):
+        optimize_and_copy_files(manifest)
     
-    # Create docs directory
-    print("Creating docs directory...")
-    docs_dir = 'docs'
-    if os.path.exists(docs_dir):
-        shutil.rmtree(docs_dir)
-    shutil.copytree('deploy', docs_dir)
+    # Sync docs directory: copy only changed files and drop only files a
+    # previous deploy put there, leaving the split data written by the
+    # optimize scripts in place
+    print("Syncing docs directory...")
+    with instrument.stage('sync_docs') as stage:
+        copied, removed, unchanged = sync_tree(DEPLOY_DIR, 'docs', manifest)
+        stage.count('copied', len(copied))
+        stage.count('removed', len(removed))
+    save_manifest(manifest, MANIFEST_NAME)
+    print(f"Copied {len(copied)} changed files, removed {len(removed)}, left {len(unchanged)} unchanged")
     
     print("Deployment package created successfully!")
     print("\nNext steps:")
@@ -62,4 +216,5 @@ def main():
     print("5. Your site will be available at https://Tenjin25.github.io/nc-election-analysis")
 
 if __name__ == '__main__':
-    main()
+    with instrument.run('deploy'):
+        main()
@@ -1,7 +1,11 @@
+import os
+import json
+import shutil
+import argparse
 import pandas as pd
 
-# Read the combined statistics file
-df = pd.read_csv('all_full_statistics_combined.csv')
+import instrument
+import csv_stats
 
 # Map short race names to full names for output filenames
 race_map = {
@@ -10,23 +14,112 @@ race_map = {
     'Sen': 'Senate'
 }
 
-# Loop through each unique SourceFile
-for source_file in df['SourceFile'].dropna().unique():
-    # Try to extract year and race from the source file name
+RESULT_COLUMNS = ['ID', 'Dem', 'Rep', 'Oth']
+CHUNK_ROWS = 200000
+DATASET_DIR = 'election_results'
+
+def source_race(source_file):
+    """(year, race) from a source file name such as '2020 Pres Statistics.csv', or None"""
     parts = source_file.replace('.csv', '').split()
-    if len(parts) >= 2:
-        year = parts[0]
-        race_short = parts[1]
-        race = race_map.get(race_short, race_short)
-        # Filter rows for this source file
-        sub = df[df['SourceFile'] == source_file]
-        # Keep only the relevant columns
-        cols = [c for c in ['ID', 'Dem', 'Rep', 'Oth'] if c in sub.columns]
-        out = sub[cols]
-        # Remove rows with missing or zero Dem/Rep
-        out = out.dropna(subset=['Dem', 'Rep'])
-        out = out[(out['Dem'] != 0) | (out['Rep'] != 0)]
-        # Save to new file
-        outname = f"{year}_{race}_election_results_only.csv"
-        out.to_csv(outname, index=False)
+    if len(parts) < 2:
+        return None
+    return parts[0], race_map.get(parts[1], parts[1])
+
+def read_results(input_file, chunk_rows=CHUNK_ROWS):
+    """Stream the combined statistics once; returns (columns, {source_file: [row chunks]}).
+
+    Values are kept as the text in the CSV. Rows with a missing Dem or Rep,
+    or with both zero, are dropped. Every source file is listed in order of
+    first appearance, also when none of its rows are kept.
+    """
+    header = pd.read_csv(input_file, nrows=0).columns
+    columns = [c for c in RESULT_COLUMNS if c in header]
+    sources = {}
+    reader = pd.read_csv(input_file, usecols=['SourceFile'] + columns, dtype=str, chunksize=chunk_rows)
+    for chunk in reader:
+        for source_file in chunk['SourceFile'].dropna().unique():
+            sources.setdefault(source_file, [])
+        chunk = chunk.dropna(subset=['SourceFile', 'Dem', 'Rep'])
+        dem = pd.to_numeric(chunk['Dem'], errors='coerce')
+        rep = pd.to_numeric(chunk['Rep'], errors='coerce')
+        chunk = chunk[(dem != 0) | (rep != 0)]
+        for source_file, rows in chunk.groupby('SourceFile', sort=False):
+            sources[source_file].append(rows[columns])
+    return columns, sources
+
+def write_csvs(results, columns, output_dir, stage):
+    """One {year}_{race}_election_results_only.csv per result, recorded in csv_stats.json"""
+    stats = csv_stats.load_stats(output_dir)
+    district_col = csv_stats.district_column(columns)
+    for (year, race), rows in results.items():
+        outname = os.path.join(output_dir, f"{year}_{race}_election_results_only.csv")
+        rows.to_csv(outname, index=False)
+        district_rows = csv_stats.count_district_rows(rows[district_col]) if district_col else 0
+        csv_stats.record(stats, outname, len(rows), district_rows, district_col)
         print(f"Created {outname}")
+        stage.add_output(outname)
+    csv_stats.save_stats(output_dir, stats)
+
+def write_dataset(results, columns, output_dir, stage):
+    """All results as one Parquet dataset partitioned by year and race, with _stats.json beside the partitions"""
+    path = os.path.join(output_dir, DATASET_DIR)
+    table = pd.concat([rows.assign(year=year, race=race) for (year, race), rows in results.items()],
+                      ignore_index=True)
+    for party in ['Dem', 'Rep', 'Oth']:
+        if party in table.columns:
+            table[party] = pd.to_numeric(table[party], errors='coerce')
+    # Partitions are only ever added to a dataset directory, so start from an empty one
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    try:
+        table.to_parquet(path, partition_cols=['year', 'race'], index=False)
+    except ImportError as e:
+        raise SystemExit(f"Cannot write {path} ({e})")
+    district_col = csv_stats.district_column(columns)
+    stats = {
+        f"year={year}/race={race}": {
+            'rows': len(rows),
+            'district_rows': csv_stats.count_district_rows(rows[district_col]) if district_col else 0
+        }
+        for (year, race), rows in results.items()
+    }
+    with open(os.path.join(path, '_stats.json'), 'w', encoding='utf-8') as f:
+        json.dump(stats, f, indent=2, sort_keys=True)
+    print(f"Created {path} ({len(results)} partitions)")
+    stage.add_output(path)
+
+def extract_election_results(input_file='all_full_statistics_combined.csv', output_dir='.', output_format='csv',
+                             chunk_rows=CHUNK_ROWS):
+    """Write {year}_{race}_election_results_only.csv for each source file in the combined statistics,
+    or with output_format='parquet' one partitioned dataset"""
+    # Read the combined statistics file in chunks, grouping each chunk by source file
+    with instrument.stage('read', inputs=[input_file]) as stage:
+        columns, sources = read_results(input_file, chunk_rows)
+        stage.count('source_files', len(sources))
+
+    # A later source file with the same year and race replaces an earlier one
+    results = {}
+    for source_file, chunks in sources.items():
+        race = source_race(source_file)
+        if race is not None:
+            results[race] = pd.concat(chunks) if chunks else pd.DataFrame(columns=columns)
+
+    with instrument.stage('write') as stage:
+        if output_format == 'parquet':
+            write_dataset(results, columns, output_dir, stage)
+        else:
+            write_csvs(results, columns, output_dir, stage)
+        stage.count('results', len(results))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Split the combined statistics into one results CSV per year and race')
+    parser.add_argument('--input', default='all_full_statistics_combined.csv')
+    parser.add_argument('--output-dir', default='.',
+                        help='Directory for the per-race CSVs (default: current directory)')
+    parser.add_argument('--format', choices=['csv', 'parquet'], default='csv',
+                        help=f'One CSV per year and race, or a {DATASET_DIR}/ Parquet dataset partitioned by year and race (default: csv)')
+    parser.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS,
+                        help='Rows of the combined CSV read at a time (default: %(default)s)')
+    args = parser.parse_args()
+    with instrument.run('extract_election_results'):
+        extract_election_results(args.input, args.output_dir, args.format, args.chunk_rows)
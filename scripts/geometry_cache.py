@@ -0,0 +1,300 @@
+"""
+Binary, memory-mapped cache of a polygon GeoJSON layer for the Python tools.
+
+Parsing the precinct GeoJSON with ``json.load`` and turning every feature into
+a shapely object is the slowest part of each geometry script, and every script
+did it again. The cache is built once per source file and holds the layer as
+flat arrays:
+
+    coords            float64 (n, 2)   every vertex of every ring
+    ring_offsets      int64            ring i is coords[ring_offsets[i]:ring_offsets[i + 1]]
+    part_offsets      int64            polygon j is rings part_offsets[j]:part_offsets[j + 1]
+    feature_offsets   int64            feature k is polygons feature_offsets[k]:feature_offsets[k + 1]
+    kinds             int8             shapely.GeometryType of each feature (-1 for no geometry)
+    bboxes            float64 (k, 4)   minx, miny, maxx, maxy of each feature
+    record_offsets    int64            feature k's JSON without its geometry is
+    records           uint8            records[record_offsets[k]:record_offsets[k + 1]]
+
+The offsets are shapely's ragged-array layout, so geometries come back with one
+vectorized ``shapely.from_ragged_array`` call. Feature ids are kept in the
+header. On disk the file follows precinct_store.py:
+
+    8 bytes   magic b'NCGEOBIN'
+    4 bytes   uint32 length of the JSON header
+    N bytes   JSON header (source file stamp, ids, array offsets), space
+              padded so the array section starts on an 8-byte boundary
+    ...       raw arrays, each starting on an 8-byte boundary
+
+Opening a cache only parses the header; the arrays are ``numpy.memmap`` views,
+so a tool that reads only the bboxes, or a handful of features, never pages in
+the rest of the file.
+"""
+
+import os
+import json
+import hashlib
+import argparse
+
+import numpy as np
+import shapely
+from shapely import GeometryType
+from shapely.geometry import shape
+
+import instrument
+
+MAGIC = b'NCGEOBIN'
+CACHE_VERSION = 1
+CACHE_DIR = '.build/geometry'
+
+ARRAYS = ['coords', 'ring_offsets', 'part_offsets', 'feature_offsets', 'kinds', 'bboxes',
+          'record_offsets', 'records']
+
+
+def _align(n):
+    return (n + 7) & ~7
+
+
+def source_stamp(path):
+    """Identifies a source file and its version without reading it"""
+    stat = os.stat(path)
+    return {'path': os.path.abspath(path), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def cache_path(geojson_path, cache_dir=CACHE_DIR):
+    """The cache file of a source file, named after it and a hash of its absolute
+    path, so same-named layers in different directories (data/ and docs/data/)
+    never share a cache"""
+    name = os.path.splitext(os.path.basename(geojson_path))[0]
+    digest = hashlib.sha1(os.path.abspath(geojson_path).encode('utf-8')).hexdigest()[:10]
+    return os.path.join(cache_dir, f'{name}.{digest}.geobin')
+
+
+def feature_id(feature, index, id_field=None):
+    if id_field:
+        return str((feature.get('properties') or {}).get(id_field, index))
+    return str(feature.get('id', index))
+
+
+def encode_layer(geojson_data, id_field=None):
+    """Flat arrays and the id table for the features of a polygon FeatureCollection"""
+    features = geojson_data['features']
+    geometries = np.array([shape(f['geometry']) if f.get('geometry') else None for f in features], dtype=object)
+    kinds = shapely.get_type_id(geometries).astype(np.int8)
+    unsupported = ~np.isin(kinds, [GeometryType.MISSING, GeometryType.POLYGON, GeometryType.MULTIPOLYGON])
+    if unsupported.any():
+        i = int(np.flatnonzero(unsupported)[0])
+        raise ValueError(f"Feature {i} is a {geometries[i].geom_type}; only polygon layers can be cached")
+
+    # Missing geometries become empty multipolygons so every feature has an
+    # entry in feature_offsets; kinds records that they were missing
+    present = kinds != GeometryType.MISSING
+    filled = geometries.copy()
+    filled[~present] = shapely.MultiPolygon()
+    geometry_type, coords, offsets = shapely.to_ragged_array(filled)
+    if geometry_type == GeometryType.POLYGON:
+        # A layer of only Polygons has no part level; each feature is one part
+        ring_offsets, part_offsets = offsets
+        feature_offsets = np.arange(len(features) + 1)
+    else:
+        ring_offsets, part_offsets, feature_offsets = offsets
+
+    bboxes = np.full((len(features), 4), np.nan)
+    bboxes[present] = shapely.bounds(geometries[present])
+
+    records = [json.dumps({k: v for k, v in f.items() if k != 'geometry'}, separators=(',', ':')).encode('utf-8')
+               for f in features]
+    record_offsets = np.zeros(len(records) + 1, dtype=np.int64)
+    np.cumsum([len(r) for r in records], out=record_offsets[1:])
+
+    arrays = {
+        'coords': np.ascontiguousarray(coords, dtype='<f8'),
+        'ring_offsets': ring_offsets.astype('<i8'),
+        'part_offsets': part_offsets.astype('<i8'),
+        'feature_offsets': feature_offsets.astype('<i8'),
+        'kinds': kinds,
+        'bboxes': bboxes.astype('<f8'),
+        'record_offsets': record_offsets.astype('<i8'),
+        'records': np.frombuffer(b''.join(records), dtype=np.uint8),
+    }
+    ids = [feature_id(f, i, id_field) for i, f in enumerate(features)]
+    extra = {k: v for k, v in geojson_data.items() if k not in ('type', 'features')}
+    return arrays, ids, extra
+
+
+def write_cache(arrays, ids, output_file, source=None, extra=None):
+    """Write encoded arrays to the binary layout"""
+    array_entries = {}
+    offset = 0
+    for name in ARRAYS:
+        array = arrays[name]
+        array_entries[name] = {
+            'dtype': array.dtype.str,
+            'offset': offset,
+            'shape': list(array.shape),
+        }
+        offset = _align(offset + array.nbytes)
+
+    header = json.dumps({
+        'version': CACHE_VERSION,
+        'source': source,
+        'ids': ids,
+        'collection': extra or {},
+        'arrays': array_entries,
+    }, separators=(',', ':')).encode('utf-8')
+    header += b' ' * (_align(len(MAGIC) + 4 + len(header)) - len(MAGIC) - 4 - len(header))
+
+    output_dir = os.path.dirname(output_file)
+    if output_dir and not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    # Written under a temporary name so a reader never maps a half-written file;
+    # the name is per process because pipeline stages may build the same cache at once
+    tmp_file = f'{output_file}.{os.getpid()}.tmp'
+    with open(tmp_file, 'wb') as f:
+        f.write(MAGIC)
+        f.write(len(header).to_bytes(4, 'little'))
+        f.write(header)
+        for name in ARRAYS:
+            data = arrays[name].tobytes()
+            f.write(data)
+            f.write(b'\0' * (_align(len(data)) - len(data)))
+    os.replace(tmp_file, output_file)
+
+
+def read_cache(input_file, mmap=True):
+    """Open a cache written by write_cache.
+
+    With ``mmap=True`` the arrays are memory-mapped views into the file, so
+    opening it only parses the header.
+    """
+    with open(input_file, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"Not a geometry cache: {input_file}")
+        header_length = int.from_bytes(f.read(4), 'little')
+        header = json.loads(f.read(header_length).decode('utf-8'))
+        if header['version'] != CACHE_VERSION:
+            raise ValueError(f"Unsupported geometry cache version {header['version']} in {input_file}")
+        data_start = len(MAGIC) + 4 + header_length
+        if mmap and os.path.getsize(input_file) > data_start:
+            raw = np.memmap(input_file, dtype=np.uint8, mode='r', offset=data_start)
+        else:
+            raw = np.frombuffer(f.read(), dtype=np.uint8)
+
+    layer = {'ids': header['ids'], 'source': header['source'], 'collection': header['collection']}
+    for name, entry in header['arrays'].items():
+        dtype = np.dtype(entry['dtype'])
+        count = int(np.prod(entry['shape']))
+        start = entry['offset']
+        layer[name] = raw[start:start + count * dtype.itemsize].view(dtype).reshape(entry['shape'])
+    return layer
+
+
+def build_cache(geojson_path, output_file=None, id_field=None):
+    """Convert a GeoJSON file to a cache file; returns the cache path"""
+    output_file = output_file or cache_path(geojson_path)
+    source = source_stamp(geojson_path)
+    with open(geojson_path, 'r', encoding='utf-8') as f:
+        geojson_data = json.load(f)
+    arrays, ids, extra = encode_layer(geojson_data, id_field)
+    write_cache(arrays, ids, output_file, source=dict(source, id_field=id_field), extra=extra)
+    return output_file
+
+
+def open_layer(geojson_path, output_file=None, id_field=None, force=False):
+    """The cached layer for a GeoJSON file, converting it first if the cache is missing or stale"""
+    output_file = output_file or cache_path(geojson_path)
+    if not force and os.path.exists(output_file):
+        try:
+            layer = read_cache(output_file)
+        except ValueError:
+            layer = None
+        if layer is not None and layer['source'] == dict(source_stamp(geojson_path), id_field=id_field):
+            return layer
+    print(f"Building geometry cache for {geojson_path}...")
+    layer = read_cache(build_cache(geojson_path, output_file, id_field))
+    # Another process may have replaced the cache since it was written, or the
+    # source changed while it was read; never return geometry of another version
+    if layer['source'] != dict(source_stamp(geojson_path), id_field=id_field):
+        raise ValueError(f"{geojson_path} changed while its geometry cache was built; run again")
+    return layer
+
+
+def _gather(offsets, index):
+    """Positions covered by the ranges offsets[i]:offsets[i + 1] for i in index, and their new offsets"""
+    starts = np.asarray(offsets[index], dtype=np.int64)
+    counts = np.asarray(offsets[index + 1], dtype=np.int64) - starts
+    new_offsets = np.zeros(len(index) + 1, dtype=np.int64)
+    np.cumsum(counts, out=new_offsets[1:])
+    positions = np.arange(new_offsets[-1], dtype=np.int64) + np.repeat(starts - new_offsets[:-1], counts)
+    return positions, new_offsets
+
+
+def feature_count(layer):
+    return len(layer['kinds'])
+
+
+def geometries(layer, index=None):
+    """Shapely geometries of all features, or of the features at ``index``.
+
+    Only the coordinates of the selected features are read. Polygon features
+    come back as Polygons and features without geometry as None, as
+    ``shapely.geometry.shape`` would have produced them.
+    """
+    if index is None:
+        index = np.arange(feature_count(layer))
+        coords = np.asarray(layer['coords'])
+        offsets = (np.asarray(layer['ring_offsets']), np.asarray(layer['part_offsets']),
+                   np.asarray(layer['feature_offsets']))
+    else:
+        index = np.asarray(index, dtype=np.int64)
+        parts, feature_offsets = _gather(layer['feature_offsets'], index)
+        rings, part_offsets = _gather(layer['part_offsets'], parts)
+        positions, ring_offsets = _gather(layer['ring_offsets'], rings)
+        coords = layer['coords'][positions]
+        offsets = (ring_offsets, part_offsets, feature_offsets)
+
+    result = shapely.from_ragged_array(GeometryType.MULTIPOLYGON, coords, offsets)
+    kinds = np.asarray(layer['kinds'])[index]
+    polygons = kinds == GeometryType.POLYGON
+    result[polygons] = shapely.get_geometry(result[polygons], 0)
+    result[kinds == GeometryType.MISSING] = None
+    return result
+
+
+def records(layer, index=None):
+    """Each feature's GeoJSON object without its geometry (type, properties, id)"""
+    offsets = layer['record_offsets']
+    index = range(feature_count(layer)) if index is None else np.asarray(index).tolist()
+    return [json.loads(layer['records'][offsets[i]:offsets[i + 1]].tobytes()) for i in index]
+
+
+def properties(layer, index=None):
+    return [record.get('properties') for record in records(layer, index)]
+
+
+def query_bbox(layer, bounds):
+    """Indexes of the features whose bounding box intersects ``bounds`` (minx, miny, maxx, maxy)"""
+    minx, miny, maxx, maxy = bounds
+    boxes = layer['bboxes']
+    return np.flatnonzero((boxes[:, 0] <= maxx) & (boxes[:, 2] >= minx) &
+                          (boxes[:, 1] <= maxy) & (boxes[:, 3] >= miny))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Convert polygon GeoJSON layers to memory-mapped geometry caches')
+    parser.add_argument('inputs', nargs='*',
+                        default=['data/nc_counties.geojson', 'data/nc_precincts_enhanced_2024.geojson'])
+    parser.add_argument('--cache-dir', default=CACHE_DIR)
+    parser.add_argument('--id-field', help='Property used as the feature id (default: the feature id, else its index)')
+    parser.add_argument('--force', action='store_true', help='Rebuild caches that are up to date')
+    instrument.add_arguments(parser)
+    args = parser.parse_args()
+
+    with instrument.run('geometry_cache', args):
+        for input_path in args.inputs:
+            output_file = cache_path(input_path, args.cache_dir)
+            with instrument.stage(os.path.basename(input_path), inputs=[input_path], outputs=[output_file]):
+                layer = open_layer(input_path, output_file, args.id_field, force=args.force)
+            print(f"- {output_file}: {feature_count(layer)} features, {len(layer['coords'])} vertices, "
+                  f"{os.path.getsize(output_file) / (1024 * 1024):.1f} MB "
+                  f"(GeoJSON {os.path.getsize(input_path) / (1024 * 1024):.1f} MB)")
@@ -0,0 +1,362 @@
+"""
+Stage timing and resource accounting shared by the pipeline scripts.
+
+A script wraps its main block in ``instrument.run(name)`` and marks its
+phases with ``instrument.stage``:
+
+    with instrument.run('optimize_split_data', args):
+        with instrument.stage('read', inputs=[input_file]):
+            ...
+        with instrument.stage('write', outputs=[output_dir]) as stage:
+            ...
+            stage.count('contests', len(contests))
+
+Each stage records wall and CPU time, its peak RSS, the bytes of its input
+paths (measured on entry) and of its output paths (measured on exit), and any
+counters the script adds. Stages nest, and a parent's peak includes its
+children's. A stage opened while no run is active records nothing, so
+library functions can declare stages whatever calls them. A run opened inside
+another run (one script calling another) becomes a stage of the outer run.
+Memory used by worker processes is not included.
+
+When the run ends, its JSON report is written to
+``.build/reports/{script}/{timestamp}.json``. A one-line summary is appended
+to ``.build/reports/runs.jsonl``, so stage times can be compared across
+builds with ``python scripts/instrument.py``.
+
+Per-run options, as command-line flags (see add_arguments) or environment
+variables, for scripts that take no arguments:
+
+    --profile       PIPELINE_PROFILE=1         cProfile dump for each top-level stage
+    --trace-memory  PIPELINE_TRACE_MEMORY=1    tracemalloc peak per stage (slower)
+    --report-dir    PIPELINE_REPORT_DIR=DIR    where reports go (default: .build/reports)
+                    PIPELINE_REPORT=0          time stages but write no report
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import cProfile
+import argparse
+import statistics
+import tracemalloc
+import contextlib
+from datetime import datetime, timezone
+
+REPORT_DIR = '.build/reports'
+REPORT_VERSION = '1.0'
+HISTORY_FILE = 'runs.jsonl'
+
+_current = None
+
+
+def reset_peak_rss():
+    """Reset the process's RSS high-water mark (Linux); elsewhere the peak stays process-wide"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def peak_rss_mb():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:  # Windows
+        return 0.0
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def path_size(path):
+    """Size of a file, or of every file under a directory; 0 if it does not exist"""
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, names in os.walk(path)
+        for name in names
+    )
+
+
+def _size(item):
+    if isinstance(item, int):
+        return item
+    if isinstance(item, (bytes, bytearray)):
+        return len(item)
+    return path_size(item)
+
+
+def _env_flag(name, default=False):
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() not in ('', '0', 'false', 'no')
+
+
+class Stage:
+    """Handle for the stage being timed: add byte counts and counters to it"""
+
+    def __init__(self, inputs=(), outputs=()):
+        self.bytes_in = sum(_size(item) for item in inputs)
+        self.output_paths = []
+        self.bytes_out = 0
+        self.counters = {}
+        self.child_peak_rss = 0.0
+        self.child_peak_traced = 0
+        for item in outputs:
+            self.add_output(item)
+
+    def add_input(self, item):
+        """Count a path (its current size), a byte string or a number of bytes as read"""
+        self.bytes_in += _size(item)
+
+    def add_output(self, item):
+        """Count a path (measured when the stage ends), a byte string or a number of bytes as written"""
+        if isinstance(item, (str, os.PathLike)):
+            self.output_paths.append(item)
+        else:
+            self.bytes_out += _size(item)
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+
+class Run:
+    """One instrumented script run and the stages recorded in it"""
+
+    def __init__(self, script, report_dir=None, profile=None, trace_memory=None, write_report=None):
+        self.script = script
+        self.report_dir = report_dir or os.environ.get('PIPELINE_REPORT_DIR') or REPORT_DIR
+        self.profile = _env_flag('PIPELINE_PROFILE') if profile is None else profile
+        self.trace_memory = _env_flag('PIPELINE_TRACE_MEMORY') if trace_memory is None else trace_memory
+        self.write_report = _env_flag('PIPELINE_REPORT', True) if write_report is None else write_report
+        self.started = datetime.now(timezone.utc)
+        self.run_id = f"{self.started.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}"
+        self.stages = []
+        self.stack = []
+        self.wall_start = time.perf_counter()
+        self.cpu_start = time.process_time()
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        reset_peak_rss()
+
+    def _note_peaks(self, stage):
+        """Fold the memory high-water mark so far into ``stage`` before a child resets it"""
+        stage.child_peak_rss = max(stage.child_peak_rss, peak_rss_mb())
+        if self.trace_memory:
+            stage.child_peak_traced = max(stage.child_peak_traced, tracemalloc.get_traced_memory()[1])
+
+    @contextlib.contextmanager
+    def stage(self, name, inputs=(), outputs=()):
+        parent = self.stack[-1] if self.stack else None
+        if parent is not None:
+            self._note_peaks(parent)
+        path = f"{parent.path}/{name}" if parent is not None else name
+        record = {'name': path}
+        self.stages.append(record)
+
+        stage = Stage(inputs, outputs)
+        stage.path = path
+        reset_peak_rss()
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+        # cProfile cannot nest, so only top-level stages get a profile
+        profiler = cProfile.Profile() if self.profile and parent is None else None
+        self.stack.append(stage)
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        status = 'ok'
+        if profiler is not None:
+            profiler.enable()
+        try:
+            yield stage
+        except BaseException:
+            status = 'error'
+            raise
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            record['seconds'] = round(time.perf_counter() - wall_start, 4)
+            record['cpu_seconds'] = round(time.process_time() - cpu_start, 4)
+            self.stack.pop()
+            self._note_peaks(stage)
+            record['peak_rss_mb'] = round(stage.child_peak_rss, 1)
+            if self.trace_memory:
+                record['peak_traced_mb'] = round(stage.child_peak_traced / (1024 * 1024), 1)
+            record['bytes_in'] = stage.bytes_in
+            record['bytes_out'] = stage.bytes_out + sum(path_size(p) for p in stage.output_paths)
+            if stage.counters:
+                record['counters'] = stage.counters
+            if status != 'ok':
+                record['status'] = status
+            if profiler is not None and self.write_report:
+                profile_file = os.path.join(self.run_path(), re.sub(r'[^\w.-]+', '_', path) + '.prof')
+                os.makedirs(os.path.dirname(profile_file), exist_ok=True)
+                profiler.dump_stats(profile_file)
+                record['profile'] = profile_file
+            if parent is not None:
+                parent.child_peak_rss = max(parent.child_peak_rss, stage.child_peak_rss)
+                parent.child_peak_traced = max(parent.child_peak_traced, stage.child_peak_traced)
+
+    def run_path(self):
+        return os.path.join(self.report_dir, self.script, self.run_id)
+
+    def report(self, status='ok', error=None):
+        report = {
+            'version': REPORT_VERSION,
+            'script': self.script,
+            'run_id': self.run_id,
+            'started': self.started.isoformat(timespec='seconds'),
+            'argv': sys.argv[1:],
+            'cwd': os.getcwd(),
+            'status': status,
+            'seconds': round(time.perf_counter() - self.wall_start, 4),
+            'cpu_seconds': round(time.process_time() - self.cpu_start, 4),
+            'peak_rss_mb': round(max([peak_rss_mb()] + [s.get('peak_rss_mb', 0) for s in self.stages]), 1),
+            'stages': self.stages,
+        }
+        if error is not None:
+            report['error'] = error
+        return report
+
+    def finish(self, status='ok', error=None):
+        """Write the report and the history line; returns the report"""
+        report = self.report(status, error)
+        if not self.write_report:
+            return report
+        report_file = self.run_path() + '.json'
+        os.makedirs(os.path.dirname(report_file), exist_ok=True)
+        with open(report_file, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        summary = {
+            'script': self.script,
+            'run_id': self.run_id,
+            'started': report['started'],
+            'status': status,
+            'seconds': report['seconds'],
+            'peak_rss_mb': report['peak_rss_mb'],
+            'stages': {s['name']: s.get('seconds') for s in self.stages},
+            'report': report_file,
+        }
+        # One short line per run, appended in a single write so concurrent scripts do not interleave
+        with open(os.path.join(self.report_dir, HISTORY_FILE), 'a', encoding='utf-8') as f:
+            f.write(json.dumps(summary, separators=(',', ':')) + '\n')
+        return report
+
+
+def print_stages(report, file=sys.stdout):
+    print(f"\nStage timings ({report['script']}, {report['seconds']:.2f}s, peak {report['peak_rss_mb']:.1f}MB):", file=file)
+    for stage in report['stages']:
+        size = ''
+        if stage.get('bytes_in') or stage.get('bytes_out'):
+            size = f"  in {stage['bytes_in'] / 1024 / 1024:8.2f}MB  out {stage['bytes_out'] / 1024 / 1024:8.2f}MB"
+        print(f"  {stage['name']:<36} {stage.get('seconds', 0):8.3f}s  cpu {stage.get('cpu_seconds', 0):8.3f}s"
+              f"  peak {stage.get('peak_rss_mb', 0):8.1f}MB{size}", file=file)
+
+
+@contextlib.contextmanager
+def run(script, args=None, quiet=False, **options):
+    """Instrument a script's main block; ``args`` may carry the add_arguments flags"""
+    global _current
+    if _current is not None:
+        with _current.stage(script):
+            yield _current
+        return
+
+    if args is not None:
+        options.setdefault('profile', getattr(args, 'profile', None) or None)
+        options.setdefault('trace_memory', getattr(args, 'trace_memory', None) or None)
+        options.setdefault('report_dir', getattr(args, 'report_dir', None))
+    current = Run(script, **options)
+    _current = current
+    status, error = 'ok', None
+    try:
+        yield current
+    except SystemExit as e:
+        if e.code not in (None, 0):
+            status, error = 'error', f"exit {e.code}"
+        raise
+    except BaseException as e:
+        status, error = 'error', repr(e)
+        raise
+    finally:
+        _current = None
+        report = current.finish(status, error)
+        if not quiet:
+            print_stages(report)
+
+
+def stage(name, inputs=(), outputs=()):
+    """Time a stage of the active run; without one, a handle that records nothing"""
+    if _current is None:
+        return contextlib.nullcontext(Stage())
+    return _current.stage(name, inputs, outputs)
+
+
+def current_run():
+    return _current
+
+
+def add_arguments(parser):
+    group = parser.add_argument_group('instrumentation')
+    group.add_argument('--profile', action='store_true',
+                       help='Write a cProfile dump for each top-level stage next to the run report')
+    group.add_argument('--trace-memory', action='store_true',
+                       help='Record the tracemalloc peak of each stage (slower)')
+    group.add_argument('--report-dir', help=f'Directory for run reports (default: {REPORT_DIR})')
+    return parser
+
+
+def read_history(report_dir=REPORT_DIR, script=None):
+    path = os.path.join(report_dir, HISTORY_FILE)
+    if not os.path.exists(path):
+        return []
+    with open(path, 'r', encoding='utf-8') as f:
+        runs = [json.loads(line) for line in f if line.strip()]
+    return [r for r in runs if script is None or r['script'] == script]
+
+
+def compare_runs(runs, last=10):
+    """Per script and stage: latest time, median of the earlier runs and the change"""
+    by_script = {}
+    for r in runs:
+        if r['status'] == 'ok':
+            by_script.setdefault(r['script'], []).append(r)
+    rows = []
+    for script, script_runs in sorted(by_script.items()):
+        latest, earlier = script_runs[-1], script_runs[-last - 1:-1]
+        for name, seconds in latest['stages'].items():
+            history = [r['stages'][name] for r in earlier if r['stages'].get(name) is not None]
+            median = statistics.median(history) if history else None
+            change = (seconds - median) / median if median else None
+            rows.append({'script': script, 'stage': name, 'seconds': seconds, 'median': median,
+                         'change': change, 'runs': len(history) + 1})
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare stage times of instrumented pipeline runs')
+    parser.add_argument('--report-dir', default=os.environ.get('PIPELINE_REPORT_DIR') or REPORT_DIR)
+    parser.add_argument('--script', help='Only this script')
+    parser.add_argument('--last', type=int, default=10, help='Earlier runs the latest is compared with (default: 10)')
+    parser.add_argument('--slowest', type=int, default=0, help='Only the N slowest stages overall')
+    args = parser.parse_args()
+
+    rows = compare_runs(read_history(args.report_dir, args.script), args.last)
+    if args.slowest:
+        rows = sorted(rows, key=lambda row: -row['seconds'])[:args.slowest]
+    if not rows:
+        print(f"No runs recorded in {args.report_dir}")
+    for row in rows:
+        median = f"{row['median']:8.3f}s" if row['median'] is not None else '       -'
+        change = f"{row['change']:+7.1%}" if row['change'] is not None else '      -'
+        print(f"{row['script']:<28} {row['stage']:<36} {row['seconds']:8.3f}s  median {median}  {change}"
+              f"  ({row['runs']} runs)")
@@ -0,0 +1,120 @@
+import json
+import re
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+_NUMBER_CHARS = frozenset('0123456789+-.eE')
+
+
+class JsonStreamReader:
+    """Incremental reader that walks a JSON document without loading it whole.
+
+    Containers are entered with ``members()``; leaf values (and any container
+    the caller is happy to materialize) are decoded with ``value()``. Only the
+    bytes of the value being decoded are held in memory.
+    """
+
+    def __init__(self, f, chunk_size=1 << 16):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self):
+        """Append the next chunk to the buffer, dropping consumed text"""
+        if self.eof:
+            return False
+        chunk = self.f.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """Return the next non-whitespace character without consuming it"""
+        while True:
+            self.pos = _WHITESPACE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                raise ValueError('Unexpected end of JSON input')
+
+    def expect(self, char):
+        found = self.peek()
+        if found != char:
+            raise ValueError(f"Expected '{char}' but found '{found}'")
+        self.pos += 1
+
+    def value(self):
+        """Decode and return the next complete JSON value"""
+        self.peek()
+        while True:
+            try:
+                result, end = self.decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if self._fill():
+                    continue
+                raise
+            # A number that reaches the buffer edge may have been cut short
+            if (isinstance(result, (int, float)) and not self.eof
+                    and (end == len(self.buf) or self.buf[end] in _NUMBER_CHARS)):
+                self._fill()
+                continue
+            self.pos = end
+            return result
+
+    def members(self):
+        """Yield the keys of the next object; the caller consumes each value"""
+        self.expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(':')
+            yield key
+            separator = self.peek()
+            self.pos += 1
+            if separator == '}':
+                return
+            if separator != ',':
+                raise ValueError(f"Expected ',' or '}}' but found '{separator}'")
+
+
+def iter_election_events(input_file, chunk_size=1 << 16):
+    """Stream the comprehensive precinct JSON as a sequence of events.
+
+    Walks ``results_by_year -> contest_type -> contest_id -> results`` one
+    precinct at a time and yields tuples:
+
+    - ``('top', key, value)`` for every top-level key except results_by_year
+    - ``('year', year)`` / ``('end_year', year)``
+    - ``('contest_type', contest_type)`` / ``('end_contest_type', contest_type)``
+    - ``('contest', contest_type, contest_id)`` / ``('end_contest', contest_type, contest_id)``
+    - ``('precinct', precinct_id, precinct_data)`` for each row in ``results``
+    - ``('field', key, value)`` for the other keys of a contest
+    """
+    with open(input_file, 'r', encoding='utf-8') as f:
+        reader = JsonStreamReader(f, chunk_size)
+        for key in reader.members():
+            if key != 'results_by_year':
+                yield ('top', key, reader.value())
+                continue
+            for year in reader.members():
+                yield ('year', year)
+                for contest_type in reader.members():
+                    yield ('contest_type', contest_type)
+                    for contest_id in reader.members():
+                        yield ('contest', contest_type, contest_id)
+                        for field in reader.members():
+                            if field == 'results':
+                                for precinct_id in reader.members():
+                                    yield ('precinct', precinct_id, reader.value())
+                            else:
+                                yield ('field', field, reader.value())
+                        yield ('end_contest', contest_type, contest_id)
+                    yield ('end_contest_type', contest_type)
+                yield ('end_year', year)
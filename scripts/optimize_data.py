@@ -1,18 +1,41 @@
 import json
 import os
+import argparse
 from typing import Dict, Any
 import gzip
 
-def optimize_election_data(input_file: str, output_file: str) -> None:
+from json_stream import iter_election_events
+import instrument
+
+def optimize_precinct(precinct_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Only keep essential fields for one precinct row"""
+    return {
+        'dem': precinct_data.get('dem_votes', 0),
+        'rep': precinct_data.get('rep_votes', 0),
+        'county': precinct_data.get('county', '')
+    }
+
+def contest_metadata(details: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        'dem_candidate': details.get('dem_candidate', ''),
+        'rep_candidate': details.get('rep_candidate', ''),
+        'contest_name': details.get('contest_name', '')
+    }
+
+def optimize_election_data(input_file: str, output_file: str, stream: bool = False) -> None:
     """
     Optimize election data by:
     1. Removing unnecessary fields
     2. Compressing numerical values
     3. Organizing data for efficient access
     """
+    if stream:
+        optimize_election_data_streaming(input_file, output_file)
+        return
+    
     print(f"Reading data from {input_file}...")
     
-    with open(input_file, 'r') as f:
+    with instrument.stage('read', inputs=[input_file]), open(input_file, 'r') as f:
         data = json.load(f)
     
     optimized_data = {
@@ -41,19 +64,11 @@ def optimize_election_data(input_file: str, output_file: str) -> None:
                 optimized_results = {}
                 for precinct_id, precinct_data in results.items():
                     # Only keep essential fields
-                    optimized_results[precinct_id] = {
-                        'dem': precinct_data.get('dem_votes', 0),
-                        'rep': precinct_data.get('rep_votes', 0),
-                        'county': precinct_data.get('county', '')
-                    }
+                    optimized_results[precinct_id] = optimize_precinct(precinct_data)
                 
                 optimized_data['years'][year][contest_type][contest_id] = {
                     'results': optimized_results,
-                    'metadata': {
-                        'dem_candidate': details.get('dem_candidate', ''),
-                        'rep_candidate': details.get('rep_candidate', ''),
-                        'contest_name': details.get('contest_name', '')
-                    }
+                    'metadata': contest_metadata(details)
                 }
     
     # Update metadata
@@ -84,9 +99,79 @@ def optimize_election_data(input_file: str, output_file: str) -> None:
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
         
-    with gzip.open(output_file, 'wt', encoding='utf-8') as f:
+    with instrument.stage('write', outputs=[output_file]), gzip.open(output_file, 'wt', encoding='utf-8') as f:
         json.dump(optimized_data, f)
     
+    print_summary(input_file, output_file, optimized_data['metadata'])
+
+def optimize_election_data_streaming(input_file: str, output_file: str) -> None:
+    """
+    Same output as optimize_election_data, but the input is read one precinct
+    at a time and each year is written to the output as soon as it is parsed,
+    so memory does not grow with the size of the comprehensive JSON.
+    """
+    print(f"Streaming data from {input_file}...")
+    
+    output_dir = os.path.dirname(output_file)
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    
+    precinct_ids = set()
+    years_covered = []
+    total_contests = 0
+    details: Dict[str, Any] = {}
+    first_precinct = True
+    first_contest = True
+    first_type = True
+    
+    with gzip.open(output_file, 'wt', encoding='utf-8') as out:
+        out.write('{"version": "1.0", "years": {')
+        for event in iter_election_events(input_file):
+            kind = event[0]
+            if kind == 'year':
+                if years_covered:
+                    out.write(', ')
+                years_covered.append(event[1])
+                print(f"Processing year {event[1]}...")
+                out.write(f'{json.dumps(event[1])}: {{')
+                first_type = True
+            elif kind == 'contest_type':
+                if not first_type:
+                    out.write(', ')
+                first_type = False
+                out.write(f'{json.dumps(event[1])}: {{')
+                first_contest = True
+            elif kind == 'contest':
+                if not first_contest:
+                    out.write(', ')
+                first_contest = False
+                total_contests += 1
+                out.write(f'{json.dumps(event[2])}: {{"results": {{')
+                first_precinct = True
+                details = {}
+            elif kind == 'precinct':
+                if not first_precinct:
+                    out.write(', ')
+                first_precinct = False
+                precinct_ids.add(event[1])
+                out.write(f'{json.dumps(event[1])}: {json.dumps(optimize_precinct(event[2]))}')
+            elif kind == 'field':
+                details[event[1]] = event[2]
+            elif kind == 'end_contest':
+                out.write(f'}}, "metadata": {json.dumps(contest_metadata(details))}}}')
+            elif kind in ('end_contest_type', 'end_year'):
+                out.write('}')
+        
+        metadata = {
+            'total_precincts': len(precinct_ids),
+            'total_contests': total_contests,
+            'years_covered': sorted(years_covered)
+        }
+        out.write(f'}}, "metadata": {json.dumps(metadata)}}}')
+    
+    print_summary(input_file, output_file, metadata)
+
+def print_summary(input_file: str, output_file: str, metadata: Dict[str, Any]) -> None:
     # Calculate compression stats
     original_size = os.path.getsize(input_file)
     compressed_size = os.path.getsize(output_file)
@@ -96,12 +181,20 @@ def optimize_election_data(input_file: str, output_file: str) -> None:
     print(f"Original size: {original_size / 1024 / 1024:.2f} MB")
     print(f"Compressed size: {compressed_size / 1024 / 1024:.2f} MB")
     print(f"Compression ratio: {compression_ratio:.1f}%")
-    print(f"Total contests: {total_contests}")
-    print(f"Total unique precincts: {total_precincts}")
-    print(f"Years covered: {', '.join(optimized_data['metadata']['years_covered'])}")
+    print(f"Total contests: {metadata['total_contests']}")
+    print(f"Total unique precincts: {metadata['total_precincts']}")
+    print(f"Years covered: {', '.join(metadata['years_covered'])}")
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Optimize election data into a single compressed file')
+    parser.add_argument('--stream', action='store_true',
+                        help='Read the comprehensive JSON incrementally instead of loading it whole')
+    instrument.add_arguments(parser)
+    args = parser.parse_args()
+    
     input_file = 'data/nc_statewide_precinct_comprehensive_2008_2024_UPDATED_MERGED.json'
     output_file = 'deploy/data/election_data.json.gz'
     
-    optimize_election_data(input_file, output_file)
+    with instrument.run('optimize_data', args), \
+            instrument.stage('optimize', inputs=[input_file], outputs=[output_file]):
+        optimize_election_data(input_file, output_file, stream=args.stream)
@@ -1,8 +1,12 @@
 import json
 import gzip
 import os
+import shapely
 from shapely.geometry import shape, mapping
 
+import geometry_cache
+import instrument
+
 def simplify_geojson(geojson_data, tolerance=0.0001):
     """Simplify geometries while preserving topology"""
     features = geojson_data['features']
@@ -17,20 +21,30 @@ def simplify_geojson(geojson_data, tolerance=0.0001):
     geojson_data['features'] = simplified_features
     return geojson_data
 
-def process_file(input_path, output_path, name):
-    # Read input GeoJSON
+def simplify_layer(layer, tolerance=0.0001):
+    """Simplify every geometry of a geometry cache layer in one vectorized call"""
+    simplified = shapely.simplify(geometry_cache.geometries(layer), tolerance, preserve_topology=True)
+    features = geometry_cache.records(layer)
+    for feature, geom in zip(features, simplified):
+        feature['geometry'] = mapping(geom) if geom is not None else None
+    return {'type': 'FeatureCollection', **layer['collection'], 'features': features}
+
+def process_file(input_path, output_path, name, cache_file=None):
+    # Read input geometry from the binary cache (converted once per GeoJSON change)
     print(f"Processing {input_path}...")
-    with open(input_path, 'r') as f:
-        geojson_data = json.load(f)
-    
-    # Step 1: Simplify geometries
-    print("Simplifying geometries...")
-    simplified_data = simplify_geojson(geojson_data)
-    
-    # Step 2: Compress with gzip
-    print("Compressing...")
-    with gzip.open(output_path, 'wt') as f:
-        json.dump(simplified_data, f)
+    with instrument.stage(name, inputs=[input_path], outputs=[output_path]):
+        with instrument.stage('load'):
+            layer = geometry_cache.open_layer(input_path, cache_file)
+        
+        # Step 1: Simplify geometries
+        print("Simplifying geometries...")
+        with instrument.stage('simplify'):
+            simplified_data = simplify_layer(layer)
+        
+        # Step 2: Compress with gzip
+        print("Compressing...")
+        with instrument.stage('write'), gzip.open(output_path, 'wt') as f:
+            json.dump(simplified_data, f)
     
     # Print size reduction
     original_size = os.path.getsize(input_path) / (1024 * 1024)
@@ -56,4 +70,5 @@ def main():
     )
 
 if __name__ == '__main__':
-    main()
+    with instrument.run('optimize_geojson'):
+        main()
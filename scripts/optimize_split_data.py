@@ -1,73 +1,125 @@
+import io
 import json
 import gzip
 import os
+import argparse
+import glob
+import hashlib
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 
-def optimize_election_data(input_file, output_dir):
-    """Split and optimize election data by year"""
-    print(f"Reading data from {input_file}...")
-    
-    with open(input_file, 'r') as f:
-        data = json.load(f)
-    
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
-    
-    # Create an index file for metadata
-    index = {
-        'version': '1.0',
+from json_stream import iter_election_events
+from build_manifest import MANIFEST_DIR, load_manifest, save_manifest, is_fresh, record, hash_file, hash_json
+from split_reader import read_index, key_prefix
+import instrument
+
+MANIFEST_NAME = 'optimize_split_data'
+
+# Bump when the split file format changes so existing manifests are rebuilt
+SPLIT_FORMAT = 3
+
+# Schema of the year files, stored as the index version (see split_reader.py)
+SCHEMA_VERSION = '2.0'
+SEPARATORS = (',', ':')
+
+def optimize_precinct(precinct_data):
+    """Keep only the fields the map needs for one precinct row"""
+    return {
+        'd': precinct_data.get('dem_votes', 0),
+        'r': precinct_data.get('rep_votes', 0),
+        'c': precinct_data.get('county', '')
+    }
+
+def contest_meta(details):
+    """Short candidate/contest metadata block for one contest"""
+    return {
+        'dc': details.get('dem_candidate', ''),
+        'rc': details.get('rep_candidate', ''),
+        'name': details.get('contest_name', '')
+    }
+
+class PrecinctDictionary:
+    """The counties and precincts of one year, numbered in order of first appearance"""
+
+    def __init__(self):
+        self.counties = []
+        self.county_ids = {}
+        self.precinct_ids = {}
+        self.precinct_county = []
+        self.precinct_names = []
+        self.unprefixed = []
+
+    def precinct_id(self, key, county):
+        precinct = self.precinct_ids.get((key, county))
+        if precinct is None:
+            precinct = self.precinct_ids[(key, county)] = len(self.precinct_names)
+            if county not in self.county_ids:
+                self.county_ids[county] = len(self.counties)
+                self.counties.append(county)
+            self.precinct_county.append(self.county_ids[county])
+            prefix = key_prefix(county)
+            if key.startswith(prefix):
+                self.precinct_names.append(key[len(prefix):])
+            else:
+                self.precinct_names.append(key)
+                self.unprefixed.append(precinct)
+        return precinct
+
+    def to_json(self):
+        dictionary = {
+            'counties': self.counties,
+            'precinct_county': self.precinct_county,
+            'precinct_names': self.precinct_names
+        }
+        if self.unprefixed:
+            dictionary['unprefixed'] = self.unprefixed
+        return dictionary
+
+def encode_contest(contest, dictionary):
+    """A split contest with its results as parallel precinct/dem/rep arrays.
+
+    Precinct indexes are delta-encoded: contests mostly list the year's
+    precincts in dictionary order, so 'p' is a run of 1s that gzip all but
+    removes.
+    """
+    precincts, dem, rep = [], [], []
+    previous = 0
+    for precinct_id, row in contest['results'].items():
+        precinct = dictionary.precinct_id(precinct_id, row['c'])
+        precincts.append(precinct - previous)
+        previous = precinct
+        dem.append(row['d'])
+        rep.append(row['r'])
+    return {'type': contest['type'], 'p': precincts, 'd': dem, 'r': rep, 'meta': contest['meta']}
+
+def encode_year(year_data):
+    """A year of split contests in the dictionary-encoded schema"""
+    dictionary = PrecinctDictionary()
+    contests = {contest_id: encode_contest(contest, dictionary) for contest_id, contest in year_data['contests'].items()}
+    return {'contests': contests, 'dictionary': dictionary.to_json(), 'metadata': year_data['metadata']}
+
+def new_index():
+    return {
+        'version': SCHEMA_VERSION,
         'years': {},
         'metadata': {
             'total_contests': 0,
             'years_covered': []
         }
     }
-    
-    # Process each year separately
-    for year, contests in data.get('results_by_year', {}).items():
-        print(f"Processing year {year}...")
-        year_data = {
-            'contests': {},
-            'metadata': {
-                'total_contests': 0
-            }
-        }
-        
-        for contest_type, contest_data in contests.items():
-            for contest_id, details in contest_data.items():
-                # Optimize precinct results
-                optimized_results = {}
-                for precinct_id, precinct_data in details.get('results', {}).items():
-                    # Keep only essential fields and round percentages
-                    optimized_results[precinct_id] = {
-                        'd': precinct_data.get('dem_votes', 0),
-                        'r': precinct_data.get('rep_votes', 0),
-                        'c': precinct_data.get('county', '')
-                    }
-                
-                year_data['contests'][contest_id] = {
-                    'type': contest_type,
-                    'results': optimized_results,
-                    'meta': {
-                        'dc': details.get('dem_candidate', ''),
-                        'rc': details.get('rep_candidate', ''),
-                        'name': details.get('contest_name', '')
-                    }
-                }
-                year_data['metadata']['total_contests'] += 1
-        
-        # Save year data compressed
-        output_file = os.path.join(output_dir, f'election_data_{year}.json.gz')
-        with gzip.open(output_file, 'wt', encoding='utf-8') as f:
-            json.dump(year_data, f)
-        
-        # Update index
-        index['years'][year] = {
-            'file': f'election_data_{year}.json.gz',
-            'contests': list(year_data['contests'].keys()),
-            'total_contests': year_data['metadata']['total_contests']
+
+def add_year_to_index(index, year, contest_ids, blocks):
+    index['years'][year] = {
+        'file': f'election_data_{year}.json.gz',
+        'contests': list(contest_ids),
+        'total_contests': len(contest_ids),
+        'blocks': {
+            'file': f'election_data_{year}.blocks',
+            **blocks
         }
-        index['metadata']['total_contests'] += year_data['metadata']['total_contests']
-    
+    }
+    index['metadata']['total_contests'] += len(contest_ids)
+
+def write_index(index, output_dir):
     index['metadata']['years_covered'] = sorted(index['years'].keys())
     
     # Save index
@@ -81,14 +133,437 @@ def optimize_election_data(input_file, output_dir):
     print(f"\nFiles created in {output_dir}:")
     print(f"- election_data_index.json")
     for year in index['years'].keys():
-        print(f"- election_data_{year}.json.gz")
+        print(f"- election_data_{year}.json.gz, election_data_{year}.blocks")
+
+def open_gzip_text(output_file):
+    """Open a gzip file for text writing with a fixed header timestamp.
+
+    gzip stores the write time in its header; pinning it to 0 makes every
+    build of the same data byte-identical, whichever process wrote it.
+    """
+    return io.TextIOWrapper(gzip.GzipFile(output_file, 'wb', mtime=0), encoding='utf-8')
+
+def open_block(raw):
+    """Open a gzip member for text writing at the current position of the binary file ``raw``.
+
+    Closing the block ends the member but leaves ``raw`` open for the next one.
+    """
+    return io.TextIOWrapper(gzip.GzipFile(filename='', mode='wb', fileobj=raw, mtime=0), encoding='utf-8')
+
+def year_file(output_dir, year):
+    return os.path.join(output_dir, f'election_data_{year}.json.gz')
+
+def blocks_file(output_dir, year):
+    return os.path.join(output_dir, f'election_data_{year}.blocks')
+
+def year_outputs(output_dir, year):
+    return [year_file(output_dir, year), blocks_file(output_dir, year)]
+
+def write_block(raw, text):
+    """Append one gzip member holding ``text``; returns its [offset, size]"""
+    offset = raw.tell()
+    with open_block(raw) as block:
+        block.write(text)
+    return [offset, raw.tell() - offset]
+
+def write_blocks(output_dir, year, contests, dictionary):
+    """Save each contest, then the year's dictionary, as its own gzip member in the year's .blocks file.
+
+    Returns {'offsets': {contest_id: [offset, size]}, 'dictionary': [offset, size]},
+    the byte range of each member, so a reader can seek (or send an HTTP
+    Range request) for one contest and decompress only that and the
+    dictionary. The members back to back are also one valid gzip stream.
+    """
+    offsets = {}
+    with open(blocks_file(output_dir, year), 'wb') as raw:
+        for contest_id, contest in contests.items():
+            offsets[contest_id] = write_block(raw, json.dumps(contest, separators=SEPARATORS))
+        dictionary_range = write_block(raw, json.dumps(dictionary, separators=SEPARATORS))
+    return {'offsets': offsets, 'dictionary': dictionary_range}
+
+def write_year(output_dir, year, year_data):
+    """Save one year's data dictionary-encoded and compressed, whole and per contest; returns (contest ids, blocks)"""
+    year_data = encode_year(year_data)
+    with open_gzip_text(year_file(output_dir, year)) as f:
+        json.dump(year_data, f, separators=SEPARATORS)
+    blocks = write_blocks(output_dir, year, year_data['contests'], year_data['dictionary'])
+    return list(year_data['contests'].keys()), blocks
+
+def write_years(output_dir, years, workers=1, manifest=None, input_hashes=None):
+    """Write every (year, year_data) pair and build the index.
+
+    With more than one worker each year is serialized and compressed in its
+    own process while the next year is still being prepared; the index is
+    merged in input order so the output does not depend on the worker count.
+    At most ``workers`` years are submitted and not yet written at a time, so
+    a streamed ``years`` is only read as fast as the workers keep up.
+    
+    With a manifest, a year_data of None marks a year that is unchanged since
+    the last build: its file is kept and its contests come from the manifest.
+    Every year that is written is recorded with its hash from input_hashes.
+    """
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    
+    index = new_index()
+    
+    def finish(year, written):
+        contest_ids, blocks = written
+        add_year_to_index(index, year, contest_ids, blocks)
+        if manifest is not None:
+            record(manifest, year, input_hashes[year], year_outputs(output_dir, year),
+                   contests=contest_ids, blocks=blocks)
+    
+    def kept(year):
+        entry = manifest['entries'][year]
+        add_year_to_index(index, year, entry['contests'], entry['blocks'])
+    
+    if workers <= 1:
+        for year, year_data in years:
+            if year_data is None:
+                kept(year)
+            else:
+                finish(year, write_year(output_dir, year, year_data))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            pending = []
+            
+            def merge_done():
+                # Merge finished years from the front so the index keeps input order
+                while pending and (pending[0][1] is None or pending[0][1].done()):
+                    year, future = pending.pop(0)
+                    if future is None:
+                        kept(year)
+                    else:
+                        finish(year, future.result())
+            
+            for year, year_data in years:
+                if year_data is None:
+                    pending.append((year, None))
+                else:
+                    running = [future for _, future in pending if future is not None and not future.done()]
+                    if len(running) >= workers:
+                        wait(running, return_when=FIRST_COMPLETED)
+                    pending.append((year, executor.submit(write_year, output_dir, year, year_data)))
+                merge_done()
+            wait([future for _, future in pending if future is not None])
+            merge_done()
+    
+    write_index(index, output_dir)
+    return index
+
+def new_contest_digest(contest_type):
+    return hashlib.sha256(json.dumps(contest_type).encode('utf-8'))
+
+def update_contest_digest(digest, kind, key, value):
+    """Fold one precinct row or contest field into a contest's content hash.
+
+    Rows and fields are hashed in document order, so the in-memory and
+    streaming readers produce the same hash for the same contest.
+    """
+    digest.update(json.dumps([kind, key, value], sort_keys=True, separators=(',', ':')).encode('utf-8'))
+
+def contest_hash(contest_type, details):
+    """Content hash of one contest of results_by_year"""
+    digest = new_contest_digest(contest_type)
+    for field, value in details.items():
+        if field == 'results':
+            for precinct_id, precinct_data in value.items():
+                update_contest_digest(digest, 'precinct', precinct_id, precinct_data)
+        else:
+            update_contest_digest(digest, 'field', field, value)
+    return digest.hexdigest()
+
+def year_hash(contest_hashes):
+    """Input hash of a year from its ordered [contest_id, hash] pairs"""
+    return hash_json([SPLIT_FORMAT, contest_hashes])
+
+def report_year_changes(manifest, year, contest_hashes):
+    """Print which contests of a year changed since the last build"""
+    previous = dict(manifest['entries'].get(year, {}).get('contest_hashes', []))
+    changed = [contest_id for contest_id, digest in contest_hashes if previous.get(contest_id) != digest]
+    if previous and changed:
+        print(f"Year {year}: {len(changed)} of {len(contest_hashes)} contests changed ({', '.join(changed)})")
+
+def source_is_fresh(manifest, source_hash, output_dir):
+    """Whole-run shortcut: same source as the last build into output_dir, outputs untouched"""
+    entry = manifest['entries'].get('source', {})
+    index_file = os.path.join(output_dir, 'election_data_index.json')
+    return index_file in entry.get('outputs', {}) and is_fresh(manifest, 'source', source_hash)
+
+def new_year_data():
+    return {
+        'contests': {},
+        'metadata': {
+            'total_contests': 0
+        }
+    }
+
+def optimize_year(contests):
+    """Reshape one year of results_by_year into the split format"""
+    year_data = new_year_data()
+    
+    for contest_type, contest_data in contests.items():
+        for contest_id, details in contest_data.items():
+            # Optimize precinct results
+            optimized_results = {}
+            for precinct_id, precinct_data in details.get('results', {}).items():
+                # Keep only essential fields and round percentages
+                optimized_results[precinct_id] = optimize_precinct(precinct_data)
+            
+            year_data['contests'][contest_id] = {
+                'type': contest_type,
+                'results': optimized_results,
+                'meta': contest_meta(details)
+            }
+            year_data['metadata']['total_contests'] += 1
+    
+    return year_data
+
+def select_years(manifest, output_dir, years, input_hashes, rebuilt, force=False):
+    """Yield (year, year_data), or (year, None) for years unchanged since the last build.
+
+    ``years`` yields (year, contest_hashes, build) where build() makes the
+    year's data; it is only called for years that need rebuilding.
+    """
+    for year, contest_hashes, build in years:
+        input_hashes[year] = year_hash(contest_hashes)
+        if not force and is_fresh(manifest, year, input_hashes[year], year_outputs(output_dir, year)):
+            print(f"Year {year} unchanged, keeping {os.path.basename(year_file(output_dir, year))}")
+            yield year, None
+            continue
+        report_year_changes(manifest, year, contest_hashes)
+        print(f"Processing year {year}...")
+        rebuilt[year] = contest_hashes
+        yield year, build()
+
+def write_changed_years(manifest, source_hash, output_dir, years, workers=1, force=False,
+                        manifest_dir=MANIFEST_DIR):
+    """Write the years that changed, then record them and the source in the manifest"""
+    input_hashes = {}
+    rebuilt = {}
+    selected = select_years(manifest, output_dir, years, input_hashes, rebuilt, force)
+    with instrument.stage('write_years', outputs=[output_dir]) as stage:
+        index = write_years(output_dir, selected, workers, manifest, input_hashes)
+        stage.count('years', len(index['years']))
+        stage.count('years_rebuilt', len(rebuilt))
+    for year, contest_hashes in rebuilt.items():
+        manifest['entries'][year]['contest_hashes'] = contest_hashes
+    
+    outputs = [os.path.join(output_dir, 'election_data_index.json')]
+    outputs += [path for year in index['years'] for path in year_outputs(output_dir, year)]
+    record(manifest, 'source', source_hash, outputs)
+    save_manifest(manifest, MANIFEST_NAME, manifest_dir)
+    return index
+
+def optimize_election_data(input_file, output_dir, stream=False, workers=1, force=False,
+                           manifest_dir=MANIFEST_DIR):
+    """Split and optimize election data by year.
+
+    Only years whose contests changed since the last build (per the content
+    hashes in the build manifest in ``manifest_dir``) are rewritten; ``force``
+    rebuilds all.
+    """
+    if stream:
+        return optimize_election_data_streaming(input_file, output_dir, workers=workers, force=force,
+                                                manifest_dir=manifest_dir)
+    
+    manifest = load_manifest(MANIFEST_NAME, manifest_dir)
+    source_hash = hash_json([SPLIT_FORMAT, hash_file(input_file)])
+    if not force and source_is_fresh(manifest, source_hash, output_dir):
+        print(f"{input_file} is unchanged since the last build, nothing to do")
+        return read_index(output_dir)
+    
+    print(f"Reading data from {input_file}...")
+    
+    with instrument.stage('read', inputs=[input_file]), open(input_file, 'r') as f:
+        data = json.load(f)
+    
+    def years():
+        # Process each year separately
+        for year, contests in data.get('results_by_year', {}).items():
+            contest_hashes = [
+                [contest_id, contest_hash(contest_type, details)]
+                for contest_type, contest_data in contests.items()
+                for contest_id, details in contest_data.items()
+            ]
+            yield year, contest_hashes, lambda contests=contests: optimize_year(contests)
+    
+    return write_changed_years(manifest, source_hash, output_dir, years(), workers, force, manifest_dir)
+
+def optimize_election_data_from_stores(store_dir, output_dir, workers=1, force=False, manifest_dir=MANIFEST_DIR):
+    """Split and optimize election data from the columnar stores built by precinct_store.py"""
+    from precinct_store import read_store, iter_contest_rows
+    
+    store_files = sorted(glob.glob(os.path.join(store_dir, 'precinct_store_*.bin')))
+    print(f"Reading {len(store_files)} precinct stores from {store_dir}...")
+    
+    store_hashes = [hash_file(store_file) for store_file in store_files]
+    manifest = load_manifest(MANIFEST_NAME, manifest_dir)
+    source_hash = hash_json([SPLIT_FORMAT, store_hashes])
+    if not force and source_is_fresh(manifest, source_hash, output_dir):
+        print(f"{store_dir} is unchanged since the last build, nothing to do")
+        return read_index(output_dir)
+    
+    def build(store_file):
+        store = read_store(store_file)
+        year_data = new_year_data()
+        for contest_id, contest in store['contests'].items():
+            year_data['contests'][contest_id] = {
+                'type': contest['type'],
+                'results': {
+                    precinct_id: optimize_precinct(precinct_data)
+                    for precinct_id, precinct_data in iter_contest_rows(store, contest_id)
+                },
+                'meta': contest_meta(contest['meta'])
+            }
+            year_data['metadata']['total_contests'] += 1
+        return year_data
+    
+    def years():
+        for store_file, store_hash in zip(store_files, store_hashes):
+            year = os.path.basename(store_file)[len('precinct_store_'):-len('.bin')]
+            # Stores are hashed whole; there are no per-contest hashes to compare
+            yield year, [['store', store_hash]], lambda store_file=store_file: build(store_file)
+    
+    return write_changed_years(manifest, source_hash, output_dir, years(), workers, force, manifest_dir)
+
+def iter_streamed_years(input_file):
+    """Yield (year, contest_hashes, year_data) built from the streamed input, one year at a time"""
+    year_data = None
+    contest = None
+    details = {}
+    digest = None
+    contest_hashes = []
+    for event in iter_election_events(input_file):
+        kind = event[0]
+        if kind == 'year':
+            year_data = new_year_data()
+            contest_hashes = []
+        elif kind == 'contest':
+            contest = {'type': event[1], 'results': {}}
+            year_data['contests'][event[2]] = contest
+            year_data['metadata']['total_contests'] += 1
+            details = {}
+            digest = new_contest_digest(event[1])
+        elif kind == 'precinct':
+            contest['results'][event[1]] = optimize_precinct(event[2])
+            update_contest_digest(digest, 'precinct', event[1], event[2])
+        elif kind == 'field':
+            details[event[1]] = event[2]
+            update_contest_digest(digest, 'field', event[1], event[2])
+        elif kind == 'end_contest':
+            contest['meta'] = contest_meta(details)
+            contest_hashes.append([event[2], digest.hexdigest()])
+        elif kind == 'end_year':
+            yield event[1], contest_hashes, year_data
+
+def optimize_election_data_streaming(input_file, output_dir, workers=1, force=False, manifest_dir=MANIFEST_DIR):
+    """Split and optimize election data by year without loading the input whole.
+
+    Each year's slimmed-down rows are collected while the input is read, and
+    the year is only compressed and written if its contests changed since
+    the last build. With more than one worker, changed years are handed to a
+    worker process for compression while parsing continues.
+    
+    With ``force`` and a single worker every year is rebuilt, and each contest
+    is encoded and appended to the open year file and blocks file as soon as
+    it has been read, so memory is bounded by the largest contest plus the
+    year's dictionary. The files written are identical to the in-memory mode
+    either way.
+    """
+    manifest = load_manifest(MANIFEST_NAME, manifest_dir)
+    source_hash = hash_json([SPLIT_FORMAT, hash_file(input_file)])
+    if not force and source_is_fresh(manifest, source_hash, output_dir):
+        print(f"{input_file} is unchanged since the last build, nothing to do")
+        return read_index(output_dir)
+    
+    print(f"Streaming data from {input_file}...")
+    
+    if workers > 1 or not force:
+        years = (
+            (year, contest_hashes, lambda year_data=year_data: year_data)
+            for year, contest_hashes, year_data in iter_streamed_years(input_file)
+        )
+        return write_changed_years(manifest, source_hash, output_dir, years, workers, force, manifest_dir)
+    
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    
+    index = new_index()
+    out = None
+    raw_blocks = None
+    dictionary = None
+    contest = None
+    blocks = {}
+    contest_ids = []
+    details = {}
+    digest = None
+    contest_hashes = []
+    
+    for event in iter_election_events(input_file):
+        kind = event[0]
+        if kind == 'year':
+            year = event[1]
+            print(f"Processing year {year}...")
+            out = open_gzip_text(year_file(output_dir, year))
+            out.write('{"contests":{')
+            raw_blocks = open(blocks_file(output_dir, year), 'wb')
+            dictionary = PrecinctDictionary()
+            blocks = {'offsets': {}}
+            contest_ids = []
+            contest_hashes = []
+        elif kind == 'contest':
+            contest = {'type': event[1], 'results': {}}
+            details = {}
+            digest = new_contest_digest(event[1])
+        elif kind == 'precinct':
+            contest['results'][event[1]] = optimize_precinct(event[2])
+            update_contest_digest(digest, 'precinct', event[1], event[2])
+        elif kind == 'field':
+            details[event[1]] = event[2]
+            update_contest_digest(digest, 'field', event[1], event[2])
+        elif kind == 'end_contest':
+            contest['meta'] = contest_meta(details)
+            text = json.dumps(encode_contest(contest, dictionary), separators=SEPARATORS)
+            out.write(f'{"," if contest_ids else ""}{json.dumps(event[2])}:{text}')
+            blocks['offsets'][event[2]] = write_block(raw_blocks, text)
+            contest_ids.append(event[2])
+            contest_hashes.append([event[2], digest.hexdigest()])
+            contest = None
+        elif kind == 'end_year':
+            dictionary_text = json.dumps(dictionary.to_json(), separators=SEPARATORS)
+            metadata = json.dumps({'total_contests': len(contest_ids)}, separators=SEPARATORS)
+            out.write(f'}},"dictionary":{dictionary_text},"metadata":{metadata}}}')
+            out.close()
+            out = None
+            blocks['dictionary'] = write_block(raw_blocks, dictionary_text)
+            raw_blocks.close()
+            raw_blocks = None
+            add_year_to_index(index, event[1], contest_ids, blocks)
+            record(manifest, event[1], year_hash(contest_hashes), year_outputs(output_dir, event[1]),
+                   contests=contest_ids, blocks=blocks, contest_hashes=contest_hashes)
+    
+    write_index(index, output_dir)
+    outputs = [os.path.join(output_dir, 'election_data_index.json')]
+    outputs += [path for year in index['years'] for path in year_outputs(output_dir, year)]
+    record(manifest, 'source', source_hash, outputs)
+    save_manifest(manifest, MANIFEST_NAME, manifest_dir)
+    return index
 
 def optimize_precincts(input_file, output_file):
     """Optimize precinct GeoJSON by simplifying and removing unnecessary properties"""
-    print(f"Reading precincts from {input_file}...")
+    from shapely.geometry import mapping
+    import geometry_cache
     
-    with open(input_file, 'r') as f:
-        data = json.load(f)
+    # Features come from the binary geometry cache, so the GeoJSON text is
+    # only parsed again when it changed
+    print(f"Reading precincts from {input_file}...")
+    layer = geometry_cache.open_layer(input_file)
+    features = geometry_cache.records(layer)
+    for feature, geom in zip(features, geometry_cache.geometries(layer)):
+        feature['geometry'] = mapping(geom) if geom is not None else None
+    data = {'type': 'FeatureCollection', **layer['collection'], 'features': features}
     
     # Keep only essential properties and simplify structure
     for feature in data['features']:
@@ -106,12 +581,40 @@ def optimize_precincts(input_file, output_file):
         json.dump(data, f)
 
 if __name__ == '__main__':
-    # Optimize election data
-    input_file = 'data/nc_statewide_precinct_comprehensive_2008_2024_UPDATED_MERGED.json'
-    output_dir = 'docs/data/elections'
-    optimize_election_data(input_file, output_dir)
-    
-    # Optimize precincts
-    precinct_input = 'data/nc_precincts_enhanced_2024.geojson'
-    precinct_output = 'docs/data/nc_precincts.json.gz'
-    optimize_precincts(precinct_input, precinct_output)
+    parser = argparse.ArgumentParser(description='Split and optimize election data by year')
+    parser.add_argument('--stream', action='store_true',
+                        help='Read the comprehensive JSON incrementally instead of loading it whole')
+    parser.add_argument('--from-stores', metavar='DIR',
+                        help='Read the columnar precinct stores in DIR (see precinct_store.py) instead of the JSON')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Number of processes used to build and compress the per-year files '
+                             '(default: 1, 0 = one per CPU core)')
+    parser.add_argument('--force', action='store_true',
+                        help='Rebuild every output even if the build manifest says it is up to date')
+    instrument.add_arguments(parser)
+    args = parser.parse_args()
+    if args.workers == 0:
+        args.workers = os.cpu_count() or 1
+    
+    with instrument.run('optimize_split_data', args):
+        # Optimize election data
+        input_file = 'data/nc_statewide_precinct_comprehensive_2008_2024_UPDATED_MERGED.json'
+        output_dir = 'docs/data/elections'
+        with instrument.stage('elections', outputs=[output_dir]):
+            if args.from_stores:
+                optimize_election_data_from_stores(args.from_stores, output_dir, workers=args.workers, force=args.force)
+            else:
+                optimize_election_data(input_file, output_dir, stream=args.stream, workers=args.workers, force=args.force)
+        
+        # Optimize precincts
+        precinct_input = 'data/nc_precincts_enhanced_2024.geojson'
+        precinct_output = 'docs/data/nc_precincts.json.gz'
+        manifest = load_manifest(MANIFEST_NAME)
+        precinct_hash = hash_file(precinct_input)
+        if not args.force and is_fresh(manifest, 'precincts', precinct_hash, [precinct_output]):
+            print(f"{precinct_input} is unchanged since the last build, keeping {precinct_output}")
+        else:
+            with instrument.stage('precincts', inputs=[precinct_input], outputs=[precinct_output]):
+                optimize_precincts(precinct_input, precinct_output)
+            record(manifest, 'precincts', precinct_hash, [precinct_output])
+            save_manifest(manifest, MANIFEST_NAME)
@@ -1,9 +1,25 @@
 import json
 import gzip
 import os
+import shutil
 import math
+import argparse
+import hashlib
+import numpy as np
+import shapely
 from shapely.geometry import shape, mapping, MultiPolygon, box
 from shapely.ops import unary_union
+from shapely.strtree import STRtree
+
+from build_manifest import load_manifest, save_manifest, is_fresh, record, hash_file, hash_json, copy_if_changed
+from optimize_split_data import open_gzip_text
+import geometry_cache
+import instrument
+
+MANIFEST_NAME = 'optimize_split_geojson'
+
+# Bump when the region file format changes so existing manifests are rebuilt
+REGION_FORMAT = 1
 
 def split_bbox(bbox, divisions=2):
     """Split a bounding box into smaller regions"""
@@ -37,22 +53,35 @@ def simplify_geojson(geojson_data, tolerance=0.0001, preserve_topology=True):
     geojson_data['features'] = simplified_features
     return geojson_data
 
-def split_and_optimize_geojson(geojson_data, output_dir, name_prefix, divisions=2, tolerance=0.0001):
-    """Split GeoJSON into regions and optimize each part"""
+def region_input_hash(features, geometries, candidates, region_bounds, tolerance):
+    """Content hash of everything that goes into one region file"""
+    digest = hashlib.sha256(json.dumps([REGION_FORMAT, region_bounds, tolerance]).encode('utf-8'))
+    for wkb in shapely.to_wkb(geometries[candidates]):
+        digest.update(wkb)
+    digest.update(hash_json([features[i].get('properties') for i in candidates.tolist()]).encode('utf-8'))
+    return digest.hexdigest()
+
+def split_and_optimize_geojson(geojson_data, output_dir, name_prefix, divisions=2, tolerance=0.0001,
+                               manifest=None, force=False, geometries=None):
+    """Split GeoJSON into regions and optimize each part.
+
+    With a build manifest, a region whose features are unchanged since the
+    last build keeps its existing file instead of being clipped, simplified
+    and compressed again.
+    
+    ``geometries`` (optional) are the features' shapely geometries, e.g. from
+    a geometry cache; the features' own 'geometry' entries are then not read.
+    """
     print(f"Splitting and optimizing {name_prefix} into {divisions}x{divisions} regions...")
     
+    # Convert every geometry once and index them, so each region only
+    # looks at the features whose envelopes overlap it
+    if geometries is None:
+        geometries = np.array([shape(feature['geometry']) for feature in geojson_data['features']], dtype=object)
+    tree = STRtree(geometries)
+    
     # Calculate overall bounds
-    bounds = None
-    for feature in geojson_data['features']:
-        geom = shape(feature['geometry'])
-        if bounds is None:
-            bounds = geom.bounds
-        else:
-            minx = min(bounds[0], geom.bounds[0])
-            miny = min(bounds[1], geom.bounds[1])
-            maxx = max(bounds[2], geom.bounds[2])
-            maxy = max(bounds[3], geom.bounds[3])
-            bounds = (minx, miny, maxx, maxy)
+    bounds = tuple(float(v) for v in shapely.total_bounds(geometries))
     
     # Split into regions
     regions = split_bbox(bounds, divisions)
@@ -70,20 +99,33 @@ def split_and_optimize_geojson(geojson_data, output_dir, name_prefix, divisions=
     }
     
     # Process each region
+    rebuilt = 0
     for i, region_bounds in enumerate(regions):
         region_box = box(*region_bounds)
         region_features = []
+        region_filename = f"{name_prefix}_region_{i}.json.gz"
+        output_path = os.path.join(output_dir, region_filename)
+        
+        # Find features that intersect this region (in original feature order)
+        candidates = np.sort(tree.query(region_box, predicate='intersects'))
         
-        # Find features that intersect this region
-        for feature in geojson_data['features']:
-            geom = shape(feature['geometry'])
-            if geom.intersects(region_box):
-                # Clip geometry to region if it extends beyond
-                clipped_geom = geom.intersection(region_box)
-                if not clipped_geom.is_empty:
-                    feature_copy = feature.copy()
-                    feature_copy['geometry'] = mapping(clipped_geom)
-                    region_features.append(feature_copy)
+        if manifest is not None:
+            input_hash = region_input_hash(geojson_data['features'], geometries, candidates, region_bounds, tolerance)
+            if not force and is_fresh(manifest, output_path, input_hash):
+                feature_count = manifest['entries'][output_path]['feature_count']
+                if feature_count:
+                    add_region_to_index(region_index, i, region_box, region_bounds, region_filename, feature_count)
+                continue
+        rebuilt += 1
+        
+        # Clip geometry to region if it extends beyond, then simplify
+        clipped = shapely.intersection(geometries[candidates], region_box)
+        simplified = shapely.simplify(clipped, tolerance, preserve_topology=True)
+        for index, clipped_geom, simplified_geom in zip(candidates.tolist(), clipped, simplified):
+            if not clipped_geom.is_empty:
+                feature_copy = geojson_data['features'][index].copy()
+                feature_copy['geometry'] = mapping(simplified_geom)
+                region_features.append(feature_copy)
         
         if region_features:
             # Create region GeoJSON
@@ -96,33 +138,18 @@ def split_and_optimize_geojson(geojson_data, output_dir, name_prefix, divisions=
                 }
             }
             
-            # Optimize region
-            optimized_data = simplify_geojson(region_data, tolerance=tolerance)
-            
             # Save region
-            region_filename = f"{name_prefix}_region_{i}.json.gz"
-            output_path = os.path.join(output_dir, region_filename)
+            with open_gzip_text(output_path) as f:
+                json.dump(region_data, f)
             
-            with gzip.open(output_path, 'wt') as f:
-                json.dump(optimized_data, f)
-            
-            # Add to index
-            region_index['metadata']['files'].append({
-                'filename': region_filename,
-                'bounds': region_bounds,
-                'feature_count': len(region_features)
-            })
-            
-            # Add region boundary to index
-            region_index['features'].append({
-                'type': 'Feature',
-                'geometry': mapping(region_box),
-                'properties': {
-                    'region_id': i,
-                    'filename': region_filename,
-                    'feature_count': len(region_features)
-                }
-            })
+            add_region_to_index(region_index, i, region_box, region_bounds, region_filename, len(region_features))
+        
+        if manifest is not None:
+            outputs = [output_path] if region_features else []
+            record(manifest, output_path, input_hash, outputs, feature_count=len(region_features))
+    
+    if manifest is not None:
+        print(f"Rebuilt {rebuilt} of {len(regions)} regions")
     
     # Save index
     index_path = os.path.join(output_dir, f"{name_prefix}_index.json")
@@ -131,6 +158,25 @@ def split_and_optimize_geojson(geojson_data, output_dir, name_prefix, divisions=
     
     return region_index
 
+def add_region_to_index(region_index, region_id, region_box, region_bounds, region_filename, feature_count):
+    # Add to index
+    region_index['metadata']['files'].append({
+        'filename': region_filename,
+        'bounds': region_bounds,
+        'feature_count': feature_count
+    })
+    
+    # Add region boundary to index
+    region_index['features'].append({
+        'type': 'Feature',
+        'geometry': mapping(region_box),
+        'properties': {
+            'region_id': region_id,
+            'filename': region_filename,
+            'feature_count': feature_count
+        }
+    })
+
 def ensure_directory(path):
     """Create directory if it doesn't exist"""
     if not os.path.exists(path):
@@ -154,14 +200,79 @@ def read_geojson(filepath):
         print(f"Error reading file {filepath}: {str(e)}")
         raise
 
+def process_layer(input_path, name_prefix, gh_pages_dir, ftp_geojson_dir, ftp_compressed_dir,
+                  divisions, tolerance, manifest, force=False):
+    """Split one layer for GitHub Pages and write its full-resolution FTP copies.
+
+    Skipped entirely when the input file and settings match the last build
+    and none of the outputs were touched since.
+    """
+    filename = os.path.basename(input_path)
+    ftp_geojson = os.path.join(ftp_geojson_dir, filename)
+    ftp_compressed = os.path.join(ftp_compressed_dir, os.path.splitext(filename)[0] + '.json.gz')
+    index_path = os.path.join(gh_pages_dir, f"{name_prefix}_index.json")
+    
+    layer_key = f'layer:{index_path}'
+    layer_hash = hash_json([REGION_FORMAT, hash_file(input_path), divisions, tolerance])
+    if not force and is_fresh(manifest, layer_key, layer_hash):
+        print(f"{input_path} is unchanged since the last build, keeping its regions")
+        return
+    
+    # Geometries and properties come from the binary geometry cache, which
+    # is only rebuilt (one json.load) when the GeoJSON changed
+    with instrument.stage('load', inputs=[input_path]):
+        layer = geometry_cache.open_layer(input_path)
+        geojson_data = {'type': 'FeatureCollection', 'features': geometry_cache.records(layer)}
+        geometries = geometry_cache.geometries(layer)
+    
+    # Create optimized version for GitHub Pages
+    print("Creating optimized version for GitHub Pages...")
+    with instrument.stage('split') as stage:
+        region_index = split_and_optimize_geojson(
+            geojson_data,
+            gh_pages_dir,
+            name_prefix,
+            divisions=divisions,
+            tolerance=tolerance,
+            manifest=manifest,
+            force=force,
+            geometries=geometries
+        )
+        region_files = [os.path.join(gh_pages_dir, entry['filename']) for entry in region_index['metadata']['files']]
+        for path in region_files + [index_path]:
+            stage.add_output(path)
+    
+    # Create full-resolution versions for FTP: the original file as is, and gzipped
+    print("Creating full-resolution versions for FTP...")
+    with instrument.stage('ftp_copies', outputs=[ftp_geojson, ftp_compressed]):
+        copy_if_changed(input_path, ftp_geojson)
+        with open(input_path, 'rb') as src, gzip.GzipFile(ftp_compressed, 'wb', mtime=0) as dst:
+            shutil.copyfileobj(src, dst)
+    
+    record(manifest, layer_key, layer_hash, region_files + [index_path, ftp_geojson, ftp_compressed])
+
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Split county/precinct GeoJSON into compressed regions')
+    parser.add_argument('--county-divisions', type=int, default=2,
+                        help='Grid size for counties, e.g. 2 for 2x2 regions (default: 2)')
+    parser.add_argument('--precinct-divisions', type=int, default=3,
+                        help='Grid size for precincts, e.g. 8 for 8x8 regions (default: 3)')
+    parser.add_argument('--force', action='store_true',
+                        help='Rebuild every region even if the build manifest says it is up to date')
+    parser.add_argument('--input-dir',
+                        help='Directory with nc_counties.geojson and nc_precincts_enhanced_2024.geojson '
+                             '(default: docs/data)')
+    instrument.add_arguments(parser)
+    args = parser.parse_args()
+    
     try:
         print("\nStarting GeoJSON optimization...")
         
         # Set up directories
-        base_dir = os.path.dirname(os.path.dirname(__file__))
+        base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
         docs_dir = os.path.join(base_dir, 'docs')
         data_dir = os.path.join(docs_dir, 'data')
+        input_dir = os.path.abspath(args.input_dir) if args.input_dir else data_dir
         gh_pages_dir = ensure_directory(os.path.join(data_dir, 'gh-pages'))
         
         # Create FTP directories
@@ -205,76 +316,54 @@ For web deployment, use the optimized versions in /docs/data/gh-pages/
     with open(os.path.join(ftp_dir, 'README.md'), 'w') as f:
         f.write(readme_content)
     
-    # Process counties
-    print("\nProcessing counties...")
-    with open(os.path.join(data_dir, 'nc_counties.geojson'), 'r') as f:
-        counties_data = json.load(f)
-    
-    # Create optimized version for GitHub Pages
-    print("Creating optimized version for GitHub Pages...")
-    counties_index = split_and_optimize_geojson(
-        counties_data,
-        gh_pages_dir,
-        'counties',
-        divisions=2,  # Split into 4 regions (2x2)
-        tolerance=0.001  # More aggressive simplification
-    )
-    
-    # Create full-resolution versions for FTP
-    print("Creating full-resolution versions for FTP...")
-    # Save uncompressed GeoJSON
-    with open(os.path.join(ftp_geojson_dir, 'nc_counties.geojson'), 'w') as f:
-        json.dump(counties_data, f)
-    # Save compressed version
-    with gzip.open(os.path.join(ftp_compressed_dir, 'nc_counties.json.gz'), 'wt') as f:
-        json.dump(counties_data, f)
-    
-    # Process precincts
-    print("\nProcessing precincts...")
-    with open(os.path.join(data_dir, 'nc_precincts_enhanced_2024.geojson'), 'r') as f:
-        precincts_data = json.load(f)
-    
-    # Create optimized version for GitHub Pages
-    print("Creating optimized version for GitHub Pages...")
-    precincts_index = split_and_optimize_geojson(
-        precincts_data,
-        gh_pages_dir,
-        'precincts',
-        divisions=3,  # Split into 9 regions (3x3)
-        tolerance=0.0005  # More aggressive simplification
-    )
-    
-    # Create full-resolution versions for FTP
-    print("Creating full-resolution versions for FTP...")
-    # Save uncompressed GeoJSON
-    with open(os.path.join(ftp_geojson_dir, 'nc_precincts_enhanced_2024.geojson'), 'w') as f:
-        json.dump(precincts_data, f)
-    # Save compressed version
-    with gzip.open(os.path.join(ftp_compressed_dir, 'nc_precincts_enhanced_2024.json.gz'), 'wt') as f:
-        json.dump(precincts_data, f)
-    
-    print("\nOptimization complete!")
-    print("\nGitHub Pages files (optimized and split):")
-    print(f"  {gh_pages_dir}")
-    
-    print("\nFTP Server files (full resolution):")
-    print(f"  Uncompressed GeoJSON: {ftp_geojson_dir}")
-    print(f"  Compressed GeoJSON:   {ftp_compressed_dir}")
-    
-    # Print file sizes
-    def get_dir_size(path):
-        total = 0
-        for dirpath, _, filenames in os.walk(path):
-            for f in filenames:
-                fp = os.path.join(dirpath, f)
-                total += os.path.getsize(fp)
-        return total / (1024 * 1024)  # Convert to MB
-    
-    gh_size = get_dir_size(gh_pages_dir)
-    ftp_uncompressed_size = get_dir_size(ftp_geojson_dir)
-    ftp_compressed_size = get_dir_size(ftp_compressed_dir)
-    
-    print("\nDirectory Sizes:")
-    print(f"  GitHub Pages (optimized): {gh_size:.2f}MB")
-    print(f"  FTP Uncompressed: {ftp_uncompressed_size:.2f}MB")
-    print(f"  FTP Compressed: {ftp_compressed_size:.2f}MB")
+    with instrument.run('optimize_split_geojson', args):
+        manifest = load_manifest(MANIFEST_NAME)
+        
+        # Process counties
+        print("\nProcessing counties...")
+        with instrument.stage('counties'):
+            process_layer(
+                os.path.join(input_dir, 'nc_counties.geojson'), 'counties',
+                gh_pages_dir, ftp_geojson_dir, ftp_compressed_dir,
+                divisions=args.county_divisions,  # 2 -> 4 regions (2x2)
+                tolerance=0.001,  # More aggressive simplification
+                manifest=manifest, force=args.force
+            )
+        
+        # Process precincts
+        print("\nProcessing precincts...")
+        with instrument.stage('precincts'):
+            process_layer(
+                os.path.join(input_dir, 'nc_precincts_enhanced_2024.geojson'), 'precincts',
+                gh_pages_dir, ftp_geojson_dir, ftp_compressed_dir,
+                divisions=args.precinct_divisions,  # 3 -> 9 regions (3x3)
+                tolerance=0.0005,  # More aggressive simplification
+                manifest=manifest, force=args.force
+            )
+        save_manifest(manifest, MANIFEST_NAME)
+        
+        print("\nOptimization complete!")
+        print("\nGitHub Pages files (optimized and split):")
+        print(f"  {gh_pages_dir}")
+        
+        print("\nFTP Server files (full resolution):")
+        print(f"  Uncompressed GeoJSON: {ftp_geojson_dir}")
+        print(f"  Compressed GeoJSON:   {ftp_compressed_dir}")
+        
+        # Print file sizes
+        def get_dir_size(path):
+            total = 0
+            for dirpath, _, filenames in os.walk(path):
+                for f in filenames:
+                    fp = os.path.join(dirpath, f)
+                    total += os.path.getsize(fp)
+            return total / (1024 * 1024)  # Convert to MB
+        
+        gh_size = get_dir_size(gh_pages_dir)
+        ftp_uncompressed_size = get_dir_size(ftp_geojson_dir)
+        ftp_compressed_size = get_dir_size(ftp_compressed_dir)
+        
+        print("\nDirectory Sizes:")
+        print(f"  GitHub Pages (optimized): {gh_size:.2f}MB")
+        print(f"  FTP Uncompressed: {ftp_uncompressed_size:.2f}MB")
+        print(f"  FTP Compressed: {ftp_compressed_size:.2f}MB")
@@ -0,0 +1,321 @@
+"""
+Run the whole build as one dependency graph.
+
+    python scripts/pipeline.py                  every stage, as many at once as there are cores
+    python scripts/pipeline.py deploy           deploy and the stages it depends on
+    python scripts/pipeline.py --list           the graph and what would run
+
+Each stage is one of the build scripts, with the files it reads (inputs), the
+files it writes (outputs) and the stages that must finish first (deps). The
+scripts run as separate processes from the repository root, whatever directory
+the pipeline is started from. A stage starts as soon as its deps are done, so
+independent branches (the CSV cleanup, the geometry splitting and the election
+splitting) run side by side.
+
+After a stage succeeds, its stamp in .build/pipeline/ is set to the time the
+stage started. A stage is skipped when its stamp is newer than every input,
+its own script and the stamps of its deps, and every output exists. A stage
+whose required input file is missing is not run and counts as failed. When a
+stage fails, the stages that depend on it are not started.
+The scripts still use their own build manifests, so a stage that does run
+only redoes the work whose content changed.
+"""
+
+import os
+import sys
+import glob
+import fnmatch
+import time
+import argparse
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import instrument
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STATE_DIR = '.build/pipeline'
+ELECTION_JSON = 'data/nc_statewide_precinct_comprehensive_2008_2024_UPDATED_MERGED.json'
+COUNTIES = 'data/nc_counties.geojson'
+PRECINCTS = 'data/nc_precincts_enhanced_2024.geojson'
+# Statuses that fail the run and block the stages after them
+FAILED = ('failed', 'missing input', 'blocked')
+
+
+def build_stages(csv_dir='data', workers=0):
+    """The stage graph; every path is relative to the repository root.
+
+    'exclude' drops input matches that are another stage's outputs, so the
+    CSVs extract_election_results writes into csv_dir do not make the
+    cleanup stages before it stale again.
+    """
+    csvs = os.path.join(csv_dir, '*.csv')
+    extracted = os.path.join(csv_dir, '*_election_results_only.csv')
+    combined = os.path.join(csv_dir, 'all_full_statistics_combined.csv')
+    return {
+        # Raw CSV cleanup, in place in csv_dir
+        'rename_csvs': {
+            'script': 'rename_csvs.py', 'args': [csv_dir],
+            'inputs': [csvs], 'exclude': [extracted], 'outputs': [], 'deps': []
+        },
+        'delete_empty_files': {
+            'script': 'delete_empty_files.py', 'args': [csv_dir],
+            'inputs': [csvs], 'exclude': [extracted], 'outputs': [], 'deps': ['rename_csvs']
+        },
+        'extract_election_results': {
+            'script': 'extract_election_results.py',
+            'args': ['--input', combined, '--output-dir', csv_dir],
+            'inputs': [combined], 'requires': [combined],
+            'outputs': [extracted, os.path.join(csv_dir, 'csv_stats.json')],
+            'deps': ['delete_empty_files']
+        },
+        # Decides from the row stats extract_election_results records, so it runs after it
+        'cleanup_empty_election_only': {
+            'script': 'cleanup_empty_election_only.py', 'args': [csv_dir],
+            'inputs': [os.path.join(csv_dir, '*_election_only.csv'), extracted], 'outputs': [],
+            'deps': ['extract_election_results']
+        },
+        # Election data, checked by validate_results before anything is built from it
+        'validate_results': {
+            'script': 'validate_results.py', 'args': ['--input', ELECTION_JSON],
+            'inputs': [ELECTION_JSON], 'requires': [ELECTION_JSON],
+            'outputs': ['.build/validation.json'], 'deps': []
+        },
+        'optimize_split_data': {
+            'script': 'optimize_split_data.py', 'args': ['--stream', '--workers', str(workers)],
+            'inputs': [ELECTION_JSON, PRECINCTS], 'requires': [ELECTION_JSON, PRECINCTS],
+            'outputs': ['docs/data/elections/election_data_index.json', 'docs/data/nc_precincts.json.gz'],
+            'deps': ['validate_results']
+        },
+        'build_summaries': {
+            'script': 'build_summaries.py', 'args': [],
+            'inputs': [ELECTION_JSON], 'requires': [ELECTION_JSON],
+            'outputs': ['data/summaries/*.json'], 'deps': ['validate_results']
+        },
+        'build_swing': {
+            'script': 'build_swing.py', 'args': [],
+            'inputs': [ELECTION_JSON, COUNTIES], 'requires': [ELECTION_JSON],
+            'outputs': ['data/swing/*.json'], 'deps': ['validate_results']
+        },
+        'build_feature_ids': {
+            'script': 'build_feature_ids.py', 'args': [],
+            'inputs': [ELECTION_JSON, COUNTIES, PRECINCTS], 'requires': [ELECTION_JSON, COUNTIES],
+            'outputs': ['data/feature_ids/feature_ids_index.json'], 'deps': ['validate_results']
+        },
+        # Geometry
+        'build_topojson': {
+            'script': 'build_topojson.py', 'args': ['--levels'],
+            'inputs': [COUNTIES, PRECINCTS], 'requires': [COUNTIES],
+            'outputs': ['data/geometry_levels.json'], 'deps': []
+        },
+        # The map draws its precinct layer from the {z}/{x}/{y}.pbf directory
+        'build_vector_tiles': {
+            'script': 'build_vector_tiles.py', 'args': ['--tile-dir', 'data/tiles'],
+            'inputs': [COUNTIES, PRECINCTS], 'requires': [COUNTIES, PRECINCTS],
+            'outputs': ['data/tiles/nc_map.pmtiles', 'data/tiles/tiles.json'], 'deps': []
+        },
+        'optimize_split_geojson': {
+            'script': 'optimize_split_geojson.py', 'args': ['--input-dir', 'data'],
+            'inputs': [COUNTIES, PRECINCTS], 'requires': [COUNTIES, PRECINCTS],
+            'outputs': ['docs/data/gh-pages/counties_index.json', 'docs/data/gh-pages/precincts_index.json'],
+            'deps': []
+        },
+        # Site: bundles the outputs above, and syncs into docs/ only after the
+        # splitters have finished writing there
+        'deploy': {
+            'script': 'deploy.py', 'args': [],
+            'inputs': ['index.html', 'styles/*.css', 'scripts/*.js', 'data/*.geojson', 'data/*.topojson',
+                       'data/geometry_levels.json', 'data/summaries/*.json', 'data/swing/*.json',
+                       'data/feature_ids/*.json', 'data/tiles/tiles.json',
+                       'docs/data/elections/election_data_index.json',
+                       'docs/data/elections/election_data_????.json.gz',
+                       'docs/data/elections/election_data_????.blocks'],
+            'outputs': ['docs/index.html', 'docs/asset-manifest.json'],
+            'deps': ['optimize_split_data', 'build_summaries', 'build_swing', 'build_feature_ids',
+                     'build_topojson', 'build_vector_tiles', 'optimize_split_geojson']
+        }
+    }
+
+
+def select(stages, targets):
+    """Names of the targets and everything they depend on, in dependency order.
+
+    Raises ValueError for an unknown stage or a cycle.
+    """
+    order = []
+    visiting = set()
+
+    def visit(name):
+        if name not in stages:
+            raise ValueError(f"Unknown stage: {name}")
+        if name in order:
+            return
+        if name in visiting:
+            raise ValueError(f"Dependency cycle through {name}")
+        visiting.add(name)
+        for dep in stages[name]['deps']:
+            visit(dep)
+        visiting.discard(name)
+        order.append(name)
+
+    for name in targets or stages:
+        visit(name)
+    return order
+
+
+def stamp_path(name):
+    return os.path.join(STATE_DIR, name + '.stamp')
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except FileNotFoundError:
+        return None
+
+
+def newest_input(stage, deps):
+    """Latest modification time among a stage's inputs, its script and its deps' stamps"""
+    paths = [path for pattern in stage['inputs'] for path in glob.glob(pattern)
+             if not any(fnmatch.fnmatch(path, exclude) for exclude in stage.get('exclude', []))]
+    paths.append(os.path.join('scripts', stage['script']))
+    paths += [stamp_path(dep) for dep in deps]
+    times = [t for t in map(_mtime, paths) if t is not None]
+    return max(times, default=0)
+
+
+def is_up_to_date(name, stage):
+    stamp = _mtime(stamp_path(name))
+    if stamp is None:
+        return False
+    if any(not glob.glob(pattern) for pattern in stage['outputs']):
+        return False
+    return newest_input(stage, stage['deps']) <= stamp
+
+
+def run_stage(name, stage, env):
+    """Run one stage's script; (return code, combined output, seconds)"""
+    command = [sys.executable, os.path.join('scripts', stage['script'])] + stage['args']
+    started = time.time()
+    result = subprocess.run(command, cwd=ROOT, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                            text=True, encoding='utf-8', errors='replace')
+    if result.returncode == 0:
+        os.makedirs(STATE_DIR, exist_ok=True)
+        with open(stamp_path(name), 'w') as f:
+            f.write(' '.join(command) + '\n')
+        # Stamp the start time, so inputs edited while the stage ran are seen as newer
+        os.utime(stamp_path(name), (started, started))
+    return result.returncode, result.stdout, time.time() - started
+
+
+def run_pipeline(stages, targets=None, jobs=None, force=False, dry_run=False, env=None):
+    """Run the selected stages as their deps finish; {name: status} in dependency order.
+
+    Status is one of 'ran', 'failed', 'up to date', 'missing input' (a failure),
+    'blocked' (a dep failed) or, with dry_run, 'would run'.
+    """
+    order = select(stages, targets)
+    jobs = jobs or os.cpu_count() or 1
+    status = {}
+    pending = list(order)
+    running = {}
+
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        while pending or running:
+            for name in list(pending):
+                if len(running) >= jobs:
+                    break
+                stage = stages[name]
+                deps = [status.get(dep) for dep in stage['deps']]
+                if any(s in FAILED for s in deps):
+                    status[name] = 'blocked'
+                elif None in deps or 'running' in deps:
+                    continue
+                elif any(not os.path.exists(path) for path in stage.get('requires', [])):
+                    status[name] = 'missing input'
+                    missing = [path for path in stage['requires'] if not os.path.exists(path)]
+                    print(f"[{name}] cannot run without {', '.join(missing)}")
+                elif not force and 'would run' not in deps and is_up_to_date(name, stage):
+                    status[name] = 'up to date'
+                elif dry_run:
+                    status[name] = 'would run'
+                else:
+                    status[name] = 'running'
+                    print(f"[{name}] started")
+                    running[pool.submit(run_stage, name, stage, env)] = name
+                pending.remove(name)
+                if status[name] != 'running':
+                    print(f"[{name}] {status[name]}")
+
+            if not running:
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                returncode, output, seconds = future.result()
+                status[name] = 'ran' if returncode == 0 else 'failed'
+                print(f"[{name}] {'finished' if returncode == 0 else f'failed (exit {returncode})'} in {seconds:.1f}s")
+                for line in output.rstrip().splitlines():
+                    print(f"    {line}")
+
+    return {name: status[name] for name in order}
+
+
+def print_graph(stages, order):
+    for name in order:
+        stage = stages[name]
+        state = 'up to date' if is_up_to_date(name, stage) else 'stale'
+        if any(not os.path.exists(path) for path in stage.get('requires', [])):
+            state = 'missing input'
+        deps = ', '.join(stage['deps']) or '-'
+        print(f"  {name:<30} {state:<14} after: {deps}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the build scripts as a dependency graph, skipping up-to-date stages')
+    parser.add_argument('targets', nargs='*',
+                        help='Stages to build, with everything they depend on (default: all)')
+    parser.add_argument('--jobs', '-j', type=int, default=0,
+                        help='Stages run at once (default: 0 = one per CPU core)')
+    parser.add_argument('--workers', type=int, default=0,
+                        help='Processes for optimize_split_data.py (default: 0 = one per CPU core)')
+    parser.add_argument('--csv-dir', default='data',
+                        help='Directory with the raw statistics CSVs, relative to the repository root (default: data)')
+    parser.add_argument('--force', action='store_true',
+                        help='Run every selected stage even if it is up to date')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='Only print what would run')
+    parser.add_argument('--list', action='store_true',
+                        help='Print the stages, their state and their deps, then exit')
+    instrument.add_arguments(parser)
+    args = parser.parse_args()
+
+    os.chdir(ROOT)
+    stages = build_stages(args.csv_dir, args.workers)
+    try:
+        order = select(stages, args.targets)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.list:
+        print_graph(stages, order)
+        sys.exit(0)
+
+    # Every script reports into the same directory, and the instrumentation
+    # flags apply to each of them
+    env = dict(os.environ)
+    env['PIPELINE_REPORT_DIR'] = os.path.abspath(args.report_dir or instrument.REPORT_DIR)
+    if args.profile:
+        env['PIPELINE_PROFILE'] = '1'
+    if args.trace_memory:
+        env['PIPELINE_TRACE_MEMORY'] = '1'
+
+    with instrument.run('pipeline', args):
+        with instrument.stage('stages') as stage:
+            status = run_pipeline(stages, args.targets, args.jobs, args.force, args.dry_run, env)
+            for name, state in status.items():
+                stage.count(state.replace(' ', '_'))
+
+    print("\nPipeline summary:")
+    for name, state in status.items():
+        print(f"  {name:<30} {state}")
+    if any(state in FAILED for state in status.values()):
+        sys.exit(1)
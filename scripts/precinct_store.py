@@ -0,0 +1,297 @@
+"""
+Columnar, array-backed store for precinct results.
+
+Each year holds one interned table of precinct keys (``ALAMANCE_01_PATTERSON``)
+and one table of counties. Every contest in the year is a set of parallel
+arrays indexed by row: the row's position in the key table plus dem / rep /
+other / total votes. Margin, winner and competitiveness are derived, so they
+are not stored; competitiveness.py recomputes them in bulk. The contest's own
+fields (name, statewide summary) and the candidate names repeated on every
+precinct row are stored once per contest instead.
+
+On disk a store is a single little-endian binary file:
+
+    8 bytes   magic b'NCPSTORE'
+    4 bytes   uint32 length of the JSON header
+    N bytes   JSON header (keys, counties, contests, array offsets), space
+              padded so the array section starts on an 8-byte boundary
+    ...       raw arrays, each starting on an 8-byte boundary
+
+The header's ``arrays`` entries give each array's dtype, byte offset from the
+start of the array section and element count, so any reader (NumPy, or a
+browser DataView) can slice the columns out without parsing anything else.
+"""
+
+import json
+import os
+import argparse
+
+import numpy as np
+
+from json_stream import iter_election_events
+from competitiveness import classify
+import instrument
+
+MAGIC = b'NCPSTORE'
+STORE_VERSION = 2
+
+# Column name in the store -> (source field in the comprehensive JSON, dtype)
+COLUMNS = {
+    'dem_votes': ('dem_votes', '<i4'),
+    'rep_votes': ('rep_votes', '<i4'),
+    'other_votes': ('other_votes', '<i4'),
+    'total_votes': ('total_votes', '<i4'),
+}
+
+# Per-precinct fields that are really per-contest and are kept only once
+CONTEST_LEVEL_FIELDS = ['dem_candidate', 'rep_candidate']
+
+
+def county_from_key(precinct_key):
+    """The county prefix of a precinct key such as ALAMANCE_01_PATTERSON"""
+    return precinct_key.split('_', 1)[0]
+
+
+def _new_contest(contest_type):
+    return {
+        'type': contest_type,
+        'meta': {},
+        'candidates': {},
+        'rows': {name: [] for name in COLUMNS},
+        'keys': [],
+        'counties': [],
+    }
+
+
+def _add_row(contest, precinct_id, precinct_data):
+    contest['keys'].append(precinct_id)
+    contest['counties'].append(precinct_data.get('county') or county_from_key(precinct_id))
+    for name, (field, _) in COLUMNS.items():
+        contest['rows'][name].append(precinct_data.get(field) or 0)
+    for field in CONTEST_LEVEL_FIELDS:
+        if field not in contest['candidates'] and precinct_data.get(field):
+            contest['candidates'][field] = precinct_data[field]
+
+
+def _finish_year(year, raw_contests):
+    """Intern keys/counties for a year and turn row lists into arrays"""
+    keys = sorted({key for contest in raw_contests.values() for key in contest['keys']})
+    key_index = {key: i for i, key in enumerate(keys)}
+
+    key_counties = {}
+    for contest in raw_contests.values():
+        for key, county in zip(contest['keys'], contest['counties']):
+            key_counties.setdefault(key, county)
+    counties = sorted(set(key_counties.values()))
+    county_index = {county: i for i, county in enumerate(counties)}
+
+    contests = {}
+    for contest_id, contest in raw_contests.items():
+        columns = {
+            name: np.asarray(contest['rows'][name], dtype=dtype)
+            for name, (_, dtype) in COLUMNS.items()
+        }
+        columns['index'] = np.asarray([key_index[key] for key in contest['keys']], dtype='<i4')
+        contests[contest_id] = {
+            'type': contest['type'],
+            'meta': contest['meta'],
+            'candidates': contest['candidates'],
+            'columns': columns,
+        }
+
+    return {
+        'year': year,
+        'keys': keys,
+        'counties': counties,
+        'key_county': np.asarray([county_index[key_counties[key]] for key in keys], dtype='<i2'),
+        'contests': contests,
+    }
+
+
+def build_year_store(year, contests):
+    """Build a store from one year of ``results_by_year`` (already loaded)"""
+    raw_contests = {}
+    for contest_type, contest_data in contests.items():
+        for contest_id, details in contest_data.items():
+            contest = _new_contest(contest_type)
+            for field, value in details.items():
+                if field != 'results':
+                    contest['meta'][field] = value
+            for precinct_id, precinct_data in details.get('results', {}).items():
+                _add_row(contest, precinct_id, precinct_data)
+            raw_contests[contest_id] = contest
+    return _finish_year(year, raw_contests)
+
+
+def iter_year_stores(input_file):
+    """Stream the comprehensive JSON and yield one store per year.
+
+    Only the current year's rows are held in memory.
+    """
+    raw_contests = {}
+    contest = None
+    for event in iter_election_events(input_file):
+        kind = event[0]
+        if kind == 'year':
+            raw_contests = {}
+        elif kind == 'contest':
+            contest = _new_contest(event[1])
+            raw_contests[event[2]] = contest
+        elif kind == 'precinct':
+            _add_row(contest, event[1], event[2])
+        elif kind == 'field':
+            contest['meta'][event[1]] = event[2]
+        elif kind == 'end_year':
+            yield _finish_year(event[1], raw_contests)
+
+
+def contest_counties(store, contest_id):
+    """County name for every row of a contest"""
+    columns = store['contests'][contest_id]['columns']
+    county_codes = store['key_county'][columns['index']]
+    return [store['counties'][code] for code in county_codes]
+
+
+def iter_contest_rows(store, contest_id):
+    """Yield ``(precinct_key, row)`` pairs for a contest, rebuilt from the arrays"""
+    columns = store['contests'][contest_id]['columns']
+    keys = store['keys']
+    counties = store['counties']
+    values = {name: columns[name].tolist() for name in COLUMNS}
+    margin_pct = classify(columns['dem_votes'], columns['rep_votes'])['margin_pct'].tolist()
+    county_codes = store['key_county'][columns['index']].tolist()
+    for row, key_pos in enumerate(columns['index'].tolist()):
+        precinct_data = {'county': counties[county_codes[row]]}
+        for name, (field, _) in COLUMNS.items():
+            precinct_data[field] = values[name][row]
+        precinct_data['margin_pct'] = margin_pct[row]
+        yield keys[key_pos], precinct_data
+
+
+def _align(n):
+    return (n + 7) & ~7
+
+
+def write_store(store, output_file):
+    """Write a store to the compact binary layout"""
+    arrays = [('key_county', store['key_county'])]
+    header_contests = {}
+    for contest_id, contest in store['contests'].items():
+        columns = {}
+        for name, array in contest['columns'].items():
+            array_name = f'{contest_id}/{name}'
+            arrays.append((array_name, array))
+            columns[name] = array_name
+        header_contests[contest_id] = {
+            'type': contest['type'],
+            'meta': contest['meta'],
+            'candidates': contest['candidates'],
+            'rows': int(len(contest['columns']['index'])),
+            'columns': columns,
+        }
+
+    array_entries = {}
+    offset = 0
+    for name, array in arrays:
+        array_entries[name] = {
+            'dtype': array.dtype.str,
+            'offset': offset,
+            'length': int(array.size),
+        }
+        offset = _align(offset + array.nbytes)
+
+    header = json.dumps({
+        'version': STORE_VERSION,
+        'year': store['year'],
+        'keys': store['keys'],
+        'counties': store['counties'],
+        'contests': header_contests,
+        'arrays': array_entries,
+    }, separators=(',', ':')).encode('utf-8')
+    header += b' ' * (_align(len(MAGIC) + 4 + len(header)) - len(MAGIC) - 4 - len(header))
+
+    output_dir = os.path.dirname(output_file)
+    if output_dir and not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    with open(output_file, 'wb') as f:
+        f.write(MAGIC)
+        f.write(len(header).to_bytes(4, 'little'))
+        f.write(header)
+        for name, array in arrays:
+            data = array.tobytes()
+            f.write(data)
+            f.write(b'\0' * (_align(len(data)) - len(data)))
+
+
+def read_store(input_file, mmap=True):
+    """Read a store written by write_store.
+
+    With ``mmap=True`` the columns are memory-mapped views into the file, so
+    opening a store only parses the header.
+    """
+    with open(input_file, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"Not a precinct store: {input_file}")
+        header_length = int.from_bytes(f.read(4), 'little')
+        header = json.loads(f.read(header_length).decode('utf-8'))
+        if header['version'] != STORE_VERSION:
+            raise ValueError(f"Unsupported precinct store version {header['version']} in {input_file}")
+        data_start = len(MAGIC) + 4 + header_length
+        if mmap and os.path.getsize(input_file) > data_start:
+            raw = np.memmap(input_file, dtype=np.uint8, mode='r', offset=data_start)
+        else:
+            raw = np.frombuffer(f.read(), dtype=np.uint8)
+
+    def load(name):
+        entry = header['arrays'][name]
+        dtype = np.dtype(entry['dtype'])
+        start = entry['offset']
+        return raw[start:start + entry['length'] * dtype.itemsize].view(dtype)
+
+    contests = {}
+    for contest_id, contest in header['contests'].items():
+        contests[contest_id] = {
+            'type': contest['type'],
+            'meta': contest['meta'],
+            'candidates': contest['candidates'],
+            'columns': {name: load(array_name) for name, array_name in contest['columns'].items()},
+        }
+
+    return {
+        'year': header['year'],
+        'keys': header['keys'],
+        'counties': header['counties'],
+        'key_county': load('key_county'),
+        'contests': contests,
+    }
+
+
+def store_path(store_dir, year):
+    return os.path.join(store_dir, f'precinct_store_{year}.bin')
+
+
+def build_stores(input_file, output_dir):
+    """Convert the comprehensive precinct JSON into one store file per year"""
+    print(f"Streaming data from {input_file}...")
+    written = []
+    for store in iter_year_stores(input_file):
+        output_file = store_path(output_dir, store['year'])
+        write_store(store, output_file)
+        rows = sum(len(c['columns']['index']) for c in store['contests'].values())
+        print(f"- {os.path.basename(output_file)}: {len(store['contests'])} contests, "
+              f"{rows} rows, {os.path.getsize(output_file) / 1024:.1f} KB")
+        written.append(output_file)
+    return written
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build columnar precinct stores from the comprehensive JSON')
+    parser.add_argument('--input', default='data/nc_statewide_precinct_comprehensive_2008_2024_UPDATED_MERGED.json')
+    parser.add_argument('--output-dir', default='data/stores')
+    instrument.add_arguments(parser)
+    args = parser.parse_args()
+
+    with instrument.run('precinct_store', args), \
+            instrument.stage('build_stores', inputs=[args.input], outputs=[args.output_dir]) as stage:
+        stage.count('stores', len(build_stores(args.input, args.output_dir)))
@@ -0,0 +1,369 @@
+"""
+Small HTTP query server over the per-year split files from optimize_split_data.py.
+
+    GET /index                                   the split index
+    GET /contest/{year}/{contest_id}             one contest (meta + precinct rows)
+        ?county=WAKE[,DURHAM]                    only rows from these counties
+        &fields=d,r                              only these row fields (d, r, c)
+    GET /summary/{year}                          statewide and county totals per contest
+
+A contest is read from its own block in the year's .blocks file, so one
+request decompresses only that contest (split output without .blocks files
+falls back to parsing the whole year file once). Dictionary-encoded (2.0)
+files are decoded with the year's dictionary block, read once per year file. Summaries parse the year
+file once. Decoded contests live in an LRU cache, and finished
+responses (including their gzip-encoded form) in a second LRU keyed by the
+request. Every response carries an ETag (its gzip-encoded form a different
+one), and a matching If-None-Match gets a 304. Cache entries are tied to the
+modification time and size of the index and year files, so rebuilding the
+split files is picked up without a restart.
+
+Uses only the standard library (ThreadingHTTPServer).
+"""
+
+import os
+import json
+import gzip
+import hashlib
+import argparse
+import threading
+from collections import OrderedDict
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+
+from split_reader import read_block, schema_version, precinct_keys, decode_contest, decode_year
+
+DEFAULT_DATA_DIR = 'docs/data/elections'
+ROW_FIELDS = ('d', 'r', 'c')
+
+
+class LRUCache:
+    """Thread-safe least-recently-used cache"""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            if key in self.items:
+                self.items.move_to_end(key)
+                self.hits += 1
+                return self.items[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        with self.lock:
+            self.items[key] = value
+            self.items.move_to_end(key)
+            while len(self.items) > self.capacity:
+                self.items.popitem(last=False)
+
+
+class SplitData:
+    """Decoded contests from the split files, loaded on demand"""
+
+    def __init__(self, data_dir, cache_size=64):
+        self.data_dir = data_dir
+        self.contests = LRUCache(cache_size)
+        # (dictionary, precinct keys) of each 2.0 year file version
+        self.dictionaries = LRUCache(16)
+        # One lock per year file so concurrent misses parse it only once
+        self.year_locks = {}
+        self.year_locks_lock = threading.Lock()
+        self._index = (None, None)
+
+    def index_path(self):
+        return os.path.join(self.data_dir, 'election_data_index.json')
+
+    def index_version(self):
+        """Identifies the current content of the index file (None if it does not exist)"""
+        try:
+            stat = os.stat(self.index_path())
+        except FileNotFoundError:
+            return None
+        return f'{stat.st_mtime_ns}-{stat.st_size}'
+
+    def index(self):
+        """The split index, re-read only when the file changes"""
+        version = self.index_version()
+        if version is None:
+            raise FileNotFoundError(f'{self.index_path()} not found')
+        if self._index[0] != version:
+            with open(self.index_path(), 'r', encoding='utf-8') as f:
+                self._index = (version, json.load(f))
+        return self._index[1]
+
+    def year_path(self, year):
+        return os.path.join(self.data_dir, f'election_data_{year}.json.gz')
+
+    def version(self, year):
+        """Identifies the current content of a year file (None if it does not exist)"""
+        if not year.isdigit():
+            return None
+        try:
+            stat = os.stat(self.year_path(year))
+        except FileNotFoundError:
+            return None
+        return f'{stat.st_mtime_ns}-{stat.st_size}'
+
+    def _year_lock(self, year):
+        with self.year_locks_lock:
+            return self.year_locks.setdefault(year, threading.Lock())
+
+    def contest(self, year, contest_id):
+        """One decoded contest, or None if the year or contest does not exist"""
+        version = self.version(year)
+        if version is None:
+            return None
+        key = (year, version, contest_id)
+        contest = self.contests.get(key)
+        if contest is not None:
+            return contest
+        ids = self.contests.get((year, version, None))
+        if ids is not None and contest_id not in ids:
+            return None
+        with self._year_lock(year):
+            contest = self.contests.get(key)
+            if contest is None:
+                contest = self._load_contest(year, version, contest_id)
+        return contest
+
+    def _load_contest(self, year, version, contest_id):
+        """Read one contest from its block, or from the whole year file when there are no blocks"""
+        blocks = self.index()['years'].get(year, {}).get('blocks')
+        if blocks is None:
+            return self._load_year(year, version).get(contest_id)
+        if contest_id not in blocks['offsets']:
+            return None
+        offset, size = blocks['offsets'][contest_id]
+        contest = read_block(os.path.join(self.data_dir, blocks['file']), offset, size)
+        if schema_version(self.index()) >= 2:
+            dictionary, keys = self._dictionary(year, version, blocks)
+            contest = decode_contest(contest, dictionary, keys)
+        self.contests.put((year, version, contest_id), contest)
+        return contest
+
+    def _dictionary(self, year, version, blocks):
+        entry = self.dictionaries.get((year, version))
+        if entry is None:
+            offset, size = blocks['dictionary']
+            dictionary = read_block(os.path.join(self.data_dir, blocks['file']), offset, size)
+            entry = (dictionary, precinct_keys(dictionary))
+            self.dictionaries.put((year, version), entry)
+        return entry
+
+    def year_contests(self, year):
+        """All contests of a year as {contest_id: contest}, or None if the year does not exist.
+
+        Served from the cache when every contest is still in it; otherwise
+        the year file is parsed once more.
+        """
+        version = self.version(year)
+        if version is None:
+            return None
+        with self._year_lock(year):
+            ids = self.contests.get((year, version, None))
+            if ids is not None:
+                contests = {contest_id: self.contests.get((year, version, contest_id)) for contest_id in ids}
+                if all(contest is not None for contest in contests.values()):
+                    return contests
+            return self._load_year(year, version)
+
+    def _load_year(self, year, version):
+        """Parse a year file and cache each contest; the one gzip decode per year version"""
+        with gzip.open(self.year_path(year), 'rt', encoding='utf-8') as f:
+            contests = decode_year(json.load(f))
+        for contest_id, contest in contests.items():
+            self.contests.put((year, version, contest_id), contest)
+        self.contests.put((year, version, None), list(contests))
+        return contests
+
+
+def select_rows(results, counties=None, fields=None):
+    """Filter precinct rows by county and keep only the requested fields"""
+    if counties:
+        results = {key: row for key, row in results.items() if row.get('c', '').upper() in counties}
+    if fields:
+        results = {key: {field: row[field] for field in fields if field in row} for key, row in results.items()}
+    return results
+
+
+def summarize_contest(contest):
+    """Statewide and per-county dem/rep totals for one contest"""
+    counties = {}
+    dem = rep = 0
+    for row in contest['results'].values():
+        county = counties.setdefault(row.get('c', ''), {'d': 0, 'r': 0, 'precincts': 0})
+        county['d'] += row.get('d', 0)
+        county['r'] += row.get('r', 0)
+        county['precincts'] += 1
+        dem += row.get('d', 0)
+        rep += row.get('r', 0)
+    return {
+        'type': contest.get('type'),
+        'meta': contest.get('meta', {}),
+        'statewide': {'d': dem, 'r': rep, 'precincts': len(contest['results'])},
+        'counties': counties
+    }
+
+
+class Response:
+    """An encoded response body with its ETag and lazily gzipped copy"""
+
+    def __init__(self, status, payload):
+        self.status = status
+        self.body = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+        self.digest = hashlib.sha1(self.body).hexdigest()
+        self._gzipped = None
+
+    def etag(self, gzipped=False):
+        """Strong ETag of the identity or gzip-encoded body, which are different representations"""
+        return f'"{self.digest}-gzip"' if gzipped else f'"{self.digest}"'
+
+    def gzipped(self):
+        if self._gzipped is None:
+            self._gzipped = gzip.compress(self.body, 6, mtime=0)
+        return self._gzipped
+
+
+def accepts_gzip(header):
+    """True when an Accept-Encoding header allows gzip (directly or through '*') with a q-value above 0"""
+    qualities = {}
+    for part in (header or '').split(','):
+        coding, *params = [piece.strip() for piece in part.split(';')]
+        if not coding:
+            continue
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[coding.lower()] = quality
+    quality = qualities.get('gzip', qualities.get('x-gzip', qualities.get('*', 0.0)))
+    return quality > 0
+
+
+def route(data, path, query):
+    """(status, payload) for a request path; payloads are JSON-serializable"""
+    parts = [part for part in path.split('/') if part]
+    if parts == ['index']:
+        return 200, data.index()
+    if len(parts) == 3 and parts[0] == 'contest':
+        _, year, contest_id = parts
+        contest = data.contest(year, contest_id)
+        if contest is None:
+            return 404, {'error': f'No contest {contest_id} in {year}'}
+        counties = {c.strip().upper() for value in query.get('county', []) for c in value.split(',') if c.strip()}
+        fields = [f.strip() for value in query.get('fields', []) for f in value.split(',') if f.strip() in ROW_FIELDS]
+        return 200, {
+            'year': year,
+            'contest': contest_id,
+            'type': contest.get('type'),
+            'meta': contest.get('meta', {}),
+            'results': select_rows(contest['results'], counties, fields)
+        }
+    if len(parts) == 2 and parts[0] == 'summary':
+        year = parts[1]
+        contests = data.year_contests(year)
+        if contests is None:
+            return 404, {'error': f'No data for {year}'}
+        return 200, {
+            'year': year,
+            'contests': {contest_id: summarize_contest(contest) for contest_id, contest in contests.items()}
+        }
+    return 404, {'error': f'Unknown path {path}'}
+
+
+def make_handler(data, responses):
+    class QueryHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            url = urlsplit(self.path)
+            parts = [part for part in url.path.split('/') if part]
+            # Responses are keyed by the index and year file versions, so rebuilt files never serve stale data
+            version = data.version(parts[1]) if len(parts) > 1 else None
+            cache_key = (url.path, url.query, data.index_version(), version)
+            response = responses.get(cache_key)
+            if response is None:
+                try:
+                    status, payload = route(data, url.path, parse_qs(url.query))
+                except (OSError, ValueError) as e:
+                    status, payload = 500, {'error': str(e)}
+                response = Response(status, payload)
+                if status == 200:
+                    responses.put(cache_key, response)
+            self.send(response)
+
+        def send(self, response):
+            use_gzip = accepts_gzip(self.headers.get('Accept-Encoding'))
+            etag = response.etag(use_gzip)
+            if response.status == 200 and self.headers.get('If-None-Match') == etag:
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.send_header('Vary', 'Accept-Encoding')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            body = response.body
+            if use_gzip:
+                body = response.gzipped()
+            self.send_response(response.status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', 'no-cache')
+            self.send_header('Vary', 'Accept-Encoding')
+            self.send_header('Access-Control-Allow-Origin', '*')
+            if use_gzip:
+                self.send_header('Content-Encoding', 'gzip')
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return QueryHandler
+
+
+class QueryServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Room for a few hundred clients connecting at once
+    request_queue_size = 1024
+
+
+def make_server(data_dir=DEFAULT_DATA_DIR, host='127.0.0.1', port=8000, cache_size=64, response_cache_size=512):
+    data = SplitData(data_dir, cache_size)
+    responses = LRUCache(response_cache_size)
+    server = QueryServer((host, port), make_handler(data, responses))
+    server.data = data
+    server.responses = responses
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve contest queries from the per-year split files')
+    parser.add_argument('--data-dir', default=DEFAULT_DATA_DIR,
+                        help='Directory with election_data_index.json and the per-year files (default: %(default)s)')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--cache-size', type=int, default=64,
+                        help='Decoded contests kept in memory (default: %(default)s)')
+    parser.add_argument('--response-cache-size', type=int, default=512,
+                        help='Encoded responses kept in memory (default: %(default)s)')
+    args = parser.parse_args()
+
+    server = make_server(args.data_dir, args.host, args.port, args.cache_size, args.response_cache_size)
+    print(f"Serving {args.data_dir} on http://{args.host}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -1,9 +1,21 @@
 import os
+import argparse
 
-folder = '.'
+import instrument
 
-for filename in os.listdir(folder):
-    if filename.endswith('.csv') and ' ' in filename:
-        new_filename = filename.replace(' ', '_')
-        os.rename(os.path.join(folder, filename), os.path.join(folder, new_filename))
-        print(f"Renamed: {filename} -> {new_filename}")
+def rename_csvs(folder='.'):
+    """Replace spaces in CSV file names with underscores"""
+    with instrument.stage('rename') as stage:
+        for filename in os.listdir(folder):
+            if filename.endswith('.csv') and ' ' in filename:
+                new_filename = filename.replace(' ', '_')
+                os.rename(os.path.join(folder, filename), os.path.join(folder, new_filename))
+                print(f"Renamed: {filename} -> {new_filename}")
+                stage.count('renamed')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Replace spaces in CSV file names with underscores')
+    parser.add_argument('folder', nargs='?', default='.', help='Directory with the CSV files (default: current directory)')
+    args = parser.parse_args()
+    with instrument.run('rename_csvs'):
+        rename_csvs(args.folder)
@@ -0,0 +1,142 @@
+"""
+Read contests from the per-year split files written by optimize_split_data.py.
+
+Each year has two files:
+
+    election_data_{year}.json.gz   every contest of the year in one gzip stream
+    election_data_{year}.blocks    each contest as its own gzip member, back to back
+
+``election_data_index.json`` lists the byte range of every contest's member
+under ``years[year]['blocks']['offsets']`` as ``[offset, size]``. Reading one
+contest is then a seek, a read of ``size`` bytes and a small decompression,
+whatever the size of the year. Split output from before the .blocks files
+existed has no ``blocks`` entry; those years fall back to parsing the whole
+year file.
+
+The index ``version`` tells the two schemas of the year files apart:
+
+    1.0  each contest's results are {precinct_key: {'d', 'r', 'c'}}
+    2.0  each year has one dictionary of its counties and precincts:
+
+             {'counties': [county, ...],
+              'precinct_county': [county index of each precinct, ...],
+              'precinct_names': [precinct key without the county prefix, ...],
+              'unprefixed': [precincts whose name is the whole key, ...]}
+
+         and each contest holds parallel arrays instead of a results object:
+         'p' (precinct indexes into the dictionary, each stored as the
+         difference from the previous one), 'd' and 'r'. A precinct
+         key is its county with spaces replaced by '_', then '_', then its
+         name (ALAMANCE + 01_PATTERSON -> ALAMANCE_01_PATTERSON). The
+         dictionary is stored in the year file and as its own block, at
+         ``years[year]['blocks']['dictionary']``.
+
+The readers below return contests in the 1.0 shape ({'type', 'results',
+'meta'}) whatever the schema; decode_contest turns a 2.0 contest into it.
+"""
+
+import os
+import json
+import gzip
+from itertools import accumulate
+
+
+def read_index(data_dir):
+    with open(os.path.join(data_dir, 'election_data_index.json'), 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def schema_version(index):
+    """Major schema version of the split files an index describes (1 or 2)"""
+    return int(str(index.get('version', '1.0')).split('.')[0])
+
+
+def key_prefix(county):
+    """The prefix a county's precinct keys start with"""
+    return county.replace(' ', '_') + '_'
+
+
+def read_block(path, offset, size):
+    """Decode the contest stored in bytes [offset, offset + size) of a .blocks file"""
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        return json.loads(gzip.decompress(f.read(size)))
+
+
+def precinct_keys(dictionary):
+    """Every precinct key of a 2.0 dictionary, in index order"""
+    counties = [key_prefix(county) for county in dictionary['counties']]
+    keys = [counties[county] + name for county, name in zip(dictionary['precinct_county'], dictionary['precinct_names'])]
+    for precinct in dictionary.get('unprefixed', []):
+        keys[precinct] = dictionary['precinct_names'][precinct]
+    return keys
+
+
+def decode_contest(contest, dictionary, keys=None):
+    """A 2.0 contest in the 1.0 shape; pass ``keys`` from precinct_keys when decoding many"""
+    keys = keys or precinct_keys(dictionary)
+    counties = dictionary['counties']
+    precinct_county = dictionary['precinct_county']
+    return {
+        'type': contest['type'],
+        'results': {
+            keys[precinct]: {'d': dem, 'r': rep, 'c': counties[precinct_county[precinct]]}
+            for precinct, dem, rep in zip(accumulate(contest['p']), contest['d'], contest['r'])
+        },
+        'meta': contest['meta']
+    }
+
+
+def decode_year(year_data):
+    """Every contest of a parsed year file as {contest_id: contest} in the 1.0 shape"""
+    if 'dictionary' not in year_data:
+        return year_data['contests']
+    keys = precinct_keys(year_data['dictionary'])
+    return {contest_id: decode_contest(contest, year_data['dictionary'], keys)
+            for contest_id, contest in year_data['contests'].items()}
+
+
+def read_year(data_dir, year, index=None):
+    """Every contest of a year as {contest_id: contest}"""
+    index = index or read_index(data_dir)
+    with gzip.open(os.path.join(data_dir, index['years'][year]['file']), 'rt', encoding='utf-8') as f:
+        return decode_year(json.load(f))
+
+
+def read_dictionary(data_dir, year, index=None):
+    """The county/precinct dictionary of a 2.0 year"""
+    index = index or read_index(data_dir)
+    entry = index['years'][year]
+    blocks = entry.get('blocks')
+    if blocks is None:
+        with gzip.open(os.path.join(data_dir, entry['file']), 'rt', encoding='utf-8') as f:
+            return json.load(f)['dictionary']
+    offset, size = blocks['dictionary']
+    return read_block(os.path.join(data_dir, blocks['file']), offset, size)
+
+
+def read_contest(data_dir, year, contest_id, index=None, dictionary=None):
+    """One contest ({'type', 'results', 'meta'}), or None if the year or contest is not in the index.
+
+    For 2.0 files, pass the year's ``dictionary`` (read_dictionary) to reuse
+    it across calls.
+    """
+    index = index or read_index(data_dir)
+    entry = index['years'].get(year)
+    if entry is None or contest_id not in entry['contests']:
+        return None
+    blocks = entry.get('blocks')
+    if blocks is None:
+        return read_year(data_dir, year, index)[contest_id]
+    offset, size = blocks['offsets'][contest_id]
+    contest = read_block(os.path.join(data_dir, blocks['file']), offset, size)
+    if schema_version(index) < 2:
+        return contest
+    return decode_contest(contest, dictionary or read_dictionary(data_dir, year, index))
+
+
+def contest_range(index, year, contest_id):
+    """(file, offset, size) of one contest's block, e.g. for an HTTP Range request"""
+    blocks = index['years'][year]['blocks']
+    offset, size = blocks['offsets'][contest_id]
+    return blocks['file'], offset, size
@@ -0,0 +1,289 @@
+"""
+Batch validation of the comprehensive precinct JSON.
+
+Each contest's precinct rows are loaded into NumPy columns, and every
+invariant is checked for the whole contest at once:
+
+    total            dem_votes + rep_votes + other_votes == total_votes
+    two_party_total  two_party_total == dem_votes + rep_votes
+    margin           margin == rep_votes - dem_votes
+    margin_pct       margin_pct == margin / two_party_total * 100, to two decimals
+    winner           winner matches the sign of the margin
+    competitiveness  the competitiveness code matches the scale in the file's metadata
+    all_parties      all_parties['DEM'] and ['REP'] equal dem_votes and rep_votes,
+                     and all parties together equal total_votes
+    negative_votes   no vote count is below zero
+    vote_values      every vote count a row carries (the VOTE_FIELDS and each
+                     all_parties entry) is a number, not null, text or NaN
+    statewide        the contest's statewide_summary vote counts equal the sums
+                     of its precinct rows, and its derived fields agree with them
+
+A field that a row does not carry is not checked, and a value that is not a
+number counts as not carried by the other checks. Every violation is reported
+with its year, contest and precinct key (or 'statewide'). The metadata (and
+with it the competitiveness scale) is read before any contest is checked,
+wherever it appears in the file. The script exits
+non-zero when any invariant is violated, so pipeline.py runs it as a gate in
+front of optimize_split_data.py.
+"""
+
+import os
+import json
+import argparse
+from collections import Counter
+
+import numpy as np
+
+from json_stream import iter_election_events
+from competitiveness import classify, scale_from_metadata
+import instrument
+
+VOTE_FIELDS = ['dem_votes', 'rep_votes', 'other_votes', 'total_votes']
+DERIVED_FIELDS = ['two_party_total', 'margin', 'margin_pct']
+
+# Stored percentages are rounded to two decimals; allow one unit of rounding
+# difference between producers
+MARGIN_PCT_TOLERANCE = 0.01 + 1e-9
+
+DEFAULT_REPORT = '.build/validation.json'
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and np.isfinite(value)
+
+
+def _column(values):
+    """Float column with NaN where a row does not carry the field or it is not a number"""
+    return np.array([value if _is_number(value) else np.nan for value in values], dtype=np.float64)
+
+
+def load_columns(results):
+    """Precinct keys and one array per checked field for a contest's results"""
+    keys = list(results)
+    rows = list(results.values())
+    columns = {field: _column([row.get(field) for row in rows]) for field in VOTE_FIELDS + DERIVED_FIELDS}
+    columns['winner'] = np.array([row.get('winner') or '' for row in rows])
+    columns['code'] = np.array([(row.get('competitiveness') or {}).get('code') or '' for row in rows])
+    parties = [row.get('all_parties') or None for row in rows]
+    columns['all_parties_total'] = _column([sum(v for v in p.values() if _is_number(v)) if p else None
+                                            for p in parties])
+    columns['all_parties_dem'] = _column([p.get('DEM') if p else None for p in parties])
+    columns['all_parties_rep'] = _column([p.get('REP') if p else None for p in parties])
+    # Every vote count a row carries that is not a number: row index, value and field
+    bad_rows, bad_values, bad_fields = [], [], []
+    for i, (row, p) in enumerate(zip(rows, parties)):
+        counts = [(field, row[field]) for field in VOTE_FIELDS if field in row]
+        counts += [(f'all_parties.{party}', value) for party, value in (p or {}).items()]
+        for field, value in counts:
+            if not _is_number(value):
+                bad_rows.append(i)
+                bad_values.append(value)
+                bad_fields.append(field)
+    columns['bad_vote_rows'] = np.array(bad_rows, dtype=np.int64)
+    columns['bad_vote_values'] = bad_values
+    columns['bad_vote_fields'] = bad_fields
+    return keys, columns
+
+
+def derive(dem, rep, scale):
+    """Margin fields and competitiveness code for float vote arrays (NaN rows derive nothing)"""
+    present = ~(np.isnan(dem) | np.isnan(rep))
+    derived = classify(np.where(present, dem, 0).astype(np.int64), np.where(present, rep, 0).astype(np.int64), scale)
+    derived['code'] = scale['codes'][derived['category']]
+    derived['present'] = present
+    return derived
+
+
+def _mismatches(stored, expected, tolerance=0):
+    """Row indexes where both values are present and differ by more than ``tolerance``"""
+    with np.errstate(invalid='ignore'):
+        return np.flatnonzero(np.abs(stored - expected) > tolerance)
+
+
+def _label_mismatches(stored, expected, present):
+    """Row indexes where a stored label is set and differs from the derived one"""
+    return np.flatnonzero(present & (stored != '') & (stored != expected))
+
+
+def check_rows(columns, scale):
+    """{check: (row indexes, stored values, expected values)} for the violated precinct invariants"""
+    dem, rep, other, total = (columns[field] for field in VOTE_FIELDS)
+    derived = derive(dem, rep, scale)
+    margin_pct = np.where(derived['present'], derived['margin_pct'], np.nan)
+
+    numeric = {
+        'total': (total, dem + rep + other, 0),
+        'two_party_total': (columns['two_party_total'], dem + rep, 0),
+        'margin': (columns['margin'], rep - dem, 0),
+        'margin_pct': (columns['margin_pct'], margin_pct, MARGIN_PCT_TOLERANCE),
+        'all_parties_dem': (columns['all_parties_dem'], dem, 0),
+        'all_parties_rep': (columns['all_parties_rep'], rep, 0),
+        'all_parties_total': (columns['all_parties_total'], total, 0),
+    }
+    violations = {}
+    for check, (stored, expected, tolerance) in numeric.items():
+        rows = _mismatches(stored, expected, tolerance)
+        if len(rows):
+            violations[check] = (rows, stored[rows], expected[rows])
+
+    for check, field in [('winner', 'winner'), ('competitiveness', 'code')]:
+        rows = _label_mismatches(columns[field], derived[field], derived['present'])
+        if len(rows):
+            violations[check] = (rows, columns[field][rows], derived[field][rows])
+
+    with np.errstate(invalid='ignore'):
+        negative = np.flatnonzero(np.column_stack([dem, rep, other, total]).min(axis=1) < 0)
+    if len(negative):
+        violations['negative_votes'] = (negative, np.fmin(np.fmin(dem, rep), np.fmin(other, total))[negative],
+                                        np.zeros(len(negative)))
+    if len(columns['bad_vote_rows']):
+        violations['vote_values'] = (columns['bad_vote_rows'], columns['bad_vote_values'],
+                                     [f'{field}: a number' for field in columns['bad_vote_fields']])
+    return violations
+
+
+def check_statewide(summary, columns, scale):
+    """[(field, stored, expected)] where the statewide summary disagrees with the precinct rows"""
+    sums = {field: float(np.nansum(columns[field])) for field in VOTE_FIELDS}
+    derived = derive(np.array([sums['dem_votes']]), np.array([sums['rep_votes']]), scale)
+    expected = dict(sums)
+    expected['two_party_total'] = float(derived['two_party_total'][0])
+    expected['margin'] = float(derived['margin'][0])
+    expected['margin_pct'] = float(derived['margin_pct'][0])
+    expected['winner'] = str(derived['winner'][0])
+
+    problems = []
+    for field, value in expected.items():
+        stored = summary.get(field)
+        if stored is None:
+            continue
+        tolerance = MARGIN_PCT_TOLERANCE if field == 'margin_pct' else 0
+        if isinstance(value, str) and stored != value or not isinstance(value, str) and abs(stored - value) > tolerance:
+            problems.append((field, stored, value))
+    return problems
+
+
+def _value(value):
+    """A stored/expected value as plain JSON (ints stay ints)"""
+    if isinstance(value, (np.floating, float)):
+        if np.isnan(value):
+            return None
+        return int(value) if float(value).is_integer() else round(float(value), 4)
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def validate_contest(year, contest_id, details, scale):
+    """Every violation of one contest as report entries"""
+    keys, columns = load_columns(details.get('results', {}))
+    violations = []
+    if keys:
+        for check, (rows, stored, expected) in check_rows(columns, scale).items():
+            violations += [
+                {'year': year, 'contest': contest_id, 'precinct': keys[row], 'check': check,
+                 'stored': _value(s), 'expected': _value(e)}
+                for row, s, e in zip(rows.tolist(), stored, expected)
+            ]
+    summary = details.get('statewide_summary')
+    if summary:
+        violations += [
+            {'year': year, 'contest': contest_id, 'precinct': 'statewide', 'check': f'statewide.{field}',
+             'stored': _value(stored), 'expected': _value(expected)}
+            for field, stored, expected in check_statewide(summary, columns, scale)
+        ]
+    return violations, len(keys)
+
+
+def iter_contests(input_file):
+    """Stream the comprehensive JSON; yields ('metadata', value) and (year, contest_id, details)"""
+    year = None
+    details = None
+    for event in iter_election_events(input_file):
+        kind = event[0]
+        if kind == 'top':
+            if event[1] == 'metadata':
+                yield 'metadata', event[2]
+        elif kind == 'year':
+            year = event[1]
+        elif kind == 'contest':
+            details = {'results': {}}
+        elif kind == 'precinct':
+            details['results'][event[1]] = event[2]
+        elif kind == 'field':
+            details[event[1]] = event[2]
+        elif kind == 'end_contest':
+            yield year, event[2], details
+            details = None
+
+
+def read_metadata(input_file):
+    """The top-level metadata of a comprehensive JSON file, or None.
+
+    Stops reading at the metadata, so this is a separate pass over the whole
+    file only when results_by_year comes first.
+    """
+    for event in iter_election_events(input_file):
+        if event[0] == 'top' and event[1] == 'metadata':
+            return event[2]
+    return None
+
+
+def validate_file(input_file):
+    """Check every contest of a comprehensive JSON file; returns the report"""
+    scale = scale_from_metadata(read_metadata(input_file))
+    violations = []
+    contests = 0
+    precincts = 0
+    for item in iter_contests(input_file):
+        if item[0] == 'metadata':
+            continue
+        year, contest_id, details = item
+        contest_violations, rows = validate_contest(year, contest_id, details, scale)
+        violations += contest_violations
+        contests += 1
+        precincts += rows
+    return {
+        'input': input_file,
+        'contests': contests,
+        'precincts': precincts,
+        'violations': len(violations),
+        'by_check': dict(Counter(v['check'] for v in violations)),
+        'details': violations
+    }
+
+
+def print_report(report, limit=20):
+    print(f"{report['input']}: {report['contests']} contests, {report['precincts']} precinct rows, "
+          f"{report['violations']} violations")
+    for check, count in sorted(report['by_check'].items()):
+        print(f"  {check:<28} {count}")
+    for v in report['details'][:limit]:
+        print(f"  {v['year']} {v['contest']} {v['precinct']}: {v['check']} stored {v['stored']!r}, expected {v['expected']!r}")
+    if report['violations'] > limit:
+        print(f"  ... {report['violations'] - limit} more in the report file")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check the invariants of every precinct row and statewide summary')
+    parser.add_argument('--input', default='data/nc_statewide_precinct_comprehensive_2008_2024_UPDATED_MERGED.json')
+    parser.add_argument('--report', default=DEFAULT_REPORT,
+                        help='JSON file listing every violation (default: %(default)s)')
+    parser.add_argument('--warn-only', action='store_true',
+                        help='Report violations but exit 0')
+    instrument.add_arguments(parser)
+    args = parser.parse_args()
+
+    with instrument.run('validate_results', args):
+        with instrument.stage('validate', inputs=[args.input], outputs=[args.report]) as stage:
+            report = validate_file(args.input)
+            if os.path.dirname(args.report):
+                os.makedirs(os.path.dirname(args.report), exist_ok=True)
+            with open(args.report, 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=2)
+            stage.count('contests', report['contests'])
+            stage.count('violations', report['violations'])
+        print_report(report)
+
+    if report['violations'] and not args.warn_only:
+        raise SystemExit(1)